@@ -0,0 +1,411 @@
+"""The JSON API, version 1, under /api/v1/.
+
+Read-only views of what the HTML pages show, for app and script clients:
+
+    GET /api/v1/timeline                     the current user's home feed
+    GET /api/v1/users?q=...                  user search (see search.py)
+    GET /api/v1/users?ids=1,2,3              many users by id
+    GET /api/v1/users/<id>                   one user
+    GET /api/v1/users/<id>/messages          their messages
+    GET /api/v1/users/<id>/following         who they follow
+    GET /api/v1/users/<id>/followers         who follows them
+    GET /api/v1/users/<id>/likes             messages they've liked
+    GET /api/v1/messages?ids=1,2,3           many messages by id
+    GET /api/v1/messages/search?q=...        message search (messagesearch.py)
+    GET /api/v1/messages/<id>                one message
+    GET /api/v1/trending?window=24h          most liked lately (trending.py)
+
+Lists answer {"data": [...], "next_cursor": ..., "prev_cursor": ...}; pass
+a cursor back as `before` (next) or `after` (prev), as on the HTML pages
+(see pagination.py). Single objects answer {"data": {...}}, and errors
+{"error": "..."}. Everything needs a logged-in session.
+
+`fields=a,b,c` picks which fields each object has (see USER_FIELDS and
+MESSAGE_FIELDS; by default, all of them). Only those columns are
+selected, and rows go straight to dicts (see serialize()) without ORM
+objects being built. A message's `username` and `image_url` are its
+author's; `liked` and `followed` are about the current user.
+"""
+
+from datetime import datetime
+
+from flask import Blueprint, current_app, g, jsonify, request
+from werkzeug.exceptions import (BadRequest, HTTPException, NotFound,
+                                 Unauthorized)
+
+from models import db, User, Message, Follow, Like
+from pagination import paginate
+import edges
+import httpcache
+import messagesearch
+import search
+import timeline
+import trending
+
+bp = Blueprint("api_v1", __name__, url_prefix="/api/v1")
+
+USER_FIELDS = {
+    "id": User.id,
+    "username": User.username,
+    "image_url": User.image_url,
+    "header_image_url": User.header_image_url,
+    "bio": User.bio,
+    "location": User.location,
+    "messages_count": User.messages_count,
+    "following_count": User.following_count,
+    "followers_count": User.followers_count,
+    "likes_count": User.likes_count,
+    "followed": None,
+}
+
+MESSAGE_FIELDS = {
+    "id": Message.id,
+    "text": Message.text,
+    "timestamp": Message.timestamp,
+    "user_id": Message.user_id,
+    "username": User.username,
+    "image_url": User.image_url,
+    "liked": None,
+}
+
+def _iso(value):
+    return value.isoformat() + "Z"
+
+
+def serialize(rows, fields, computed=None):
+    """Dicts of just `fields`, read from result rows by position.
+
+    `computed` maps the fields that aren't columns (like "liked") to a
+    function of the row.
+    """
+
+    if not rows:
+        return []
+
+    computed = {name: get for name, get in (computed or {}).items()
+                if name in fields}
+    names = list(rows[0]._fields)
+    columns = [(name, names.index(name)) for name in fields
+               if name not in computed]
+    dates = [name for name, i in columns if isinstance(rows[0][i], datetime)]
+
+    data = []
+    for row in rows:
+        item = {name: row[i] for name, i in columns}
+        for name in dates:
+            item[name] = _iso(item[name])
+        for name, get in computed.items():
+            item[name] = get(row)
+        data.append(item)
+
+    return data
+
+
+def requested_fields(allowed):
+    """The `fields` asked for, checked against `allowed`; all by default."""
+
+    asked = request.args.get("fields")
+    if not asked:
+        return tuple(allowed)
+
+    fields = tuple(dict.fromkeys(
+        name.strip() for name in asked.split(",") if name.strip()))
+    unknown = [name for name in fields if name not in allowed]
+    if unknown or not fields:
+        raise BadRequest(f"Unknown fields: {', '.join(unknown) or asked}.")
+    return fields
+
+
+def requested_ids():
+    """The `ids` asked for by a batch request, in order."""
+
+    try:
+        ids = [int(id) for id in request.args["ids"].split(",") if id]
+    except ValueError:
+        raise BadRequest("ids must be comma-separated integers.")
+
+    if len(ids) > current_app.config["API_MAX_BATCH"]:
+        raise BadRequest(
+            f"At most {current_app.config['API_MAX_BATCH']} ids at a time.")
+    return list(dict.fromkeys(ids))
+
+
+def _columns(allowed, fields, keys):
+    """Labelled columns for `fields`, plus the `keys` pages are ordered by."""
+
+    names = dict.fromkeys([*keys, *fields])
+    return [allowed[name].label(name) for name in names
+            if allowed[name] is not None]
+
+
+def user_query(fields):
+    return (db.session
+            .query(*_columns(USER_FIELDS, fields, ("id",)))
+            .filter(User.disabled_at.is_(None)))
+
+
+def message_query(fields):
+    # Messages by users being deleted are left out, like the users.
+    return (db.session
+            .query(*_columns(MESSAGE_FIELDS, fields, ("timestamp", "id")))
+            .join(User, User.id == Message.user_id)
+            .filter(User.disabled_at.is_(None)))
+
+
+def users_data(rows, fields):
+    followed = (g.user.following_ids([row.id for row in rows])
+                if "followed" in fields else ())
+    return serialize(rows, fields,
+                     {"followed": lambda row: row.id in followed})
+
+
+def messages_data(rows, fields):
+    liked = (g.user.liked_message_ids(rows)
+             if "liked" in fields else ())
+    return serialize(rows, fields, {"liked": lambda row: row.id in liked})
+
+
+def page_response(page, data):
+    return jsonify(data=data,
+                   next_cursor=page.next_cursor,
+                   prev_cursor=page.prev_cursor)
+
+
+def in_order(rows, ids):
+    by_id = {row.id: row for row in rows}
+    return [by_id[id] for id in ids if id in by_id]
+
+
+def _page_args():
+    return {
+        "before": request.args.get("before"),
+        "after": request.args.get("after"),
+        "per_page": current_app.config["PAGE_SIZE"],
+    }
+
+
+def _get_user(user_id):
+    user = (db.session
+            .query(User.id, User.messages_count)
+            .filter(User.id == user_id)
+            .filter(User.disabled_at.is_(None))
+            .one_or_none())
+    if user is None:
+        raise NotFound("No such user.")
+    return user
+
+
+@bp.before_request
+def require_login():
+    if not g.user:
+        raise Unauthorized("Log in first.")
+
+
+@bp.errorhandler(HTTPException)
+def error_json(error):
+    return jsonify(error=error.description), error.code
+
+
+@bp.get("/timeline")
+def get_timeline():
+    """The current user's home feed, newest first."""
+
+    httpcache.check("api", timeline.feed_version(g.user.id),
+                    request.query_string)
+
+    fields = requested_fields(MESSAGE_FIELDS)
+    page = timeline.get_timeline_keys(
+        g.user,
+        before=request.args.get("before"),
+        after=request.args.get("after"),
+        per_page=current_app.config["FEED_PAGE_SIZE"],
+    )
+
+    # The timestamps let a partitioned messages table skip months.
+    ids = [message_id for _, message_id in page.items]
+    rows = in_order(
+        message_query(fields)
+        .filter(Message.id.in_(ids))
+        .filter(Message.timestamp.in_(
+            {timestamp for timestamp, _ in page.items}))
+        .all(),
+        ids)
+
+    return page_response(page, messages_data(rows, fields))
+
+
+@bp.get("/users")
+def list_users():
+    """Users matching `q` (or everyone), or with `ids`, many at once."""
+
+    fields = requested_fields(USER_FIELDS)
+
+    if "ids" in request.args:
+        ids = requested_ids()
+        rows = in_order(
+            user_query(fields).filter(User.id.in_(ids)).all() if ids else [],
+            ids)
+        return jsonify(data=users_data(rows, fields))
+
+    page = search.search_users(request.args.get("q"), **_page_args(),
+                               columns=_columns(USER_FIELDS, fields, ("id",)))
+    return page_response(page, users_data(page.items, fields))
+
+
+@bp.get("/users/<int:user_id>")
+def show_user(user_id):
+    """One user."""
+
+    fields = requested_fields(USER_FIELDS)
+    rows = user_query(fields).filter(User.id == user_id).all()
+    if not rows:
+        raise NotFound("No such user.")
+
+    return jsonify(data=users_data(rows, fields)[0])
+
+
+@bp.get("/users/<int:user_id>/messages")
+def list_user_messages(user_id):
+    """A user's messages, newest first."""
+
+    user = _get_user(user_id)
+    fields = requested_fields(MESSAGE_FIELDS)
+    page = paginate(
+        message_query(fields).filter(Message.user_id == user.id),
+        (Message.timestamp, Message.id),
+        **_page_args(),
+        windows=(current_app.config["MESSAGE_WINDOWS"]
+                 if user.messages_count > current_app.config["PAGE_SIZE"]
+                 else ()),
+    )
+
+    return page_response(page, messages_data(page.items, fields))
+
+
+@bp.get("/users/<int:user_id>/following")
+def list_following(user_id):
+    """Users this user follows."""
+
+    user = _get_user(user_id)
+    fields = requested_fields(USER_FIELDS)
+    page = paginate(
+        (user_query(fields)
+         .join(Follow, Follow.user_being_followed_id == User.id)
+         .filter(Follow.user_following_id == user.id)),
+        (Follow.user_being_followed_id,),
+        **_page_args(),
+        key=lambda row: (row.id,),
+    )
+
+    rows = page.items
+    if user.id == g.user.id and page.prev_cursor is None:
+        rows = edges.overlay(
+            rows, user.id, edges.FOLLOW,
+            lambda ids: user_query(fields).filter(User.id.in_(ids)).all())
+
+    return page_response(page, users_data(rows, fields))
+
+
+@bp.get("/users/<int:user_id>/followers")
+def list_followers(user_id):
+    """Users following this user."""
+
+    user = _get_user(user_id)
+    fields = requested_fields(USER_FIELDS)
+    page = paginate(
+        (user_query(fields)
+         .join(Follow, Follow.user_following_id == User.id)
+         .filter(Follow.user_being_followed_id == user.id)),
+        (Follow.user_following_id,),
+        **_page_args(),
+        key=lambda row: (row.id,),
+    )
+
+    return page_response(page, users_data(page.items, fields))
+
+
+@bp.get("/users/<int:user_id>/likes")
+def list_likes(user_id):
+    """Messages this user has liked."""
+
+    user = _get_user(user_id)
+    fields = requested_fields(MESSAGE_FIELDS)
+    page = paginate(
+        (message_query(fields)
+         .join(Like, Like.message_id == Message.id)
+         .filter(Like.user_id == user.id)),
+        (Like.message_id,),
+        **_page_args(),
+        key=lambda row: (row.id,),
+    )
+
+    rows = page.items
+    if user.id == g.user.id and page.prev_cursor is None:
+        rows = edges.overlay(
+            rows, user.id, edges.LIKE,
+            lambda ids: message_query(fields)
+            .filter(Message.id.in_(ids)).all())
+
+    return page_response(page, messages_data(rows, fields))
+
+
+@bp.get("/messages")
+def list_messages():
+    """Many messages by `ids`, at once."""
+
+    if "ids" not in request.args:
+        raise BadRequest("ids is required.")
+
+    fields = requested_fields(MESSAGE_FIELDS)
+    ids = requested_ids()
+    rows = in_order(
+        message_query(fields).filter(Message.id.in_(ids)).all() if ids
+        else [],
+        ids)
+
+    return jsonify(data=messages_data(rows, fields))
+
+
+@bp.get("/messages/search")
+def search_messages():
+    """Messages matching `q`, best first."""
+
+    fields = requested_fields(MESSAGE_FIELDS)
+    page = messagesearch.search_keys(request.args.get("q"), **_page_args())
+
+    ids = [message_id for _, message_id in page.items]
+    rows = in_order(
+        message_query(fields).filter(Message.id.in_(ids)).all(), ids)
+
+    return page_response(page, messages_data(rows, fields))
+
+
+@bp.get("/messages/<int:message_id>")
+def show_message(message_id):
+    """One message."""
+
+    fields = requested_fields(MESSAGE_FIELDS)
+    rows = message_query(fields).filter(Message.id == message_id).all()
+    if not rows:
+        raise NotFound("No such message.")
+
+    return jsonify(data=messages_data(rows, fields)[0])
+
+
+@bp.get("/trending")
+def list_trending():
+    """The most liked messages lately, best first."""
+
+    window = request.args.get("window", trending.DEFAULT_WINDOW)
+    if window not in trending.WINDOWS:
+        raise BadRequest(
+            f"window must be one of {', '.join(trending.WINDOWS)}.")
+
+    fields = requested_fields(MESSAGE_FIELDS)
+    rows = trending.trending_query(message_query(fields), window).all()
+
+    return jsonify(data=messages_data(rows, fields))
+
+
+def init_app(app):
+    app.register_blueprint(bp)
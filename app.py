@@ -1,28 +1,193 @@
 import os
+from datetime import datetime, timedelta
+from time import sleep
+
+import click
 from dotenv import load_dotenv
 
-from flask import Flask, render_template, request, flash, redirect, session, g
+from flask import (Flask, render_template, request, flash, redirect, session, g,
+                   jsonify, abort)
 from flask_debugtoolbar import DebugToolbarExtension
 from sqlalchemy.exc import IntegrityError
-from werkzeug.exceptions import Unauthorized
+from sqlalchemy.orm.attributes import set_committed_value
+from werkzeug.exceptions import Forbidden, Unauthorized
+from werkzeug.local import LocalProxy
 
 from forms import UserAddForm, LoginForm, MessageForm, CSRFForm, EditUserForm
-from models import db, connect_db, User, Message
+from models import db, connect_db, follow_checks, User, Message, Follow, Like
+from pagination import paginate
+import api
+import cache
+import counters
+import currentuser
+import deletions
+import edgequeue
+import edges
+import followindex
+import fragments
+import graph
+import httpcache
+import messagesearch
+import partitions
+import passwords
+import poolstats
+import querystats
+import recommendations
+import routing
+import search
+import timeline
+import trending
 
 load_dotenv()
 
-CURR_USER_KEY = "curr_user"
+CURR_USER_KEY = currentuser.USER_KEY
 
 app = Flask(__name__)
 
 app.config['SQLALCHEMY_DATABASE_URI'] = os.environ['DATABASE_URL']
 app.config['SQLALCHEMY_ECHO'] = False
+
+# Each worker's connection pool (see poolstats.py). Set DB_POOLER=1 when
+# connecting through a transaction-mode pooler such as PgBouncer, to leave
+# pooling to it.
+app.config['DB_POOL_SIZE'] = int(os.environ.get('DB_POOL_SIZE', 5))
+app.config['DB_POOL_MAX_OVERFLOW'] = int(
+    os.environ.get('DB_POOL_MAX_OVERFLOW', 10))
+app.config['DB_POOL_TIMEOUT'] = int(os.environ.get('DB_POOL_TIMEOUT', 30))
+app.config['DB_POOL_RECYCLE'] = int(os.environ.get('DB_POOL_RECYCLE', 1800))
+app.config['DB_POOL_PRE_PING'] = bool(
+    int(os.environ.get('DB_POOL_PRE_PING', 1)))
+app.config['DB_POOLER'] = bool(int(os.environ.get('DB_POOLER', 0)))
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = poolstats.engine_options(app.config)
+
+# Read replicas for GET requests, comma separated (see routing.py). Reads
+# skip replicas more than REPLICA_MAX_LAG seconds behind, and stay on the
+# primary for READ_YOUR_WRITES_SECONDS after a browser's last write.
+app.config['SQLALCHEMY_BINDS'] = routing.replica_binds(
+    url for url in os.environ.get('DATABASE_REPLICA_URLS', '').split(',')
+    if url)
+app.config['REPLICA_MAX_LAG'] = int(os.environ.get('REPLICA_MAX_LAG', 5))
+app.config['REPLICA_CHECK_INTERVAL'] = int(
+    os.environ.get('REPLICA_CHECK_INTERVAL', 5))
+app.config['READ_YOUR_WRITES_SECONDS'] = int(
+    os.environ.get('READ_YOUR_WRITES_SECONDS', 10))
 app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
 app.config['SECRET_KEY'] = os.environ['SECRET_KEY']
 toolbar = DebugToolbarExtension(app)
 app.config['FLASK_DEBUG']=False
 
+# Authors with at least this many followers are merged into feeds at read
+# time rather than copied into every follower's timeline.
+app.config['TIMELINE_FANOUT_LIMIT'] = int(
+    os.environ.get('TIMELINE_FANOUT_LIMIT', 10000))
+# How many of a user's recent messages to copy into a new follower's feed.
+app.config['TIMELINE_BACKFILL'] = int(
+    os.environ.get('TIMELINE_BACKFILL', 200))
+
+app.config['FEED_PAGE_SIZE'] = 100
+app.config['PAGE_SIZE'] = 50
+# How far back message lists look before widening the search, so that on a
+# partitioned messages table they read recent months only (see
+# pagination.windowed_keyset_query()).
+app.config['MESSAGE_WINDOWS'] = [
+    timedelta(days=int(days)) for days in
+    os.environ.get('MESSAGE_WINDOW_DAYS', '31,186').split(',')]
+
+# Where users and messages are cached (see cache.py): "local", "memory" or
+# a redis:// URL.
+app.config['CACHE_URL'] = os.environ.get('CACHE_URL', 'local')
+app.config['CACHE_TTL'] = int(os.environ.get('CACHE_TTL', 60))
+app.config['CACHE_MAX_ENTRIES'] = int(
+    os.environ.get('CACHE_MAX_ENTRIES', 10000))
+
+# Rendered message and user cards (see fragments.py), stored like CACHE_URL.
+app.config['FRAGMENT_CACHE'] = bool(int(os.environ.get('FRAGMENT_CACHE', 1)))
+app.config['FRAGMENT_CACHE_URL'] = os.environ.get(
+    'FRAGMENT_CACHE_URL', 'local')
+app.config['FRAGMENT_CACHE_TTL'] = int(
+    os.environ.get('FRAGMENT_CACHE_TTL', 3600))
+app.config['FRAGMENT_CACHE_MAX_ENTRIES'] = int(
+    os.environ.get('FRAGMENT_CACHE_MAX_ENTRIES', 20000))
+
+# How many messages each trending list keeps, and how many minutes of
+# likes are counted together (see trending.py; it should divide 60).
+app.config['TRENDING_SIZE'] = int(os.environ.get('TRENDING_SIZE', 50))
+app.config['TRENDING_BUCKET_MINUTES'] = int(
+    os.environ.get('TRENDING_BUCKET_MINUTES', 5))
+
+# Who-to-follow suggestions (see recommendations.py): how many are kept per
+# user and how many pages show, and how `flask refresh-suggestions --all`
+# splits up the work.
+app.config['SUGGESTIONS_PER_USER'] = int(
+    os.environ.get('SUGGESTIONS_PER_USER', 20))
+app.config['SUGGESTIONS_SHOWN'] = int(os.environ.get('SUGGESTIONS_SHOWN', 5))
+app.config['SUGGESTION_WORKERS'] = int(
+    os.environ.get('SUGGESTION_WORKERS', 4))
+app.config['SUGGESTION_RANGE_SIZE'] = int(
+    os.environ.get('SUGGESTION_RANGE_SIZE', 10000))
+
+# bcrypt cost for new password hashes; older ones are rehashed on login.
+app.config['BCRYPT_LOG_ROUNDS'] = int(os.environ.get('BCRYPT_LOG_ROUNDS', 12))
+# Processes hashing passwords (0: hash in the request thread), and how many
+# more hashes may wait for one before requests get a 503.
+app.config['PASSWORD_HASH_WORKERS'] = int(
+    os.environ.get('PASSWORD_HASH_WORKERS', 2))
+app.config['PASSWORD_HASH_QUEUE'] = int(
+    os.environ.get('PASSWORD_HASH_QUEUE', 8))
+# Where app processes keep the slots those limits are counted in, so the
+# limits hold for the whole host rather than each process.
+app.config['PASSWORD_HASH_SLOTS_PATH'] = os.environ.get(
+    'PASSWORD_HASH_SLOTS_PATH',
+    os.path.join(app.instance_path, 'password-slots'))
+
+# "sync" writes likes and follows in the request; "queue" queues them in a
+# local SQLite file for `flask drain-edges` to write in batches.
+app.config['EDGE_WRITES'] = os.environ.get('EDGE_WRITES', 'sync')
+app.config['EDGE_QUEUE_PATH'] = os.environ.get(
+    'EDGE_QUEUE_PATH', os.path.join(app.instance_path, 'edge-queue.sqlite3'))
+app.config['EDGE_BATCH_SIZE'] = int(os.environ.get('EDGE_BATCH_SIZE', 1000))
+
+# How many rows `flask delete-accounts` deletes per transaction.
+app.config['ACCOUNT_DELETE_BATCH_SIZE'] = int(
+    os.environ.get('ACCOUNT_DELETE_BATCH_SIZE', 1000))
+
+# The most users or messages one /api/v1/ batch request may ask for.
+app.config['API_MAX_BATCH'] = int(os.environ.get('API_MAX_BATCH', 100))
+
+# An in-memory index of the follows table (see graph.py and
+# followindex.py), loaded at startup, and how it keeps up with other
+# processes' follows.
+app.config['FOLLOW_INDEX'] = bool(int(os.environ.get('FOLLOW_INDEX', 0)))
+app.config['FOLLOW_INDEX_POLL_SECONDS'] = float(
+    os.environ.get('FOLLOW_INDEX_POLL_SECONDS', 1))
+app.config['FOLLOW_INDEX_KEEP_HOURS'] = int(
+    os.environ.get('FOLLOW_INDEX_KEEP_HOURS', 24))
+
+# Message search (see messagesearch.py): "postgres", or "sqlite" for an
+# FTS5 index in a local file at MESSAGE_SEARCH_PATH.
+app.config['MESSAGE_SEARCH'] = os.environ.get('MESSAGE_SEARCH', 'postgres')
+app.config['MESSAGE_SEARCH_PATH'] = os.environ.get(
+    'MESSAGE_SEARCH_PATH',
+    os.path.join(app.instance_path, 'message-search.sqlite3'))
+# Only this many of the newest matches are ranked.
+app.config['MESSAGE_SEARCH_CANDIDATES'] = int(
+    os.environ.get('MESSAGE_SEARCH_CANDIDATES', 10000))
+
+# Who can see the /internal/ metrics pages.
+app.config['INTERNAL_ALLOWED_IPS'] = os.environ.get(
+    'INTERNAL_ALLOWED_IPS', '127.0.0.1').split(',')
+
 connect_db(app)
+querystats.init_app(app)
+cache.init_app(app)
+fragments.init_app(app)
+httpcache.init_app(app)
+passwords.init_app(app)
+edgequeue.init_app(app)
+routing.init_app(app, db)
+graph.init_app(app)
+messagesearch.init_app(app)
+api.init_app(app)
 
 
 
@@ -32,32 +197,66 @@ connect_db(app)
 
 @app.before_request
 def add_user_to_g():
-    """If we're logged in, add curr user to Flask global."""
+    """If we're logged in, add curr user to Flask global.
 
-    if CURR_USER_KEY in session:
-        g.user = User.query.get(session[CURR_USER_KEY])
+    It's a currentuser.CurrentUser, which only loads the user from the
+    database when a route or template needs more than the session has.
+    """
+
+    g.user = currentuser.current_user()
+
+
+@app.before_request
+def check_user_can_write():
+    """Before any write, load the logged-in user.
+
+    Routes that only need the user's id don't load them, so this is where
+    a session whose account has been deleted (or disabled, see
+    deletions.py) since logging in is logged out: CurrentUser.get()
+    redirects it to the login page.
+    """
+
+    if g.user and request.method not in routing.READ_METHODS:
+        g.user.get()
+
+
+@app.teardown_request
+def forget_follow_checks(exc):
+    """Don't carry follow checks over to the next request."""
+
+    follow_checks().clear()
+
+
+def get_csrf_form():
+    """The request's CSRF form, made the first time it's asked for."""
+
+    if "_csrf_form" not in g:
+        g._csrf_form = CSRFForm()
+    return g._csrf_form
 
-    else:
-        g.user = None
 
 @app.before_request
 def add_csrf_to_g():
-    """Add csrf to Flask global"""
+    """Add csrf to Flask global.
 
-    g.csrf_form = CSRFForm()
+    The form is only made when something uses it: making one generates a
+    CSRF token, which writes the session cookie.
+    """
+
+    g.pop("_csrf_form", None)
+    g.csrf_form = LocalProxy(get_csrf_form)
 
 
 def do_login(user):
     """Log in user."""
 
-    session[CURR_USER_KEY] = user.id
+    currentuser.login(user)
 
 
 def do_logout():
     """Log out user."""
 
-    if CURR_USER_KEY in session:
-        del session[CURR_USER_KEY]
+    currentuser.logout()
 
 
 @app.route('/signup', methods=["GET", "POST"])
@@ -117,6 +316,8 @@ def login():
         )
 
         if user:
+            # Keeps a rehashed password
+            db.session.commit()
             do_login(user)
             flash(f"Hello, {user.username}!", "success")
             return redirect("/")
@@ -145,25 +346,37 @@ def logout():
 ##############################################################################
 # General user routes:
 
+def get_user_or_404(user_id):
+    """The user with this id, unless there's none or they're being deleted."""
+
+    user = cache.get_user(user_id)
+    if user is None or user.disabled_at is not None:
+        abort(404)
+    return user
+
+
 @app.get('/users')
 def list_users():
     """Page with listing of users.
 
-    Can take a 'q' param in querystring to search by that username.
+    Can take a 'q' param in querystring to search usernames, bios and
+    locations (see search.py).
     """
 
     if not g.user:
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    search = request.args.get('q')
+    page = search.search_users(
+        request.args.get('q'),
+        before=request.args.get('before'),
+        after=request.args.get('after'),
+        per_page=app.config['PAGE_SIZE'],
+    )
+    # For the follow/unfollow buttons, in one query
+    g.user.following_ids(page.items)
 
-    if not search:
-        users = User.query.all()
-    else:
-        users = User.query.filter(User.username.like(f"%{search}%")).all()
-
-    return render_template('users/index.html', users=users)
+    return render_template('users/index.html', users=page.items, page=page)
 
 
 @app.get('/users/<int:user_id>')
@@ -174,9 +387,32 @@ def show_user(user_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    user = User.query.get_or_404(user_id)
-
-    return render_template('users/show.html', user=user)
+    user = get_user_or_404(user_id)
+    httpcache.check(user.id, user.profile_version, user.activity_version,
+                    g.user.profile_version, g.user.activity_version,
+                    request.query_string)
+
+    page = paginate(
+        Message.query.filter(Message.user_id == user.id),
+        (Message.timestamp, Message.id),
+        before=request.args.get('before'),
+        after=request.args.get('after'),
+        per_page=app.config['PAGE_SIZE'],
+        # One unbounded query is cheapest when there's only a page anyway.
+        windows=(app.config['MESSAGE_WINDOWS']
+                 if user.messages_count > app.config['PAGE_SIZE'] else ()),
+    )
+
+    suggestions = (recommendations.suggestions_for(
+        user.id, app.config['SUGGESTIONS_SHOWN'])
+        if user.id == g.user.id else [])
+
+    return render_template('users/show.html',
+                           user=user,
+                           messages=page.items,
+                           liked_ids=g.user.liked_message_ids(page.items),
+                           suggestions=suggestions,
+                           page=page)
 
 
 @app.get('/users/<int:user_id>/following')
@@ -187,8 +423,30 @@ def show_following(user_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    user = User.query.get_or_404(user_id)
-    return render_template('users/following.html', user=user)
+    user = get_user_or_404(user_id)
+    page = paginate(
+        (User
+         .query
+         .join(Follow, Follow.user_being_followed_id == User.id)
+         .filter(Follow.user_following_id == user.id)
+         .filter(User.disabled_at.is_(None))),
+        (Follow.user_being_followed_id,),
+        before=request.args.get('before'),
+        after=request.args.get('after'),
+        per_page=app.config['PAGE_SIZE'],
+        key=lambda followed_user: (followed_user.id,),
+    )
+    users = page.items
+    if user.id == g.user.id and page.prev_cursor is None:
+        users = edges.overlay(
+            users, user.id, edges.FOLLOW,
+            lambda ids: User.query.filter(User.id.in_(ids)).all())
+    g.user.following_ids([user, *users])
+
+    return render_template('users/following.html',
+                           user=user,
+                           users=users,
+                           page=page)
 
 
 @app.get('/users/<int:user_id>/followers')
@@ -199,8 +457,25 @@ def show_followers(user_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    user = User.query.get_or_404(user_id)
-    return render_template('users/followers.html', user=user)
+    user = get_user_or_404(user_id)
+    page = paginate(
+        (User
+         .query
+         .join(Follow, Follow.user_following_id == User.id)
+         .filter(Follow.user_being_followed_id == user.id)
+         .filter(User.disabled_at.is_(None))),
+        (Follow.user_following_id,),
+        before=request.args.get('before'),
+        after=request.args.get('after'),
+        per_page=app.config['PAGE_SIZE'],
+        key=lambda follower: (follower.id,),
+    )
+    g.user.following_ids([user, *page.items])
+
+    return render_template('users/followers.html',
+                           user=user,
+                           users=page.items,
+                           page=page)
 
 
 @app.post('/users/follow/<int:follow_id>')
@@ -216,8 +491,10 @@ def start_following(follow_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    followed_user = User.query.get_or_404(follow_id)
-    g.user.following.append(followed_user)
+    followed_user = get_user_or_404(follow_id)
+    if followed_user.id != g.user.id:
+        edges.follow(g.user.id, followed_user.id)
+
     db.session.commit()
 
     return redirect(f"/users/{g.user.id}/following")
@@ -236,8 +513,10 @@ def stop_following(follow_id):
         return redirect("/")
 
 
-    followed_user = User.query.get_or_404(follow_id)
-    g.user.following.remove(followed_user)
+    followed_user = cache.get_user(follow_id) or abort(404)
+    if followed_user.id != g.user.id:
+        edges.unfollow(g.user.id, followed_user.id)
+
     db.session.commit()
 
 
@@ -252,7 +531,7 @@ def profile():
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    user = g.user
+    user = g.user.get()
 
     form = EditUserForm(obj=user)
 
@@ -268,6 +547,9 @@ def profile():
             user.bio = form.bio.data
             user.location=form.location.data
             db.session.commit()
+
+            # Update the session's copy of the profile for the nav bar
+            do_login(user)
             return redirect(f'/users/{g.user.id}')
 
         else:
@@ -279,7 +561,8 @@ def profile():
 
 @app.post('/users/delete')
 def delete_user():
-    """Delete user.
+    """Delete user: disable their account now, for `flask delete-accounts`
+    to delete in the background (see deletions.py).
 
     Redirect to signup page.
     """
@@ -293,7 +576,7 @@ def delete_user():
 
         do_logout()
 
-        db.session.delete(g.user)
+        deletions.disable(g.user.id)
         db.session.commit()
 
     return redirect("/signup")
@@ -302,10 +585,37 @@ def delete_user():
 def show_likes(user_id):
     """ Show all user liked messages"""
 
-    user = User.query.get(user_id)
+    user = get_user_or_404(user_id)
+    # Ordered by the likes primary key so each page is an index range scan.
+    page = paginate(
+        (Message
+         .query
+         .options(db.joinedload(Message.user))
+         .join(Like, Like.message_id == Message.id)
+         .filter(Like.user_id == user.id)),
+        (Like.message_id,),
+        before=request.args.get('before'),
+        after=request.args.get('after'),
+        per_page=app.config['PAGE_SIZE'],
+        key=lambda msg: (msg.id,),
+    )
+    messages = page.items
+    if g.user and user.id == g.user.id and page.prev_cursor is None:
+        messages = edges.overlay(
+            messages, user.id, edges.LIKE,
+            lambda ids: (Message.query
+                         .options(db.joinedload(Message.user))
+                         .filter(Message.id.in_(ids))
+                         .all()))
+
+    liked_ids = (g.user.liked_message_ids(messages) if g.user
+                 else set())
 
     return render_template("users/likes.html",
-                           user=user)
+                           user=user,
+                           messages=messages,
+                           liked_ids=liked_ids,
+                           page=page)
 
 
 ##############################################################################
@@ -325,8 +635,12 @@ def add_message():
     form = MessageForm()
 
     if form.validate_on_submit():
-        msg = Message(text=form.text.data)
-        g.user.messages.append(msg)
+        msg = Message(text=form.text.data, user_id=g.user.id)
+        db.session.add(msg)
+        db.session.flush()
+        counters.adjust(g.user.id, messages=1)
+        timeline.fan_out_message(msg)
+        messagesearch.message_added(msg)
         db.session.commit()
 
         return redirect(f"/users/{g.user.id}")
@@ -342,8 +656,65 @@ def show_message(message_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    msg = Message.query.get_or_404(message_id)
-    return render_template('messages/show.html', message=msg)
+    msg = cache.get_message(message_id) or abort(404)
+    # The session only holds the author weakly; the message keeps it.
+    set_committed_value(msg, "user", get_user_or_404(msg.user_id))
+    httpcache.check(msg.id, msg.user.profile_version,
+                    msg.user.activity_version, g.user.profile_version,
+                    g.user.activity_version)
+
+    return render_template('messages/show.html',
+                           message=msg,
+                           liked_ids=g.user.liked_message_ids([msg]))
+
+
+@app.get('/trending')
+def show_trending():
+    """Show the most liked messages lately, from the precomputed lists.
+
+    Takes a 'window' param in querystring, one of trending.WINDOWS.
+    """
+
+    if not g.user:
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+
+    window = request.args.get('window', trending.DEFAULT_WINDOW)
+    if window not in trending.WINDOWS:
+        abort(404)
+
+    messages = trending.trending_query(
+        Message.query.options(db.joinedload(Message.user)), window).all()
+
+    return render_template('messages/trending.html',
+                           messages=messages,
+                           liked_ids=g.user.liked_message_ids(messages),
+                           window=window,
+                           windows=trending.WINDOWS)
+
+
+@app.get('/messages/search')
+def search_messages():
+    """Show messages matching the 'q' param in querystring, best first
+    (see messagesearch.py)."""
+
+    if not g.user:
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+
+    q = request.args.get('q', '')
+    page = messagesearch.search_messages(
+        q,
+        before=request.args.get('before'),
+        after=request.args.get('after'),
+        per_page=app.config['PAGE_SIZE'],
+    )
+
+    return render_template('messages/search.html',
+                           messages=page.items,
+                           liked_ids=g.user.liked_message_ids(page.items),
+                           q=q,
+                           page=page)
 
 
 @app.post('/messages/<int:message_id>/delete')
@@ -360,7 +731,10 @@ def delete_message(message_id):
         return redirect("/")
 
 
+    # Timeline entries for this message go with it via ON DELETE CASCADE.
     msg = Message.query.get_or_404(message_id)
+    counters.message_deleted(msg)
+    messagesearch.messages_deleted([msg.id])
     db.session.delete(msg)
     db.session.commit()
 
@@ -379,9 +753,9 @@ def like_message(message_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    message = Message.query.get_or_404(message_id)
+    message = cache.get_message(message_id) or abort(404)
     if message.user_id != g.user.id:
-        g.user.messages_liked.append(message)
+        edges.like(g.user.id, message.id)
 
     db.session.commit()
 
@@ -399,8 +773,8 @@ def unlike_message(message_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    message = Message.query.get_or_404(message_id)
-    g.user.messages_liked.remove(message)
+    message = cache.get_message(message_id) or abort(404)
+    edges.unlike(g.user.id, message.id)
 
     db.session.commit()
 
@@ -418,32 +792,243 @@ def homepage():
     """Show homepage:
 
     - anon users: no messages
-    - logged in: 100 most recent messages of self & followed_users
+    - logged in: most recent messages of self & followed_users, a page
+      at a time
     """
 
     if g.user:
-        user= g.user
-        following_ids = [followed.id for followed in user.following]
-        messages = (Message
-                    .query
-                    .filter(
-                        (Message.user_id == user.id) |
-                        (Message.user_id.in_(following_ids))
-                    )
-                    .order_by(Message.timestamp.desc())
-                    .limit(100)
-                    .all())
-
-        return render_template('home.html', messages=messages)
+        httpcache.check(timeline.feed_version(g.user.id),
+                        request.query_string)
+
+        page = timeline.get_timeline(
+            g.user,
+            before=request.args.get('before'),
+            after=request.args.get('after'),
+            per_page=app.config['FEED_PAGE_SIZE'],
+        )
+
+        return render_template('home.html',
+                               messages=page.items,
+                               liked_ids=g.user.liked_message_ids(page.items),
+                               suggestions=recommendations.suggestions_for(
+                                   g.user.id, app.config['SUGGESTIONS_SHOWN']),
+                               page=page)
 
     else:
+        httpcache.check("home-anon", public=True, max_age=300)
         return render_template('home-anon.html')
 
 
-@app.after_request
-def add_header(response):
-    """Add non-caching headers on every request."""
+##############################################################################
+# Maintenance commands
+
+
+@app.cli.command("drain-edges")
+@click.option("--forever", is_flag=True,
+              help="keep draining, waiting --interval seconds when idle")
+@click.option("--interval", default=1.0, show_default=True)
+def drain_edges(forever, interval):
+    """Write queued likes and follows (see edges.py)."""
+
+    while True:
+        taken, changed = edges.drain(app.config['EDGE_BATCH_SIZE'])
+        if taken:
+            print(f"Applied {taken} queued changes: {dict(changed)}")
+        elif forever:
+            sleep(interval)
+        else:
+            break
+
+
+@app.cli.command("delete-accounts")
+@click.option("--forever", is_flag=True,
+              help="keep deleting, waiting --interval seconds when idle")
+@click.option("--interval", default=1.0, show_default=True)
+def delete_accounts(forever, interval):
+    """Delete disabled accounts, a batch at a time (see deletions.py)."""
+
+    while True:
+        deleted = deletions.step(app.config['ACCOUNT_DELETE_BATCH_SIZE'])
+        if deleted:
+            user_id, what, count = deleted
+            print(f"User #{user_id}: deleted {count} {what}")
+        elif forever:
+            sleep(interval)
+        else:
+            break
+
+
+@app.cli.command("refresh-trending")
+@click.option("--forever", is_flag=True,
+              help="keep refreshing, every --interval seconds")
+@click.option("--interval", default=60.0, show_default=True)
+def refresh_trending(forever, interval):
+    """Recompute the trending lists (see trending.py)."""
+
+    while True:
+        trending.refresh(app.config['TRENDING_SIZE'])
+        db.session.commit()
+        if not forever:
+            break
+        sleep(interval)
+
+
+@app.cli.command("refresh-suggestions")
+@click.option("--all", "everyone", is_flag=True,
+              help="rebuild everyone's from the whole follows graph")
+@click.option("--forever", is_flag=True,
+              help="keep refreshing queued users, waiting --interval "
+                   "seconds when idle")
+@click.option("--interval", default=5.0, show_default=True)
+def refresh_suggestions(everyone, forever, interval):
+    """Recompute who-to-follow suggestions (see recommendations.py)."""
+
+    limit = app.config['SUGGESTIONS_PER_USER']
+    if everyone:
+        written = recommendations.refresh_all(
+            limit,
+            workers=app.config['SUGGESTION_WORKERS'],
+            range_size=app.config['SUGGESTION_RANGE_SIZE'])
+        print(f"Wrote {written} suggestions.")
+        return
+
+    while True:
+        refreshed = recommendations.refresh_queued(limit)
+        if refreshed:
+            print(f"Refreshed {refreshed} users' suggestions.")
+        elif forever:
+            sleep(interval)
+        else:
+            break
+
+
+@app.cli.command("index-messages")
+@click.option("--batch-size", default=10000, show_default=True)
+def index_messages(batch_size):
+    """Rebuild the message search index (see messagesearch.py)."""
+
+    indexed = messagesearch.rebuild(batch_size)
+    print(f"Indexed {indexed} messages.")
+
+
+@app.cli.command("partition-messages")
+@click.option("--months-ahead", default=3, show_default=True)
+def partition_messages(months_ahead):
+    """Convert messages to a table partitioned by month."""
+
+    made = partitions.partition_messages(months_ahead)
+    db.session.commit()
+    print(f"Made {len(made)} partitions." if made
+          else "Already partitioned.")
+
+
+@app.cli.command("create-message-partitions")
+@click.option("--months-ahead", default=3, show_default=True)
+def create_message_partitions(months_ahead):
+    """Add monthly messages partitions up to --months-ahead from now."""
+
+    made = partitions.create_partitions(
+        partitions.add_months(datetime.utcnow(), months_ahead))
+    db.session.commit()
+    print(f"Made partitions: {', '.join(made) or 'none'}")
+
+
+@app.cli.command("detach-message-partitions")
+@click.argument("before")
+def detach_message_partitions(before):
+    """Detach messages partitions for months before BEFORE (YYYY-MM)."""
+
+    detached = partitions.detach_partitions(
+        datetime.strptime(before, "%Y-%m"))
+    # The rows went without the ORM seeing them.
+    cache.clear(Message)
+    db.session.commit()
+    print(f"Detached: {', '.join(detached) or 'none'}")
+
+
+@app.cli.command("reconcile-counters")
+def reconcile_counters():
+    """Rebuild every user's message/follow/like counters."""
+
+    counters.reconcile()
+    db.session.commit()
+    print("Counters reconciled.")
+
+
+##############################################################################
+# Internal metrics
+
+
+def check_internal():
+    """Only let INTERNAL_ALLOWED_IPS see internal pages."""
+
+    if request.remote_addr not in app.config['INTERNAL_ALLOWED_IPS']:
+        raise Forbidden()
+
+
+@app.get('/internal/cache')
+def cache_stats():
+    """Cache hit/miss/eviction counts, for operators."""
+
+    check_internal()
+    return jsonify(cache.stats())
+
+
+@app.get('/internal/fragments')
+def fragment_stats():
+    """Rendered-fragment cache hit/miss counts, for operators."""
+
+    check_internal()
+    return jsonify(fragments.stats())
+
+
+@app.get('/internal/passwords')
+def password_stats():
+    """Password hashing counts, latency and queue waits, for operators."""
+
+    check_internal()
+    return jsonify(passwords.stats())
+
+
+@app.get('/internal/pool')
+def pool_stats():
+    """Database connection pool usage and checkout waits, for operators."""
+
+    check_internal()
+    return jsonify(poolstats.stats(db.engines))
+
+
+@app.get('/internal/deletions')
+def deletion_progress():
+    """Accounts waiting to be deleted, and how much of each is left."""
+
+    check_internal()
+    return jsonify(deletions.progress())
+
+
+@app.get('/internal/replicas')
+def replica_stats():
+    """Read replicas' replication lag and whether reads go to them."""
+
+    check_internal()
+    return jsonify(routing.stats(db.engines))
+
+
+
+@app.get('/internal/follow-index')
+def follow_index_stats():
+    """The follow index's size, and its memory per million follows."""
+
+    check_internal()
+    index = followindex.get_index()
+    if index is None:
+        abort(404)
+    return jsonify(index.stats())
+
+
+@app.get('/internal/message-search')
+def message_search_stats():
+    """The message search index's size."""
 
-    # https://developer.mozilla.org/en-US/docs/Web/HTTP/Headers/Cache-Control
-    response.cache_control.no_store = True
-    return response
+    check_internal()
+    return jsonify(messagesearch.stats())
@@ -0,0 +1,164 @@
+"""JSON API vs. HTML pages: latency, payload size and serialization time.
+
+Load a dataset first (see benchmarks/datasets.py), then:
+
+    python -m benchmarks.bench_api
+    python -m benchmarks.bench_api --requests 500
+
+Each page is fetched as HTML, as JSON with every field, and as JSON with a
+sparse fieldset (`fields=`, see api.py), through the Flask test client as
+random users. Separately, for home feed pages, it times just turning the
+page into a response: rendering home.html from messages vs. serializing
+the rows the API reads. Results are written to
+benchmarks/results/api-<tier>.json.
+"""
+
+import argparse
+import random
+import sys
+from time import perf_counter
+
+from benchmarks.common import (
+    BENCH_DATABASE_URL, get_app, report, save_results, summarize)
+from benchmarks.datasets import TIERS
+
+# name: (HTML path, API path, sparse fields)
+PAGES = {
+    'timeline': ('/', '/api/v1/timeline', 'id,text,username'),
+    'profile': ('/users/{user}', '/api/v1/users/{user}/messages',
+                'id,text'),
+    'followers': ('/users/{user}/followers',
+                  '/api/v1/users/{user}/followers', 'id,username'),
+    'likes': ('/users/{user}/likes', '/api/v1/users/{user}/likes',
+              'id,text,username'),
+    'search': ('/users?q={q}', '/api/v1/users?q={q}', 'id,username'),
+}
+
+
+def fetch(app, user_ids, usernames, path, requests, rng):
+    """Time `requests` GETs of `path`, each as a random user."""
+
+    from app import CURR_USER_KEY
+
+    client = app.test_client()
+    latencies, sizes, statuses = [], [], {}
+    start = perf_counter()
+    for _ in range(requests):
+        user_id = rng.choice(user_ids)
+        with client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+
+        url = path.format(user=rng.choice(user_ids),
+                          q=rng.choice(usernames)[:4])
+        began = perf_counter()
+        resp = client.get(url)
+        latencies.append(perf_counter() - began)
+
+        sizes.append(len(resp.get_data()))
+        statuses[str(resp.status_code)] = (
+            statuses.get(str(resp.status_code), 0) + 1)
+    elapsed = perf_counter() - start
+
+    return {
+        **summarize(latencies, elapsed),
+        'mean_bytes': round(sum(sizes) / len(sizes)),
+        'statuses': statuses,
+    }
+
+
+def serialization(app, user_ids, requests, rng):
+    """Time building the response for home feed pages, both ways."""
+
+    from flask import g, jsonify, render_template, session
+
+    from app import CURR_USER_KEY
+    from models import Message
+    import api
+    import timeline
+
+    fields = tuple(api.MESSAGE_FIELDS)
+    html, json = [], []
+    for _ in range(requests):
+        with app.test_request_context('/'):
+            session[CURR_USER_KEY] = rng.choice(user_ids)
+            app.preprocess_request()
+
+            page = timeline.get_timeline(
+                g.user, per_page=app.config['FEED_PAGE_SIZE'])
+            liked_ids = g.user.liked_message_ids(page.items)
+            began = perf_counter()
+            render_template('home.html', messages=page.items,
+                            liked_ids=liked_ids, page=page)
+            html.append(perf_counter() - began)
+
+            ids = [msg.id for msg in page.items]
+            rows = api.in_order(
+                api.message_query(fields)
+                .filter(Message.id.in_(ids)).all(), ids)
+            began = perf_counter()
+            jsonify(data=api.serialize(
+                rows, fields, {'liked': lambda row: row.id in liked_ids}))
+            json.append(perf_counter() - began)
+
+    return {
+        'render-timeline-html': summarize(html, sum(html)),
+        'render-timeline-json': summarize(json, sum(json)),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument('--tier', choices=TIERS, default='10k',
+                        help="the loaded dataset, for the results name")
+    parser.add_argument('--pages', nargs='+', choices=PAGES,
+                        default=list(PAGES))
+    parser.add_argument('--requests', type=int, default=200,
+                        help="requests per page and format")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    app = get_app()
+
+    from models import db, User
+    max_user_id = db.session.query(db.func.max(User.id)).scalar()
+    if not max_user_id:
+        sys.exit(f"No data in {BENCH_DATABASE_URL}; "
+                 f"run benchmarks.datasets {args.tier} --load first.")
+
+    rng = random.Random(args.seed)
+    sample = db.session.query(User.id, User.username).filter(
+        User.id.in_(rng.sample(range(1, max_user_id + 1),
+                               min(1000, max_user_id)))).all()
+    user_ids = [user_id for user_id, _ in sample]
+    usernames = [username for _, username in sample]
+    db.session.rollback()
+
+    results = {}
+    for name in args.pages:
+        html_path, api_path, sparse = PAGES[name]
+        sep = '&' if '?' in api_path else '?'
+        for variant, path in (('html', html_path),
+                              ('json', api_path),
+                              ('json-sparse', f'{api_path}{sep}fields='
+                                              f'{sparse}')):
+            results[f'{name}-{variant}'] = fetch(
+                app, user_ids, usernames, path, args.requests, rng)
+
+    results.update(serialization(app, user_ids, args.requests, rng))
+
+    path = save_results(f'api-{args.tier}', results, {
+        'tier': args.tier,
+        'requests': args.requests,
+        'seed': args.seed,
+    })
+    report(results)
+    print()
+    print(f"{'page':<24}{'mean bytes':>12}")
+    for name, result in sorted(results.items()):
+        if 'mean_bytes' in result:
+            print(f"{name:<24}{result['mean_bytes']:>12,}")
+    print(f"Results written to {path}")
+
+
+if __name__ == '__main__':
+    main()
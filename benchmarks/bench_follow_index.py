@@ -0,0 +1,178 @@
+"""The in-memory follow index: memory, build time and lookup latency.
+
+    python -m benchmarks.bench_follow_index
+    python -m benchmarks.bench_follow_index --edges 1000000 10000000
+    python -m benchmarks.bench_follow_index --db
+
+For each --edges size it builds a random follows graph (each user follows
+a Zipf-ish number of others) straight into arrays, without a database,
+and reports the index's bytes per million follows against the same graph
+as a dict of Python sets, how long building it took, and the latency of
+follows() checks and following() lists. With --db it also loads the
+loaded dataset's follows table (see benchmarks/datasets.py) through
+graph.load_index() and compares its checks with the query-backed
+User.following_ids(). Results are written to
+benchmarks/results/follow-index.json.
+"""
+
+import argparse
+import random
+import tracemalloc
+from array import array
+from time import perf_counter
+
+from benchmarks.common import get_app, report, save_results, summarize
+
+
+def random_edges(edges, users, rng):
+    """Sorted (sources, targets) arrays of about `edges` random follows."""
+
+    sources, targets = array("i"), array("i")
+    weights = [1 / rank for rank in range(1, users + 1)]
+    total = sum(weights)
+    for user_id in range(1, users + 1):
+        count = min(users - 1, round(edges * weights[user_id - 1] / total))
+        followed = sorted(rng.sample(range(1, users + 1), count + 1))
+        followed = [id for id in followed if id != user_id][:count]
+        sources.extend([user_id] * len(followed))
+        targets.extend(followed)
+    return sources, targets
+
+
+def timed(func, args):
+    """Latencies of calling func(*args) for each of `args`, with the mean
+    in nanoseconds too, as index lookups round to 0 ms."""
+
+    latencies = []
+    start = perf_counter()
+    for arg in args:
+        began = perf_counter()
+        func(*arg)
+        latencies.append(perf_counter() - began)
+    return {
+        **summarize(latencies, perf_counter() - start),
+        'mean_ns': round(sum(latencies) / len(latencies) * 1e9),
+    }
+
+
+def synthetic(edges, users, checks, rng):
+    import graph
+    from followindex import FollowIndex
+
+    sources, targets = random_edges(edges, users, rng)
+
+    began = perf_counter()
+    follows = graph.build(sources, targets, users)
+    index = FollowIndex(follows.offsets, follows.targets)
+    build_s = perf_counter() - began
+
+    tracemalloc.start()
+    as_sets = {}
+    for source, target in zip(sources, targets):
+        as_sets.setdefault(source, set()).add(target)
+    sets_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del as_sets
+
+    pairs = [(rng.randint(1, users), rng.randint(1, users))
+             for _ in range(checks)]
+    stats = index.stats()
+
+    return {
+        f'follows-{edges}': timed(index.follows, pairs),
+        f'following-{edges}': timed(index.following,
+                                    [(user_id,) for user_id, _ in pairs]),
+    }, {
+        'edges': stats['edges'],
+        'users': users,
+        'build_s': round(build_s, 3),
+        'bytes': stats['bytes'],
+        'bytes_per_million_edges': stats['bytes_per_million_edges'],
+        'sets_bytes_per_million_edges': round(
+            sets_bytes / stats['edges'] * 1_000_000),
+    }
+
+
+def from_database(checks, rng):
+    app = get_app()
+
+    from models import db, User, Follow
+    import graph
+
+    with app.app_context():
+        began = perf_counter()
+        index = graph.load_index()
+        copy_s = perf_counter() - began
+        db.session.rollback()
+
+        began = perf_counter()
+        db.session.execute(db.select(Follow.user_following_id,
+                                     Follow.user_being_followed_id)).all()
+        select_s = perf_counter() - began
+        db.session.rollback()
+
+        users = index.stats()['users']
+        pairs = [(rng.randint(1, users), rng.randint(1, users))
+                 for _ in range(checks)]
+
+        def query(user_id, other_id):
+            User(id=user_id).following_ids([other_id])
+
+        results = {
+            'db-follows-index': timed(index.follows, pairs),
+            'db-follows-query': timed(query, pairs),
+        }
+        db.session.rollback()
+
+    return results, {
+        **index.stats(),
+        'load_copy_s': round(copy_s, 3),
+        'select_rows_s': round(select_s, 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument('--edges', type=int, nargs='+', default=[1_000_000])
+    parser.add_argument('--users-per-edge', type=float, default=0.05,
+                        help="users in each graph, per follow")
+    parser.add_argument('--checks', type=int, default=100_000)
+    parser.add_argument('--db', action='store_true',
+                        help="also load the benchmark database's follows")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    results, sizes = {}, {}
+    for edges in args.edges:
+        timings, size = synthetic(
+            edges, max(2, round(edges * args.users_per_edge)), args.checks,
+            rng)
+        results.update(timings)
+        sizes[str(edges)] = size
+
+    if args.db:
+        timings, sizes['db'] = from_database(min(args.checks, 2000), rng)
+        results.update(timings)
+
+    path = save_results('follow-index', results, {
+        'sizes': sizes,
+        'checks': args.checks,
+        'seed': args.seed,
+    })
+    report(results)
+    print()
+    print(f"{'benchmark':<24}{'mean ns':>12}")
+    for name, result in sorted(results.items()):
+        print(f"{name:<24}{result['mean_ns']:>12,}")
+    print()
+    print(f"{'graph':<12}{'edges':>12}{'B/M edges':>14}{'as sets':>14}")
+    for name, size in sizes.items():
+        print(f"{name:<12}{size['edges']:>12,}"
+              f"{size['bytes_per_million_edges']:>14,}"
+              f"{size.get('sets_bytes_per_million_edges', 0):>14,}")
+    print(f"Results written to {path}")
+
+
+if __name__ == '__main__':
+    main()
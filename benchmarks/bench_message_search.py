@@ -0,0 +1,270 @@
+"""Message search (see messagesearch.py): index size and query latency.
+
+    python -m benchmarks.bench_message_search --messages 1m
+    python -m benchmarks.bench_message_search          # 10m
+    python -m benchmarks.bench_message_search --backends postgres
+
+Messages are made up rather than loaded: a dozen or so words drawn from a
+Zipf-distributed vocabulary, with a hashtag in one in five and an
+@mention in one in ten, so there are very common words, very rare ones
+and everything between. Their tokens are loaded straight into the
+index - with COPY for PostgreSQL, building the GIN index afterwards -
+and each kind of search is run --queries times with a term picked at
+random from its band of the vocabulary:
+
+- rare_word: a word ranked 10,000 or below (a handful of hits);
+- common_word: one of the 20 commonest (hundreds of thousands of hits,
+  of which the newest MESSAGE_SEARCH_CANDIDATES are ranked);
+- hashtag, mention: a popular tag or user;
+- two_words: a common word and a middling one;
+- deep_page: the 10th page of a common word, read with cursors.
+
+Uses its own database, SEARCH_DATABASE_URL (default
+postgresql:///warbler_search), which it creates and wipes. Results go to
+benchmarks/results/message-search.json.
+"""
+
+import argparse
+import os
+import random
+import tempfile
+from bisect import bisect
+from itertools import accumulate
+from time import perf_counter
+
+from benchmarks.bench_partitions import create_database, parse_size
+from benchmarks.common import get_app, report, save_results, summarize
+
+DATABASE_URL = os.environ.get(
+    'SEARCH_DATABASE_URL', "postgresql:///warbler_search")
+
+BACKENDS = ('postgres', 'sqlite')
+
+VOCABULARY = 200_000
+TAGS = 5_000
+USERS = 100_000
+
+
+def word(rank):
+    """A made-up word for each vocabulary rank, from 1."""
+
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    text = ""
+    while rank:
+        rank, letter = divmod(rank, 26)
+        text += letters[letter]
+    return text + "o"
+
+
+class Corpus:
+    """Made-up messages, the same for a given seed."""
+
+    def __init__(self, seed):
+        self.seed = seed
+        self.words = list(accumulate(1 / rank
+                                     for rank in range(1, VOCABULARY + 1)))
+        self.tags = list(accumulate(1 / rank for rank in range(1, TAGS + 1)))
+        self.users = list(accumulate(1 / rank
+                                     for rank in range(1, USERS + 1)))
+
+    def pick(self, rng, weights):
+        return bisect(weights, rng.random() * weights[-1],
+                      hi=len(weights) - 1) + 1
+
+    def texts(self, count):
+        rng = random.Random(self.seed)
+        for _ in range(count):
+            words = [word(self.pick(rng, self.words))
+                     for _ in range(rng.randint(4, 20))]
+            if rng.random() < 0.2:
+                words.append(f"#tag{self.pick(rng, self.tags)}")
+            if rng.random() < 0.1:
+                words.insert(0, f"@user{self.pick(rng, self.users)}")
+            yield " ".join(words)
+
+
+class CopySource:
+    """A file-like source for COPY of "id<TAB>tsvector" lines."""
+
+    def __init__(self, texts):
+        import messagesearch
+
+        self.lines = (f"{id}\t{messagesearch._tsvector(text)}\n"
+                      for id, text in enumerate(texts, 1))
+        self.buffer = ""
+
+    def read(self, size=65536):
+        while len(self.buffer) < size:
+            line = next(self.lines, None)
+            if line is None:
+                break
+            self.buffer += line
+        chunk, self.buffer = self.buffer[:size], self.buffer[size:]
+        return chunk
+
+
+def load_postgres(corpus, count):
+    """Load the message_search table and build its index; returns the
+    index and how long each step took."""
+
+    from models import db
+    import messagesearch
+
+    db.session.rollback()
+    db.drop_all()
+    db.create_all()
+    # Only the index is loaded, not the messages it would point at.
+    db.session.execute(db.text(
+        "ALTER TABLE message_search "
+        "DROP CONSTRAINT message_search_message_id_fkey"))
+    db.session.execute(db.text("DROP INDEX ix_message_search_vector"))
+    db.session.commit()
+
+    began = perf_counter()
+    cursor = db.session.connection().connection.cursor()
+    cursor.copy_expert("COPY message_search (message_id, vector) FROM STDIN",
+                       CopySource(corpus.texts(count)))
+    db.session.commit()
+    copy_s = perf_counter() - began
+
+    began = perf_counter()
+    db.session.execute(db.text("SET maintenance_work_mem = '512MB'"))
+    db.session.execute(db.text(
+        "CREATE INDEX ix_message_search_vector ON message_search "
+        "USING gin (vector)"))
+    db.session.commit()
+    index_s = perf_counter() - began
+
+    db.session.connection().connection.set_isolation_level(0)
+    db.session.execute(db.text("VACUUM ANALYZE message_search"))
+    db.session.connection().connection.set_isolation_level(1)
+    db.session.commit()
+
+    return messagesearch.PostgresIndex(), {'load_s': round(copy_s, 1),
+                                           'index_s': round(index_s, 1)}
+
+
+def load_sqlite(corpus, count, path):
+    import messagesearch
+
+    index = messagesearch.SQLiteIndex(path)
+    conn = index._connection()
+
+    began = perf_counter()
+    with conn:
+        conn.execute("BEGIN")
+        conn.executemany(
+            "INSERT INTO message_index (rowid, tokens) VALUES (?, ?)",
+            ((id, " ".join(messagesearch.tokenize(text)))
+             for id, text in enumerate(corpus.texts(count), 1)))
+    load_s = perf_counter() - began
+
+    began = perf_counter()
+    conn.execute("INSERT INTO message_index (message_index) "
+                 "VALUES ('optimize')")
+    return index, {'load_s': round(load_s, 1),
+                   'index_s': round(perf_counter() - began, 1)}
+
+
+def searches(corpus, rng):
+    """{kind: function returning a random search of that kind}."""
+
+    def band(low, high):
+        return lambda: word(rng.randint(low, high))
+
+    common, middling = band(1, 20), band(100, 1000)
+    return {
+        'rare_word': band(10_000, VOCABULARY),
+        'common_word': common,
+        'hashtag': lambda: f"#tag{rng.randint(1, 50)}",
+        'mention': lambda: f"@user{rng.randint(1, 100)}",
+        'two_words': lambda: f"{common()} {middling()}",
+        'deep_page': common,
+    }
+
+
+def measure(index, corpus, queries, rng):
+    from models import db
+    import messagesearch
+
+    def search(text, pages):
+        page = messagesearch.search_keys(text)
+        for _ in range(pages - 1):
+            page = messagesearch.search_keys(text, before=page.next_cursor)
+        db.session.rollback()
+        return page
+
+    results, hits = {}, {}
+    for kind, make in searches(corpus, rng).items():
+        pages = 10 if kind == 'deep_page' else 1
+        latencies = []
+        start = perf_counter()
+        for _ in range(queries):
+            text = make()
+            began = perf_counter()
+            page = search(text, pages)
+            latencies.append(perf_counter() - began)
+            hits.setdefault(kind, []).append(len(page.items))
+        results[kind] = summarize(latencies, perf_counter() - start)
+    return results, {kind: sum(counts) / len(counts)
+                     for kind, counts in hits.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument('--messages', type=parse_size, default='10m',
+                        help="messages to index, like 500k or 10m")
+    parser.add_argument('--backends', nargs='+', choices=BACKENDS,
+                        default=list(BACKENDS))
+    parser.add_argument('--queries', type=int, default=200,
+                        help="searches of each kind")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    create_database(DATABASE_URL)
+    app = get_app(DATABASE_URL)
+    corpus = Corpus(args.seed)
+    results, sizes = {}, {}
+
+    with app.app_context(), tempfile.TemporaryDirectory() as directory:
+        for backend in args.backends:
+            if backend == 'postgres':
+                index, timings = load_postgres(corpus, args.messages)
+            else:
+                index, timings = load_sqlite(
+                    corpus, args.messages,
+                    os.path.join(directory, 'search.sqlite3'))
+            app.extensions['message_search'] = index
+
+            measured, hits = measure(index, corpus, args.queries,
+                                     random.Random(args.seed))
+            results.update({f'{backend}-{kind}': result
+                            for kind, result in measured.items()})
+            stats = index.stats()
+            nbytes = stats.get('file_bytes', stats.get('table_bytes', 0) +
+                               stats.get('index_bytes', 0))
+            sizes[backend] = {**stats, **timings, 'hits_per_page': hits,
+                              'bytes_per_message': round(
+                                  nbytes / stats['messages'])}
+
+    path = save_results('message-search', results, {
+        'messages': args.messages,
+        'queries': args.queries,
+        'candidates': app.config['MESSAGE_SEARCH_CANDIDATES'],
+        'seed': args.seed,
+        'sizes': sizes,
+    })
+    report(results)
+    print()
+    print(f"{'backend':<12}{'messages':>12}{'MB':>10}{'B/message':>11}"
+          f"{'load s':>9}{'index s':>9}")
+    for backend, size in sizes.items():
+        nbytes = size['bytes_per_message'] * size['messages']
+        print(f"{backend:<12}{size['messages']:>12,}"
+              f"{nbytes / 2 ** 20:>10,.0f}{size['bytes_per_message']:>11}"
+              f"{size['load_s']:>9}{size['index_s']:>9}")
+    print(f"Results written to {path}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+"""Micro-benchmarks for the query helpers behind the hot routes.
+
+Load a dataset first (see benchmarks/datasets.py), then:
+
+    python -m benchmarks.bench_micro --tier 10k
+    python -m benchmarks.bench_micro --tier 10k \\
+        --baseline benchmarks/baselines/micro-10k.json
+
+Each benchmark calls one function directly, inside an app context, for a
+random sample of users. Results are written to
+benchmarks/results/micro-<tier>.json; the committed baseline to compare
+against is in benchmarks/baselines/.
+"""
+
+import argparse
+import random
+import sys
+from datetime import datetime
+from time import perf_counter
+
+from benchmarks.common import compare, get_app, report, save_results, summarize
+from benchmarks.datasets import TIERS
+
+
+def benchmarks():
+    """Name -> function(user, rng) for each micro-benchmark."""
+
+    from models import Message
+    from pagination import decode_cursor, encode_cursor, paginate
+    import timeline
+
+    def home_feed(user, rng):
+        timeline.get_timeline(user, per_page=100)
+
+    def home_feed_page_5(user, rng):
+        page = timeline.get_timeline(user, per_page=20)
+        for _ in range(4):
+            if not page.next_cursor:
+                break
+            page = timeline.get_timeline(user, before=page.next_cursor,
+                                         per_page=20)
+
+    def profile_messages(user, rng):
+        paginate(Message.query.filter(Message.user_id == user.id),
+                 (Message.timestamp, Message.id), per_page=50)
+
+    def liked_ids(user, rng):
+        page = timeline.get_timeline(user, per_page=100)
+        user.liked_message_ids(page.items)
+
+    def cursor_round_trip(user, rng):
+        order = (Message.timestamp, Message.id)
+        decode_cursor(encode_cursor((datetime.utcnow(), user.id)), order)
+
+    return {
+        'home_feed': home_feed,
+        'home_feed_page_5': home_feed_page_5,
+        'profile_messages': profile_messages,
+        'liked_message_ids': liked_ids,
+        'cursor_round_trip': cursor_round_trip,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument('--tier', choices=TIERS, default='10k')
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--baseline', help="results JSON to compare against")
+    parser.add_argument('--threshold', type=float, default=0.10)
+    args = parser.parse_args()
+
+    get_app()
+
+    from models import db, User
+
+    max_user_id = db.session.query(db.func.max(User.id)).scalar()
+    if not max_user_id:
+        sys.exit(f"No data loaded; run benchmarks.datasets {args.tier} "
+                 f"--load first.")
+
+    rng = random.Random(args.seed)
+    results = {}
+
+    for name, func in benchmarks().items():
+        latencies = []
+        start = perf_counter()
+        for _ in range(args.iterations):
+            user = db.session.get(User, rng.randint(1, max_user_id))
+            if user is None:
+                continue
+            call_start = perf_counter()
+            func(user, rng)
+            latencies.append(perf_counter() - call_start)
+            db.session.rollback()
+        results[name] = summarize(latencies, perf_counter() - start)
+
+    regressions = []
+    if args.baseline:
+        regressions = compare(args.baseline, results, args.threshold)
+
+    path = save_results(f'micro-{args.tier}', results, {
+        'tier': args.tier,
+        'iterations': args.iterations,
+    })
+
+    report(results, regressions)
+    print(f"Results written to {path}")
+
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,196 @@
+"""Feed and profile latency as the messages table grows, with and without
+monthly partitions (see partitions.py).
+
+    python -m benchmarks.bench_partitions
+    python -m benchmarks.bench_partitions --sizes 25m,50m,100m,200m \\
+        --mode partitioned
+
+Messages are added at a steady --per-month rate going back from now, so a
+bigger table means more history, not busier recent months: what a page of
+recent messages costs should stay flat. Every author is fan-out-on-read,
+so feeds are read straight from messages rather than timeline_entries.
+
+Uses its own database, PARTITIONS_DATABASE_URL (default
+postgresql:///warbler_partitions), which it creates and wipes. Results go
+to benchmarks/results/partitions-<mode>.json.
+"""
+
+import argparse
+import os
+import random
+from datetime import datetime
+from time import perf_counter
+
+from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+
+from benchmarks.common import get_app, report, save_results, summarize
+
+DATABASE_URL = os.environ.get(
+    'PARTITIONS_DATABASE_URL', "postgresql:///warbler_partitions")
+
+MODES = ('plain', 'partitioned')
+
+
+def parse_size(size):
+    units = {'k': 1_000, 'm': 1_000_000}
+    if size[-1].lower() in units:
+        return int(float(size[:-1]) * units[size[-1].lower()])
+    return int(size)
+
+
+def create_database(url):
+    url = make_url(url)
+    engine = create_engine(url.set(database='postgres'),
+                           isolation_level='AUTOCOMMIT')
+    with engine.connect() as conn:
+        exists = conn.exec_driver_sql(
+            "SELECT 1 FROM pg_database WHERE datname = %s",
+            (url.database,)).scalar()
+        if not exists:
+            conn.exec_driver_sql(f'CREATE DATABASE "{url.database}"')
+    engine.dispose()
+
+
+def reset(mode, users, follows, now):
+    """Recreate the tables with `users` users each following `follows`."""
+
+    from models import db
+    import partitions
+
+    db.session.rollback()
+    db.drop_all()
+    for name in db.session.scalars(db.text(
+            "SELECT tablename FROM pg_tables "
+            "WHERE tablename LIKE 'messages\\_%'")):
+        db.session.execute(db.text(f"DROP TABLE {name}"))
+    db.create_all()
+
+    db.session.execute(db.text("""
+        INSERT INTO users (email, username, image_url, header_image_url,
+                           bio, location, password, fanout_on_read)
+        SELECT 'u' || g || '@email.com', 'u' || g, '', '', '', '', 'x', true
+        FROM generate_series(1, :users) g
+    """), {'users': users})
+    db.session.execute(db.text("""
+        INSERT INTO follows (user_following_id, user_being_followed_id)
+        SELECT DISTINCT u, 1 + (u * 7919 + f * 104729) % :users
+        FROM generate_series(1, :users) u, generate_series(1, :follows) f
+        WHERE 1 + (u * 7919 + f * 104729) % :users != u
+    """), {'users': users, 'follows': follows})
+
+    if mode == 'partitioned':
+        partitions.partition_messages(months_ahead=1)
+    db.session.commit()
+
+
+def grow(start, end, users, per_month, now):
+    """Add messages numbered start..end-1, the nth being n/per_month
+    months old."""
+
+    from models import db
+    import partitions
+
+    seconds_per_message = 30 * 24 * 3600 / per_month
+    oldest = datetime.fromtimestamp(
+        now.timestamp() - end * seconds_per_message)
+
+    if partitions.is_partitioned():
+        partitions.create_partitions(now, start=oldest)
+
+    db.session.execute(db.text("""
+        INSERT INTO messages (text, "timestamp", user_id)
+        SELECT 'message ' || g,
+               :now - make_interval(secs => g * :step),
+               1 + (g * 2654435761) % :users
+        FROM generate_series(:start, :end - 1) g
+    """), {'now': now, 'step': seconds_per_message, 'users': users,
+           'start': start, 'end': end})
+    db.session.commit()
+
+    db.session.connection().connection.set_isolation_level(0)
+    db.session.execute(db.text("VACUUM ANALYZE messages"))
+    db.session.connection().connection.set_isolation_level(1)
+    db.session.commit()
+
+
+def measure(app, users, iterations, rng):
+    """Latencies of a feed page and a profile page for random users."""
+
+    from models import db, Message, User
+    from pagination import paginate
+    import timeline
+
+    def profile(user):
+        paginate(Message.query.filter(Message.user_id == user.id),
+                 (Message.timestamp, Message.id), per_page=50,
+                 windows=app.config['MESSAGE_WINDOWS'])
+
+    def feed(user):
+        timeline.get_timeline(user, per_page=100)
+
+    results = {}
+    for name, func in (('home_feed', feed), ('profile_messages', profile)):
+        latencies = []
+        start = perf_counter()
+        for _ in range(iterations):
+            user = db.session.get(User, rng.randint(1, users))
+            call_start = perf_counter()
+            func(user)
+            latencies.append(perf_counter() - call_start)
+            db.session.rollback()
+        results[name] = summarize(latencies, perf_counter() - start)
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument('--sizes', default='1m,2m,4m',
+                        help="message counts to measure at, e.g. 1m,10m,100m")
+    parser.add_argument('--mode', choices=(*MODES, 'both'), default='both')
+    parser.add_argument('--users', type=int, default=10_000)
+    parser.add_argument('--follows', type=int, default=50)
+    parser.add_argument('--per-month', type=int, default=500_000)
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    sizes = sorted(parse_size(size) for size in args.sizes.split(','))
+    modes = MODES if args.mode == 'both' else (args.mode,)
+
+    create_database(DATABASE_URL)
+    app = get_app(DATABASE_URL)
+    now = datetime.utcnow().replace(microsecond=0)
+
+    for mode in modes:
+        rng = random.Random(args.seed)
+        reset(mode, args.users, args.follows, now)
+
+        results = {}
+        loaded = 0
+        for size in sizes:
+            start = perf_counter()
+            grow(loaded, size, args.users, args.per_month, now)
+            print(f"{mode}: {size:,} messages "
+                  f"(+{perf_counter() - start:.0f}s to load)")
+            loaded = size
+
+            for name, result in measure(app, args.users, args.iterations,
+                                        rng).items():
+                results[f"{name}@{size:,}"] = result
+
+        path = save_results(f'partitions-{mode}', results, {
+            'mode': mode,
+            'sizes': sizes,
+            'users': args.users,
+            'follows': args.follows,
+            'per_month': args.per_month,
+            'iterations': args.iterations,
+        })
+        report(results)
+        print(f"Results written to {path}")
+
+
+if __name__ == '__main__':
+    main()
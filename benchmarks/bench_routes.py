@@ -0,0 +1,378 @@
+"""Route latency/throughput benchmarks.
+
+Load a dataset first (see benchmarks/datasets.py), then:
+
+    python -m benchmarks.bench_routes --tier 10k
+    python -m benchmarks.bench_routes --tier 10k --mode gunicorn --workers 4
+    python -m benchmarks.bench_routes --tier 10k \\
+        --baseline benchmarks/baselines/routes-10k-client.json
+
+`client` mode drives the app in-process through the Flask test client;
+`gunicorn` mode starts a local gunicorn on the benchmark database and
+drives it over HTTP. Results are written to
+benchmarks/results/routes-<tier>-<mode>.json. With --baseline, the run
+exits non-zero if any route's p50/p99 got more than --threshold slower.
+
+The committed baselines are in benchmarks/baselines/; results/ is only
+the latest run's output. To move a baseline, copy a run's results over
+it.
+"""
+
+import argparse
+import http.cookiejar
+import os
+import random
+import re
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import Counter
+from time import perf_counter
+
+from benchmarks.common import (
+    BENCH_DATABASE_URL, compare, get_app, report, save_results, summarize)
+from benchmarks.datasets import PASSWORD, TIERS
+
+ROUTES = ('home', 'profile', 'search', 'like', 'follow', 'login')
+
+SERVER_TIMING_QUERIES = re.compile(r'desc="(\d+) queries"')
+CSRF_INPUT = re.compile(r'name="csrf_token" type="hidden" value="([^"]+)"')
+
+
+class Scenario:
+    """Picks random users/messages for requests against a loaded tier.
+
+    Like and follow targets are ones the user hasn't already liked or
+    followed (per `taken`, a set of ('like'|'follow', user id, target id)),
+    so those requests don't fail as duplicates. What they create is kept
+    in `created` for undo_writes().
+    """
+
+    def __init__(self, max_user_id, max_message_id, usernames, taken=(),
+                 seed=0):
+        self.max_user_id = max_user_id
+        self.max_message_id = max_message_id
+        self.usernames = usernames
+        self.taken = set(taken)
+        self.created = []
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+
+    def user_id(self):
+        with self.lock:
+            return self.rng.randint(1, self.max_user_id)
+
+    def user(self):
+        """(id, username) of a user whose username we know."""
+
+        with self.lock:
+            return self.rng.choice(self.usernames)
+
+    def target(self, kind, user_id, pick):
+        """A new target id for `user_id` to like or follow."""
+
+        with self.lock:
+            while True:
+                write = (kind, user_id, pick(self.rng))
+                if write not in self.taken:
+                    break
+            self.taken.add(write)
+            self.created.append(write)
+            return write[2]
+
+    def request_for(self, route, user=None):
+        """(method, path, form data) for one request to this route, made
+        as `user` (an (id, username) pair).
+        """
+
+        if route == 'home':
+            return 'GET', '/', None
+        if route == 'profile':
+            return 'GET', f'/users/{self.user_id()}', None
+        if route == 'search':
+            _, username = self.user()
+            return 'GET', f'/users?q={username[:4]}', None
+        if route == 'like':
+            message_id = self.target(
+                'like', user[0],
+                lambda rng: rng.randint(1, self.max_message_id))
+            return 'POST', f'/like/{message_id}', {}
+        if route == 'follow':
+            followed_id = self.target(
+                'follow', user[0],
+                lambda rng: rng.randint(1, self.max_user_id))
+            return 'POST', f'/users/follow/{followed_id}', {}
+        if route == 'login':
+            _, username = self.user()
+            return 'POST', '/login', {'username': username,
+                                      'password': PASSWORD}
+        raise ValueError(route)
+
+
+class TestClientDriver:
+    """Sends requests through the Flask test client, in-process."""
+
+    def __init__(self, app):
+        from app import CURR_USER_KEY
+
+        self.app = app
+        self.curr_user_key = CURR_USER_KEY
+
+    def session(self, user):
+        client = self.app.test_client()
+        if user is not None:
+            with client.session_transaction() as sess:
+                sess[self.curr_user_key] = user[0]
+        return client
+
+    def send(self, client, method, path, data):
+        resp = client.open(path, method=method, data=data)
+        return resp.status_code, resp.headers.get('Server-Timing', '')
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class HTTPDriver:
+    """Sends requests over HTTP to a running server, e.g. gunicorn."""
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+
+    def session(self, user):
+        jar = http.cookiejar.CookieJar()
+        opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(jar), _NoRedirect())
+        client = {'opener': opener, 'csrf': self._csrf(opener, '/login')}
+
+        if user is not None:
+            self.send(client, 'POST', '/login',
+                      {'username': user[1], 'password': PASSWORD})
+            client['csrf'] = self._csrf(opener, '/')
+
+        return client
+
+    def _csrf(self, opener, path):
+        with opener.open(self.base_url + path) as resp:
+            match = CSRF_INPUT.search(resp.read().decode())
+        return match.group(1) if match else ''
+
+    def send(self, client, method, path, data):
+        body = None
+        if method == 'POST':
+            body = urllib.parse.urlencode(
+                {**(data or {}), 'csrf_token': client['csrf']}).encode()
+
+        request = urllib.request.Request(
+            self.base_url + path, data=body, method=method)
+        try:
+            with client['opener'].open(request) as resp:
+                resp.read()
+                return resp.status, resp.headers.get('Server-Timing', '')
+        except urllib.error.HTTPError as error:
+            return error.code, error.headers.get('Server-Timing', '')
+
+
+def run_route(driver, scenario, route, requests, concurrency):
+    """Send `requests` requests to one route from `concurrency` threads."""
+
+    latencies = []
+    statuses = Counter()
+    queries = []
+    lock = threading.Lock()
+    per_thread = max(1, requests // concurrency)
+
+    def worker():
+        # /login is measured logged out; everything else as a random user.
+        user = None if route == 'login' else scenario.user()
+        client = driver.session(user)
+
+        for _ in range(per_thread):
+            if route == 'login':
+                client = driver.session(None)
+            method, path, data = scenario.request_for(route, user)
+
+            start = perf_counter()
+            status, timing = driver.send(client, method, path, data)
+            latency = perf_counter() - start
+
+            match = SERVER_TIMING_QUERIES.search(timing)
+            with lock:
+                latencies.append(latency)
+                statuses[status] += 1
+                if match:
+                    queries.append(int(match.group(1)))
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    start = perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = perf_counter() - start
+
+    result = summarize(latencies, elapsed)
+    result['statuses'] = {str(code): n for code, n in statuses.items()}
+    if queries:
+        result['mean_queries'] = round(sum(queries) / len(queries), 2)
+    return result
+
+
+def _wait_for_port(port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=1):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"gunicorn didn't start on port {port}")
+
+
+def start_gunicorn(port, workers):
+    env = {
+        **os.environ,
+        'DATABASE_URL': BENCH_DATABASE_URL,
+        'SECRET_KEY': os.environ.get('SECRET_KEY', 'benchmark'),
+    }
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-w', str(workers),
+         '-b', f'127.0.0.1:{port}', '--log-level', 'warning', 'app:app'],
+        env=env,
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    )
+    _wait_for_port(port)
+    return server
+
+
+def undo_writes(created):
+    """Remove the likes and follows a run created.
+
+    Puts the benchmark database back how it was, so the next run's write
+    routes see the same data instead of an ever-growing one.
+    """
+
+    from models import db, Follow, Like
+    import counters
+    import timeline
+
+    likes = [(user_id, target) for kind, user_id, target in created
+             if kind == 'like']
+    follows = [(user_id, target) for kind, user_id, target in created
+               if kind == 'follow']
+
+    db.session.rollback()
+
+    if likes:
+        db.session.execute(db.delete(Like).where(
+            db.tuple_(Like.user_id, Like.message_id).in_(likes)))
+
+    if follows:
+        db.session.execute(db.delete(Follow).where(
+            db.tuple_(Follow.user_following_id,
+                      Follow.user_being_followed_id).in_(follows)))
+        for user_id, followed_id in follows:
+            timeline.remove_follow(user_id, followed_id)
+
+    touched = {user_id for user_id, _ in likes + follows}
+    touched.update(followed_id for _, followed_id in follows)
+    if touched:
+        counters.reconcile(list(touched))
+
+    db.session.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument('--tier', choices=TIERS, default='10k')
+    parser.add_argument('--mode', choices=('client', 'gunicorn'),
+                        default='client')
+    parser.add_argument('--routes', nargs='+', choices=ROUTES,
+                        default=list(ROUTES))
+    parser.add_argument('--requests', type=int, default=200,
+                        help="requests per route")
+    parser.add_argument('--concurrency', type=int, default=1)
+    parser.add_argument('--workers', type=int, default=4,
+                        help="gunicorn worker processes")
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--baseline', help="results JSON to compare against")
+    parser.add_argument('--threshold', type=float, default=0.10,
+                        help="allowed slowdown vs. baseline, as a fraction")
+    args = parser.parse_args()
+
+    app = get_app()
+
+    from models import db, User, Message, Follow, Like
+    max_user_id = db.session.query(db.func.max(User.id)).scalar()
+    max_message_id = db.session.query(db.func.max(Message.id)).scalar()
+    if not max_user_id or not max_message_id:
+        sys.exit(f"No data in {BENCH_DATABASE_URL}; "
+                 f"run benchmarks.datasets {args.tier} --load first.")
+
+    # Generated usernames aren't derivable from ids, so log in as a sample.
+    usernames = db.session.query(User.id, User.username).filter(
+        User.id.in_(random.Random(args.seed).sample(
+            range(1, max_user_id + 1), min(1000, max_user_id)))).all()
+
+    user_ids = [user_id for user_id, _ in usernames]
+    taken = [('follow', user_id, user_id) for user_id in user_ids]
+    taken += [('like', *row) for row in db.session.execute(
+        db.select(Like.user_id, Like.message_id)
+        .where(Like.user_id.in_(user_ids)))]
+    taken += [('follow', *row) for row in db.session.execute(
+        db.select(Follow.user_following_id, Follow.user_being_followed_id)
+        .where(Follow.user_following_id.in_(user_ids)))]
+    db.session.rollback()
+
+    scenario = Scenario(max_user_id, max_message_id,
+                        [tuple(row) for row in usernames], taken, args.seed)
+
+    server = None
+    if args.mode == 'gunicorn':
+        server = start_gunicorn(args.port, args.workers)
+        driver = HTTPDriver(f'http://127.0.0.1:{args.port}')
+    else:
+        driver = TestClientDriver(app)
+
+    try:
+        results = {
+            route: run_route(driver, scenario, route, args.requests,
+                             args.concurrency)
+            for route in args.routes
+        }
+    finally:
+        if server:
+            server.terminate()
+            server.wait()
+        undo_writes(scenario.created)
+
+    # Compare before saving, in case the baseline is the file being saved.
+    regressions = []
+    if args.baseline:
+        regressions = compare(args.baseline, results, args.threshold)
+
+    path = save_results(f'routes-{args.tier}-{args.mode}', results, {
+        'tier': args.tier,
+        'mode': args.mode,
+        'requests': args.requests,
+        'concurrency': args.concurrency,
+        'workers': args.workers if server else None,
+    })
+
+    report(results, regressions)
+    print(f"Results written to {path}")
+
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+"""Shared setup and result handling for the Warbler benchmarks."""
+
+import json
+import os
+import platform
+import statistics
+from datetime import datetime
+
+BENCH_DATABASE_URL = os.environ.get(
+    'BENCH_DATABASE_URL', "postgresql:///warbler_bench")
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), 'results')
+
+
+def get_app(database_url=BENCH_DATABASE_URL):
+    """Import the Flask app pointed at the benchmark database.
+
+    Like the tests, this has to set DATABASE_URL before app.py is imported.
+    """
+
+    os.environ['DATABASE_URL'] = database_url
+    os.environ.setdefault('SECRET_KEY', 'benchmark')
+
+    from app import app
+
+    app.config['WTF_CSRF_ENABLED'] = False
+    app.config['DEBUG_TB_ENABLED'] = False
+
+    return app
+
+
+def summarize(latencies, elapsed):
+    """Latency percentiles (ms) and throughput for one benchmark."""
+
+    ms = sorted(latency * 1000 for latency in latencies)
+    if len(ms) > 1:
+        cuts = statistics.quantiles(ms, n=100, method='inclusive')
+        p50, p90, p99 = cuts[49], cuts[89], cuts[98]
+    else:
+        p50 = p90 = p99 = ms[0] if ms else 0.0
+
+    return {
+        'count': len(ms),
+        'mean_ms': round(statistics.fmean(ms), 3) if ms else 0.0,
+        'p50_ms': round(p50, 3),
+        'p90_ms': round(p90, 3),
+        'p99_ms': round(p99, 3),
+        'max_ms': round(ms[-1], 3) if ms else 0.0,
+        'throughput_rps': round(len(ms) / elapsed, 1) if elapsed else 0.0,
+    }
+
+
+def save_results(name, results, meta):
+    """Write results to benchmarks/results/<name>.json and return the path."""
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    path = os.path.join(RESULTS_DIR, f'{name}.json')
+
+    with open(path, 'w') as f:
+        json.dump({
+            'meta': {
+                **meta,
+                'created': datetime.utcnow().isoformat(timespec='seconds'),
+                'python': platform.python_version(),
+                'machine': platform.machine(),
+            },
+            'results': results,
+        }, f, indent=2, sort_keys=True)
+
+    return path
+
+
+def error_rate(result):
+    """The share of a route benchmark's responses that weren't 2xx/3xx.
+
+    None for results without status counts, like the micro-benchmarks.
+    """
+
+    statuses = result.get('statuses')
+    if not statuses:
+        return None
+
+    errors = sum(n for code, n in statuses.items()
+                 if not 200 <= int(code) < 400)
+    return errors / sum(statuses.values())
+
+
+def compare(baseline_path, results, threshold=0.10,
+            metrics=('p50_ms', 'p99_ms')):
+    """Compare results against a saved baseline.
+
+    Returns a list of (benchmark, metric, baseline, current) for every
+    latency metric that got more than `threshold` (a fraction) slower, and
+    for any change in the share of error responses: fast errors would
+    otherwise pass for a speed-up.
+    """
+
+    with open(baseline_path) as f:
+        baseline = json.load(f)['results']
+
+    regressions = []
+    for name, current in results.items():
+        before = baseline.get(name)
+        if not before:
+            continue
+        for metric in metrics:
+            if (metric in before and before[metric] > 0 and
+                    current[metric] > before[metric] * (1 + threshold)):
+                regressions.append(
+                    (name, metric, before[metric], current[metric]))
+
+        before_errors, current_errors = error_rate(before), error_rate(current)
+        if (before_errors is not None and current_errors is not None and
+                round(before_errors, 3) != round(current_errors, 3)):
+            regressions.append(
+                (name, 'error_rate', before_errors, current_errors))
+
+    return regressions
+
+
+def report(results, regressions=()):
+    """Print a results table, then any regressions."""
+
+    print(f"{'benchmark':<24}{'n':>7}{'p50 ms':>10}{'p90 ms':>10}"
+          f"{'p99 ms':>10}{'req/s':>10}")
+    for name, r in sorted(results.items()):
+        print(f"{name:<24}{r['count']:>7}{r['p50_ms']:>10.2f}"
+              f"{r['p90_ms']:>10.2f}{r['p99_ms']:>10.2f}"
+              f"{r['throughput_rps']:>10.1f}")
+
+    for name, metric, before, current in regressions:
+        print(f"REGRESSION {name} {metric}: {before:.2f} -> {current:.2f}")
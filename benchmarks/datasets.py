@@ -0,0 +1,111 @@
+"""Scale-tiered benchmark datasets.
+
+Writes users/messages/follows/likes CSVs with generator/create_csvs.py,
+then loads them with seed.py:
+
+    python -m benchmarks.datasets 10k --load
+    python -m benchmarks.datasets 1m --out /tmp/warbler-1m --load
+
+Loads go to BENCH_DATABASE_URL (default postgresql:///warbler_bench).
+Every user's password is "password".
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+from time import perf_counter
+
+TIERS = {
+    '10k': dict(users=10_000, messages=100_000, follows=200_000,
+                likes=100_000),
+    '100k': dict(users=100_000, messages=1_000_000, follows=2_000_000,
+                 likes=1_000_000),
+    '1m': dict(users=1_000_000, messages=10_000_000, follows=20_000_000,
+               likes=10_000_000),
+}
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), 'data')
+
+PASSWORD = "password"
+
+
+def tier_dir(tier):
+    return os.path.join(DATA_DIR, tier)
+
+
+def write_tier(tier, directory=None, seed=0, bcrypt_rounds=12, workers=None):
+    """Write CSVs for this tier with generator/create_csvs.py and return
+    the directory they're in.
+    """
+
+    sizes = TIERS[tier]
+    directory = directory or tier_dir(tier)
+
+    command = [
+        sys.executable, os.path.join(ROOT, 'generator', 'create_csvs.py'),
+        '--out', directory,
+        '--seed', str(seed),
+        # One hash is shared by every user, which keeps generation fast;
+        # the cost factor still matters to the /login benchmark.
+        '--bcrypt-rounds', str(bcrypt_rounds),
+    ]
+    for table, count in sizes.items():
+        command += [f'--{table}', str(count)]
+    if workers:
+        command += ['--workers', str(workers)]
+
+    subprocess.run(command, check=True)
+    return directory
+
+
+def load_tier(directory):
+    """Load a tier's CSVs into the benchmark database."""
+
+    from benchmarks.common import get_app
+    get_app()
+
+    from models import db
+    from seed import seed
+    seed(directory, copy=True)
+
+    # Fresh statistics, so the first benchmark run gets the same plans as
+    # later ones.
+    with db.engine.connect() as conn:
+        conn.execution_options(isolation_level='AUTOCOMMIT').exec_driver_sql(
+            'ANALYZE')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument('tier', choices=TIERS)
+    parser.add_argument('--out', help="directory for the CSV files")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--bcrypt-rounds', type=int, default=12)
+    parser.add_argument('--workers', type=int,
+                        help="generator processes (default: one per CPU)")
+    parser.add_argument('--load', action='store_true',
+                        help="load into the benchmark database afterwards")
+    parser.add_argument('--skip-write', action='store_true',
+                        help="load CSVs written by an earlier run")
+    args = parser.parse_args()
+
+    directory = args.out or tier_dir(args.tier)
+
+    if not args.skip_write:
+        start = perf_counter()
+        write_tier(args.tier, directory, args.seed, args.bcrypt_rounds,
+                   args.workers)
+        print(f"Wrote {args.tier} to {directory} "
+              f"in {perf_counter() - start:.1f}s")
+
+    if args.load:
+        start = perf_counter()
+        load_tier(directory)
+        print(f"Loaded {args.tier} in {perf_counter() - start:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,381 @@
+"""Read-through cache for User and Message rows.
+
+`get_user(id)` / `get_message(id)` return the row as a normal instance in
+the current session, loading it from the database only on a cache miss.
+What's cached is a snapshot of the row's columns, not the ORM object, so
+it's safe to share between requests (and, with a shared backend, between
+processes); a hit is rebuilt into a persistent instance without a query.
+
+Entries are invalidated automatically when the ORM changes them:
+
+- instances of User/Message that are flushed as changed or deleted;
+- ORM-enabled bulk UPDATE/DELETE statements against either model. These
+  can name the ids they touch with `.execution_options(cache_ids=[...])`
+  (counters.adjust() does); without that, the model's whole cache is
+  dropped;
+- dropping either table (as tests and seed.py do).
+
+Raw SQL that changes the rows isn't seen; call `invalidate()` or
+`clear()` after it.
+
+Invalidated keys are dropped again when the transaction commits or rolls
+back, and aren't cached in between, so no one caches a row mid-change.
+
+A miss is always read from the primary, even in a request whose reads go
+to a replica (see routing.py): a lagging replica's copy would otherwise
+be cached for everyone, including the user who just changed the row.
+
+Backends, picked with CACHE_URL:
+
+- "local" (the default): an in-process LRU with a TTL;
+- "memory": a stand-in for a shared cache server, storing pickled values
+  in this process, for trying out the shared code path;
+- "redis://...": a Redis server (needs the `redis` package).
+
+With several app processes and the local backend, another process's
+change is only seen once the TTL runs out.
+"""
+
+import pickle
+import threading
+from collections import OrderedDict
+from time import monotonic
+
+from flask import current_app
+from sqlalchemy import event
+from sqlalchemy.orm import Session, make_transient_to_detached
+
+from models import db, User, Message
+
+CACHED_MODELS = (User, Message)
+
+
+class Stats:
+    """Cache event counts."""
+
+    FIELDS = ("hits", "misses", "sets", "evictions", "expirations",
+              "invalidations")
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = dict.fromkeys(self.FIELDS, 0)
+
+    def add(self, field, n=1):
+        with self.lock:
+            self.counts[field] += n
+
+    def as_dict(self):
+        with self.lock:
+            counts = dict(self.counts)
+        lookups = counts["hits"] + counts["misses"]
+        counts["hit_rate"] = (round(counts["hits"] / lookups, 4) if lookups
+                              else None)
+        return counts
+
+
+class LRUBackend:
+    """In-process LRU cache whose entries expire after `ttl` seconds."""
+
+    def __init__(self, stats, max_entries=10000, ttl=60):
+        self.stats = stats
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+
+            value, expires = entry
+            if expires <= monotonic():
+                del self.entries[key]
+                self.stats.add("expirations")
+                return None
+
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (value, monotonic() + self.ttl)
+            self.entries.move_to_end(key)
+
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.stats.add("evictions")
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self, prefix):
+        with self.lock:
+            for key in [key for key in self.entries
+                        if key.startswith(prefix)]:
+                del self.entries[key]
+
+    def size(self):
+        return len(self.entries)
+
+
+class MemoryStore:
+    """Stands in for a shared cache server, in this process.
+
+    Only bytes go in and out, as with a real server, so whatever's cached
+    has to survive pickling.
+    """
+
+    def __init__(self):
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            value, expires = self.values.get(key, (None, 0))
+            return value if expires > monotonic() else None
+
+    def set(self, key, value, ttl):
+        with self.lock:
+            self.values[key] = (value, monotonic() + ttl)
+
+    def delete(self, *keys):
+        with self.lock:
+            for key in keys:
+                self.values.pop(key, None)
+
+    def keys(self, prefix):
+        with self.lock:
+            return [key for key in self.values if key.startswith(prefix)]
+
+
+class RedisStore:
+    """A Redis server, with the same interface as MemoryStore."""
+
+    def __init__(self, url):
+        import redis
+
+        self.client = redis.Redis.from_url(url)
+
+    def get(self, key):
+        return self.client.get(key)
+
+    def set(self, key, value, ttl):
+        self.client.set(key, value, ex=max(1, round(ttl)))
+
+    def delete(self, *keys):
+        if keys:
+            self.client.delete(*keys)
+
+    def keys(self, prefix):
+        return [key.decode() for key in
+                self.client.scan_iter(match=f"{prefix}*")]
+
+
+class SharedBackend:
+    """A cache held by a server that every app process talks to."""
+
+    def __init__(self, stats, store, ttl=60):
+        self.stats = stats
+        self.store = store
+        self.ttl = ttl
+
+    def get(self, key):
+        value = self.store.get(key)
+        return None if value is None else pickle.loads(value)
+
+    def set(self, key, value):
+        self.store.set(key, pickle.dumps(value), self.ttl)
+
+    def delete(self, key):
+        self.store.delete(key)
+
+    def clear(self, prefix):
+        self.store.delete(*self.store.keys(prefix))
+
+    def size(self):
+        return len(self.store.keys(""))
+
+
+def make_backend(url, stats, max_entries=10000, ttl=60):
+    """The backend for a CACHE_URL."""
+
+    if url == "local":
+        return LRUBackend(stats, max_entries, ttl)
+    if url == "memory":
+        return SharedBackend(stats, MemoryStore(), ttl)
+    if url.startswith("redis://"):
+        return SharedBackend(stats, RedisStore(url), ttl)
+    raise ValueError(f"Unknown CACHE_URL: {url}")
+
+
+def _backend():
+    return current_app.extensions["warbler_cache"]
+
+
+def _key(model, id):
+    return f"{model.__tablename__}:{id}"
+
+
+def _pending(session):
+    """Keys this session has invalidated in its current transaction."""
+
+    return session.info.setdefault("cache_invalidated", set())
+
+
+def _snapshot(obj):
+    return {attr.key: getattr(obj, attr.key)
+            for attr in db.inspect(obj).mapper.column_attrs}
+
+
+def _get(model, id):
+    identity = db.inspect(model).identity_key_from_primary_key((id,))
+    obj = db.session.identity_map.get(identity)
+    if obj is not None:
+        return obj
+
+    backend = _backend()
+    key = _key(model, id)
+    data = backend.get(key)
+
+    if data is not None:
+        backend.stats.add("hits")
+        obj = model(**data)
+        make_transient_to_detached(obj)
+        return db.session.merge(obj, load=False)
+
+    backend.stats.add("misses")
+    obj = db.session.get(model, id, bind_arguments={"bind": db.engine})
+
+    # Don't cache what this transaction is still changing.
+    pending = _pending(db.session)
+    if (obj is not None and key not in pending and
+            _key(model, "") not in pending):
+        backend.set(key, _snapshot(obj))
+        backend.stats.add("sets")
+
+    return obj
+
+
+def get_user(user_id):
+    """Get a User by id, or None."""
+
+    return _get(User, user_id)
+
+
+def get_message(message_id):
+    """Get a Message by id, or None."""
+
+    return _get(Message, message_id)
+
+
+def _drop(keys):
+    """Delete keys from the backend; a key ending in ":" is a prefix."""
+
+    backend = _backend()
+    for key in keys:
+        if key.endswith(":"):
+            backend.clear(key)
+        else:
+            backend.delete(key)
+
+
+def _invalidate(session, model, ids=None, deleted=False):
+    """Drop entries for these ids (or all of this model's, if None), now
+    and again when the session's transaction ends.
+    """
+
+    keys = ([_key(model, "")] if ids is None
+            else [_key(model, id) for id in ids])
+    # A user's messages go with them, by ON DELETE CASCADE.
+    if model is User and deleted:
+        keys.append(_key(Message, ""))
+
+    _drop(keys)
+    _pending(session).update(keys)
+    _backend().stats.add("invalidations", len(keys))
+
+
+def invalidate(model, *ids):
+    """Drop these rows' entries."""
+
+    _invalidate(db.session, model, ids)
+
+
+def clear(model):
+    """Drop every cached row of this model."""
+
+    _invalidate(db.session, model)
+
+
+def stats():
+    """Cache metrics, as a dict."""
+
+    backend = _backend()
+    return {
+        "backend": type(backend).__name__,
+        "entries": backend.size(),
+        **backend.stats.as_dict(),
+    }
+
+
+@event.listens_for(Session, "after_flush")
+def _after_flush(session, flush_context):
+    if not current_app:
+        return
+
+    for model in CACHED_MODELS:
+        changed = [obj.id for obj in session.dirty
+                   if isinstance(obj, model) and
+                   session.is_modified(obj, include_collections=False)]
+        deleted = [obj.id for obj in session.deleted
+                   if isinstance(obj, model)]
+
+        if changed:
+            _invalidate(session, model, changed)
+        if deleted:
+            _invalidate(session, model, deleted, deleted=True)
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _do_orm_execute(state):
+    if (not current_app or not (state.is_update or state.is_delete) or
+            not state.bind_mapper):
+        return
+
+    model = state.bind_mapper.class_
+    if model in CACHED_MODELS:
+        _invalidate(state.session, model,
+                    state.execution_options.get("cache_ids"),
+                    deleted=state.is_delete)
+
+
+def _after_drop(target, connection, **kw):
+    # Recreated tables reuse ids, so nothing cached from before is right.
+    if current_app:
+        _backend().clear(f"{target.name}:")
+
+
+for model in CACHED_MODELS:
+    event.listen(model.__table__, "after_drop", _after_drop)
+
+
+@event.listens_for(Session, "after_commit")
+@event.listens_for(Session, "after_rollback")
+def _end_transaction(session):
+    keys = session.info.pop("cache_invalidated", None)
+    if keys and current_app:
+        _drop(keys)
+
+
+def init_app(app):
+    """Set up the cache from CACHE_URL, CACHE_TTL and CACHE_MAX_ENTRIES."""
+
+    app.extensions["warbler_cache"] = make_backend(
+        app.config["CACHE_URL"],
+        Stats(),
+        max_entries=app.config["CACHE_MAX_ENTRIES"],
+        ttl=app.config["CACHE_TTL"],
+    )
@@ -0,0 +1,120 @@
+"""Denormalized per-user counters.
+
+`User.messages_count`, `following_count`, `followers_count` and
+`likes_count` are adjusted with single-row UPDATEs in the same transaction
+as the change they count, so pages can show them without loading the
+underlying collections. `reconcile()` rebuilds them from the base tables.
+
+Every adjustment also bumps the user's `activity_version`, which pages use
+to tell whether they've changed (see httpcache.py).
+"""
+
+from sqlalchemy import func
+
+from models import db, User, Message, Follow, Like
+
+COUNTERS = ("messages", "following", "followers", "likes")
+
+
+def adjust(user_id, **deltas):
+    """Add `deltas` to this user's counters, e.g. adjust(1, likes=1)."""
+
+    values = {}
+    for name, delta in deltas.items():
+        if name not in COUNTERS:
+            raise ValueError(f"Unknown counter: {name}")
+        column = getattr(User, f"{name}_count")
+        values[column] = column + delta
+    values[User.activity_version] = User.activity_version + 1
+
+    db.session.execute(
+        db.update(User)
+        .where(User.id == user_id)
+        .values(values)
+        .execution_options(cache_ids=[user_id])
+    )
+
+
+def _decrement_likers(message_ids):
+    """Decrement likes_count for everyone who liked these messages."""
+
+    likers = (db
+              .select(Like.user_id, func.count().label("n"))
+              .where(message_ids)
+              .group_by(Like.user_id)
+              .subquery())
+
+    db.session.execute(
+        db.update(User)
+        .where(User.id == likers.c.user_id)
+        .values(likes_count=User.likes_count - likers.c.n,
+                activity_version=User.activity_version + 1)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def message_deleted(msg):
+    """Adjust counters for a message about to be deleted.
+
+    Call before deleting it, while its likes still exist.
+    """
+
+    adjust(msg.user_id, messages=-1)
+    _decrement_likers(Like.message_id == msg.id)
+
+
+def likes_deleted(where):
+    """Adjust counters for the likes matching `where`, about to be deleted."""
+
+    _decrement_likers(where)
+
+
+def follows_deleted(user_id, user_ids, following):
+    """Adjust counters for follows between this user and `user_ids`, about
+    to be deleted: the user's follows of them if `following`, else theirs
+    of the user.
+    """
+
+    mine, theirs = (("following", "followers") if following
+                    else ("followers", "following"))
+    adjust(user_id, **{mine: -len(user_ids)})
+
+    column = getattr(User, f"{theirs}_count")
+    db.session.execute(
+        db.update(User)
+        .where(User.id.in_(user_ids))
+        .values({column: column - 1,
+                 User.activity_version: User.activity_version + 1})
+        .execution_options(synchronize_session=False, cache_ids=user_ids)
+    )
+
+
+def reconcile(user_ids=None):
+    """Rebuild users' counters from the base tables.
+
+    Runs as one UPDATE of the users table with a correlated count for
+    each counter. Rebuilds everyone's, or just those of `user_ids` (a list
+    or a select of ids).
+    """
+
+    def count(owner):
+        return (db
+                .select(func.count())
+                .where(owner == User.id)
+                .scalar_subquery())
+
+    query = db.update(User)
+    if user_ids is not None:
+        query = query.where(User.id.in_(user_ids))
+
+    db.session.execute(
+        query
+        .values(
+            messages_count=count(Message.user_id),
+            following_count=count(Follow.user_following_id),
+            followers_count=count(Follow.user_being_followed_id),
+            likes_count=count(Like.user_id),
+            activity_version=User.activity_version + 1,
+        )
+        .execution_options(synchronize_session=False)
+    )
@@ -0,0 +1,91 @@
+"""The logged-in user, loaded only when a request needs it.
+
+Logging in puts the user's id in the (signed) session, along with a few
+claims: their username, image_url and profile_version. That's all the nav
+bar needs, and checking follows or likes only takes the id, so
+`CurrentUser` answers those without loading the user. Anything else loads
+it (through cache.get_user()) the first time it's asked for.
+
+Claims are refreshed whenever the user is loaded and has a newer
+profile_version, so a profile edited elsewhere shows up in this browser's
+nav bar at the next page that loads the user.
+"""
+
+from flask import abort, redirect, session
+
+from models import User
+import cache
+
+USER_KEY = "curr_user"
+CLAIMS_KEY = "curr_user_claims"
+
+CLAIMS = ("username", "image_url", "profile_version")
+
+# User methods that only use the user's id.
+ID_METHODS = ("liked_message_ids", "following_ids", "followed_by_ids",
+              "is_following", "is_followed_by")
+
+
+def claims(user):
+    return {name: getattr(user, name) for name in CLAIMS}
+
+
+def login(user):
+    session[USER_KEY] = user.id
+    session[CLAIMS_KEY] = claims(user)
+
+
+def logout():
+    session.pop(USER_KEY, None)
+    session.pop(CLAIMS_KEY, None)
+
+
+class CurrentUser:
+    """Stands in for the logged-in User; `get()` returns the real one."""
+
+    def __init__(self, user_id, claims=None):
+        self.id = user_id
+        self._claims = claims
+        self._user = None
+
+    def __repr__(self):
+        return f"<CurrentUser #{self.id}>"
+
+    @property
+    def loaded(self):
+        return self._user is not None
+
+    def get(self):
+        """The User, loaded now if it hasn't been.
+
+        If they've been deleted (or disabled, see deletions.py) since
+        logging in, logs out and redirects to the login page.
+        """
+
+        if self._user is None:
+            user = cache.get_user(self.id)
+            if user is None or user.disabled_at is not None:
+                logout()
+                abort(redirect("/login"))
+
+            self._user = user
+            if claims(user) != self._claims:
+                self._claims = claims(user)
+                session[CLAIMS_KEY] = self._claims
+
+        return self._user
+
+    def __getattr__(self, name):
+        if name in CLAIMS and self._claims is not None:
+            return self._claims[name]
+        if name in ID_METHODS:
+            return getattr(User, name).__get__(self)
+        return getattr(self.get(), name)
+
+
+def current_user():
+    """A CurrentUser for the session's user, or None."""
+
+    if USER_KEY not in session:
+        return None
+    return CurrentUser(session[USER_KEY], session.get(CLAIMS_KEY))
@@ -0,0 +1,248 @@
+"""Deleting accounts in the background, a batch at a time.
+
+Deleting a user in one statement leaves Postgres to cascade through all
+their messages, likes and follows, and everyone's likes of and feed
+entries for those messages, in one transaction that holds its locks for
+as long as that takes. So deleting an account comes in two parts:
+
+- `disable()`, in the request, only sets `User.disabled_at`. From then on
+  the user can't log in, their profile is gone, they drop out of lists,
+  and queued likes and follows involving them are skipped (see edges.py).
+- `step()`, run by `flask delete-accounts`, deletes one batch of at most
+  ACCOUNT_DELETE_BATCH_SIZE rows of the longest-disabled account and
+  commits. It works through STEPS in order; once they're all done, the
+  user row has nothing left to cascade to and goes too.
+
+Every batch adjusts counters as it goes, the user's own included, so
+`progress()` is just what their counters still say.
+"""
+
+from datetime import datetime
+
+from sqlalchemy import tuple_
+
+from models import db, User, Message, Follow, Like, TimelineEntry
+import counters
+import graph
+import messagesearch
+
+
+def disable(user_id):
+    """Disable this user's account, for step() to delete."""
+
+    db.session.execute(
+        db.update(User)
+        .where(User.id == user_id)
+        .where(User.disabled_at.is_(None))
+        .values(disabled_at=datetime.utcnow())
+        .execution_options(cache_ids=[user_id])
+    )
+
+
+def _delete_message_likes(user_id, batch_size):
+    """Likes of the user's messages."""
+
+    likes = db.session.execute(
+        db.select(Like.user_id, Like.message_id)
+        .join(Message, Message.id == Like.message_id)
+        .where(Message.user_id == user_id)
+        .limit(batch_size)
+    ).tuples().all()
+
+    if likes:
+        where = tuple_(Like.user_id, Like.message_id).in_(likes)
+        counters.likes_deleted(where)
+        db.session.execute(db.delete(Like).where(where)
+                           .execution_options(synchronize_session=False))
+    return len(likes)
+
+
+def _delete_message_entries(user_id, batch_size):
+    """Feed entries for the user's messages."""
+
+    entries = db.session.execute(
+        db.select(TimelineEntry.user_id, TimelineEntry.message_id)
+        .join(Message, Message.id == TimelineEntry.message_id)
+        .where(Message.user_id == user_id)
+        .limit(batch_size)
+    ).tuples().all()
+
+    if entries:
+        db.session.execute(
+            db.delete(TimelineEntry)
+            .where(tuple_(TimelineEntry.user_id,
+                          TimelineEntry.message_id).in_(entries))
+            .execution_options(synchronize_session=False))
+    return len(entries)
+
+
+def _delete_messages(user_id, batch_size):
+    """The user's messages, by now with (nearly) nothing to cascade to."""
+
+    ids = db.session.scalars(
+        db.select(Message.id)
+        .where(Message.user_id == user_id)
+        .limit(batch_size)
+    ).all()
+
+    if ids:
+        # Likes made since _delete_message_likes() went by
+        counters.likes_deleted(Like.message_id.in_(ids))
+        counters.adjust(user_id, messages=-len(ids))
+        messagesearch.messages_deleted(ids)
+        db.session.execute(
+            db.delete(Message)
+            .where(Message.id.in_(ids))
+            .execution_options(synchronize_session=False, cache_ids=ids))
+    return len(ids)
+
+
+def _delete_likes(user_id, batch_size):
+    """The user's likes of others' messages."""
+
+    ids = db.session.scalars(
+        db.select(Like.message_id)
+        .where(Like.user_id == user_id)
+        .limit(batch_size)
+    ).all()
+
+    if ids:
+        counters.adjust(user_id, likes=-len(ids))
+        db.session.execute(
+            db.delete(Like)
+            .where(Like.user_id == user_id)
+            .where(Like.message_id.in_(ids))
+            .execution_options(synchronize_session=False))
+    return len(ids)
+
+
+def _delete_following(user_id, batch_size):
+    """The user's follows of others."""
+
+    ids = db.session.scalars(
+        db.select(Follow.user_being_followed_id)
+        .where(Follow.user_following_id == user_id)
+        .limit(batch_size)
+    ).all()
+
+    if ids:
+        counters.follows_deleted(user_id, ids, following=True)
+        graph.follows_changed({(user_id, id): False for id in ids})
+        db.session.execute(
+            db.delete(Follow)
+            .where(Follow.user_following_id == user_id)
+            .where(Follow.user_being_followed_id.in_(ids))
+            .execution_options(synchronize_session=False))
+    return len(ids)
+
+
+def _delete_followers(user_id, batch_size):
+    """Others' follows of the user."""
+
+    ids = db.session.scalars(
+        db.select(Follow.user_following_id)
+        .where(Follow.user_being_followed_id == user_id)
+        .limit(batch_size)
+    ).all()
+
+    if ids:
+        counters.follows_deleted(user_id, ids, following=False)
+        graph.follows_changed({(id, user_id): False for id in ids})
+        db.session.execute(
+            db.delete(Follow)
+            .where(Follow.user_being_followed_id == user_id)
+            .where(Follow.user_following_id.in_(ids))
+            .execution_options(synchronize_session=False))
+    return len(ids)
+
+
+def _delete_feed(user_id, batch_size):
+    """The user's own feed."""
+
+    ids = db.session.scalars(
+        db.select(TimelineEntry.message_id)
+        .where(TimelineEntry.user_id == user_id)
+        .limit(batch_size)
+    ).all()
+
+    if ids:
+        db.session.execute(
+            db.delete(TimelineEntry)
+            .where(TimelineEntry.user_id == user_id)
+            .where(TimelineEntry.message_id.in_(ids))
+            .execution_options(synchronize_session=False))
+    return len(ids)
+
+
+# (name, deleter), in the order they run. Likes and feed entries go before
+# the messages they'd otherwise be cascaded from all at once.
+STEPS = (
+    ("message likes", _delete_message_likes),
+    ("message feed entries", _delete_message_entries),
+    ("messages", _delete_messages),
+    ("likes", _delete_likes),
+    ("following", _delete_following),
+    ("followers", _delete_followers),
+    ("feed entries", _delete_feed),
+)
+
+
+def step(batch_size):
+    """Delete and commit one batch of the longest-disabled account.
+
+    Returns (user id, what was deleted, how many), or None if no account
+    is waiting to be deleted.
+    """
+
+    user_id = db.session.scalar(
+        db.select(User.id)
+        .where(User.disabled_at.isnot(None))
+        .order_by(User.disabled_at, User.id)
+        .limit(1)
+    )
+    if user_id is None:
+        return None
+
+    try:
+        for name, delete in STEPS:
+            deleted = delete(user_id, batch_size)
+            if deleted:
+                break
+        else:
+            # Anything added since goes by ON DELETE CASCADE.
+            name, deleted = "user", 1
+            db.session.execute(
+                db.delete(User)
+                .where(User.id == user_id)
+                .execution_options(synchronize_session=False,
+                                   cache_ids=[user_id]))
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    return user_id, name, deleted
+
+
+def progress():
+    """Accounts waiting to be deleted, oldest first, with what's left."""
+
+    rows = db.session.execute(
+        db.select(User.id, User.username, User.disabled_at,
+                  User.messages_count, User.likes_count,
+                  User.following_count, User.followers_count)
+        .where(User.disabled_at.isnot(None))
+        .order_by(User.disabled_at, User.id)
+    ).all()
+
+    return [{
+        "id": row.id,
+        "username": row.username,
+        "disabled_at": row.disabled_at.isoformat(),
+        "remaining": {
+            "messages": row.messages_count,
+            "likes": row.likes_count,
+            "following": row.following_count,
+            "followers": row.followers_count,
+        },
+    } for row in rows]
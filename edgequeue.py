@@ -0,0 +1,120 @@
+"""Durable local queue of like/follow changes, for write-behind mode.
+
+With EDGE_WRITES = "queue", the like/unlike and follow/unfollow routes
+don't write to PostgreSQL. They append an operation — "user A wants edge
+(kind, B) present/absent" — to this queue, a SQLite file at
+EDGE_QUEUE_PATH, and return. `flask drain-edges` (see edges.py) applies
+queued operations in batches.
+
+Operations stay queued until they have been applied and committed, so a
+crash between the two just means they are applied again, which is
+harmless: applying an operation only makes an edge present or absent.
+
+Until then, `pending()` lets reads show users their own queued changes.
+"""
+
+import os
+import sqlite3
+import threading
+
+from flask import current_app
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS edge_ops (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    actor INTEGER NOT NULL,
+    target INTEGER NOT NULL,
+    state INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_edge_ops_actor ON edge_ops (actor, kind);
+"""
+
+
+class EdgeQueue:
+    """A queue of (kind, actor id, target id, present?) operations.
+
+    Safe to share between threads and processes on one host, but only one
+    worker should take from it at a time.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+        self._connection().executescript(SCHEMA)
+
+    def _connection(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            # Autocommit: each put is durable once it returns.
+            conn = sqlite3.connect(self.path, timeout=30,
+                                   isolation_level=None)
+            conn.execute("PRAGMA journal_mode = WAL")
+            self.local.conn = conn
+        return conn
+
+    def put(self, kind, actor, target, state):
+        self._connection().execute(
+            "INSERT INTO edge_ops (kind, actor, target, state) "
+            "VALUES (?, ?, ?, ?)",
+            (kind, actor, target, int(state)))
+
+    def pending(self, actor, kind):
+        """{target id: present?} for this actor's queued operations."""
+
+        rows = self._connection().execute(
+            "SELECT target, state FROM edge_ops "
+            "WHERE actor = ? AND kind = ? ORDER BY id",
+            (actor, kind))
+        # Later operations on the same edge win.
+        return {target: bool(state) for target, state in rows}
+
+    def take(self, limit):
+        """The oldest `limit` operations, as (id, (kind, actor, target,
+        present?)) pairs. They stay queued until done()."""
+
+        rows = self._connection().execute(
+            "SELECT id, kind, actor, target, state FROM edge_ops "
+            "ORDER BY id LIMIT ?", (limit,))
+        return [(id, (kind, actor, target, bool(state)))
+                for id, kind, actor, target, state in rows]
+
+    def done(self, last_id):
+        """Remove operations up to and including `last_id`."""
+
+        self._connection().execute(
+            "DELETE FROM edge_ops WHERE id <= ?", (last_id,))
+
+    def __len__(self):
+        return self._connection().execute(
+            "SELECT count(*) FROM edge_ops").fetchone()[0]
+
+
+def get_queue():
+    return current_app.extensions["warbler_edge_queue"]
+
+
+def enabled():
+    """Are like/follow changes being queued?"""
+
+    return current_app.config["EDGE_WRITES"] == "queue"
+
+
+def pending(actor, kind):
+    """This user's queued changes of one kind, or {} when not queueing."""
+
+    if not enabled():
+        return {}
+    return get_queue().pending(actor, kind)
+
+
+def init_app(app):
+    """Open the queue at EDGE_QUEUE_PATH, if EDGE_WRITES is "queue"."""
+
+    if app.config["EDGE_WRITES"] not in ("sync", "queue"):
+        raise ValueError(f"Unknown EDGE_WRITES: {app.config['EDGE_WRITES']}")
+
+    if app.config["EDGE_WRITES"] == "queue":
+        path = app.config["EDGE_QUEUE_PATH"]
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        app.extensions["warbler_edge_queue"] = EdgeQueue(path)
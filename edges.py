@@ -0,0 +1,230 @@
+"""Like/unlike and follow/unfollow, applied in batches.
+
+Each change is an idempotent operation on one edge: make (kind, actor,
+target) present or absent. `apply()` takes any number of them and:
+
+- coalesces them, so only the last operation on each edge counts (a like
+  followed by an unlike does nothing);
+- skips ones that can't apply any more (self-likes and self-follows, and
+  users or messages deleted since, or users being deleted);
+- writes the rest with one INSERT ... ON CONFLICT DO NOTHING and one
+  DELETE per kind, both RETURNING the rows they really changed;
+- adjusts counters, feeds, trending counts (see trending.py), follow
+  suggestions (see recommendations.py) and the follow index (see
+  graph.py) for just those rows.
+
+With EDGE_WRITES = "sync" (the default) the routes apply their one
+operation straight away, in the request's transaction. With "queue" they
+add it to the edge queue (see edgequeue.py) and `drain()`, run by
+`flask drain-edges`, applies the queue in batches. Users see their own
+queued likes and follows straight away (see `overlay()` and the checks
+in models.py); counters catch up when the queue is drained.
+"""
+
+from collections import Counter, defaultdict
+
+from sqlalchemy import tuple_
+from sqlalchemy.dialects.postgresql import insert
+
+from models import db, follow_checks, User, Message, Follow, Like
+import counters
+import edgequeue
+import graph
+import recommendations
+import timeline
+import trending
+
+LIKE = "like"
+FOLLOW = "follow"
+
+
+def like(user_id, message_id):
+    _submit(LIKE, user_id, message_id, True)
+
+
+def unlike(user_id, message_id):
+    _submit(LIKE, user_id, message_id, False)
+
+
+def follow(user_id, followed_user_id):
+    _submit(FOLLOW, user_id, followed_user_id, True)
+
+
+def unfollow(user_id, followed_user_id):
+    _submit(FOLLOW, user_id, followed_user_id, False)
+
+
+def _submit(kind, actor, target, present):
+    if edgequeue.enabled():
+        edgequeue.get_queue().put(kind, actor, target, present)
+    else:
+        apply([(kind, actor, target, present)])
+
+
+def coalesce(ops):
+    """{(kind, actor, target): present?}, keeping each edge's last op."""
+
+    return {(kind, actor, target): present
+            for kind, actor, target, present in ops}
+
+
+def apply(ops):
+    """Apply (kind, actor, target, present?) ops in this transaction.
+
+    Returns a Counter of rows changed: "likes+", "likes-", "follows+" and
+    "follows-".
+    """
+
+    edges = coalesce(ops)
+    changed = Counter()
+    deltas = defaultdict(Counter)
+
+    likes = {(actor, target): present
+             for (kind, actor, target), present in edges.items()
+             if kind == LIKE}
+    follows = {(actor, target): present
+               for (kind, actor, target), present in edges.items()
+               if kind == FOLLOW}
+
+    if likes:
+        _apply_likes(likes, changed, deltas)
+    if follows:
+        _apply_follows(follows, changed, deltas)
+
+    for user_id, user_deltas in deltas.items():
+        user_deltas = {name: n for name, n in user_deltas.items() if n}
+        if user_deltas:
+            counters.adjust(user_id, **user_deltas)
+
+    # Bulk statements don't flush, which is what usually resets these.
+    follow_checks().clear()
+
+    return changed
+
+
+def _existing_users(user_ids):
+    return {user.id: user for user in
+            User.query
+            .filter(User.id.in_(user_ids))
+            .filter(User.disabled_at.is_(None))}
+
+
+def _apply_likes(likes, changed, deltas):
+    added = [pair for pair, present in likes.items() if present]
+    removed = [pair for pair, present in likes.items() if not present]
+    liked = Counter()
+
+    if added:
+        authors = dict(db.session.execute(
+            db.select(Message.id, Message.user_id)
+            .where(Message.id.in_({target for _, target in added}))
+        ).all())
+        users = _existing_users({actor for actor, _ in added})
+        rows = [{"user_id": actor, "message_id": target}
+                for actor, target in added
+                if actor in users and authors.get(target, actor) != actor]
+
+        if rows:
+            for user_id, message_id in db.session.execute(
+                    insert(Like).values(rows).on_conflict_do_nothing()
+                    .returning(Like.user_id, Like.message_id)):
+                deltas[user_id]["likes"] += 1
+                liked[message_id] += 1
+                changed["likes+"] += 1
+
+    if removed:
+        for user_id, message_id in db.session.execute(
+                db.delete(Like)
+                .where(tuple_(Like.user_id, Like.message_id).in_(removed))
+                .returning(Like.user_id, Like.message_id)
+                .execution_options(synchronize_session=False)):
+            deltas[user_id]["likes"] -= 1
+            changed["likes-"] += 1
+
+    trending.count_likes(liked)
+
+
+def _apply_follows(follows, changed, deltas):
+    follows = {(actor, target): present
+               for (actor, target), present in follows.items()
+               if actor != target}
+    added = [pair for pair, present in follows.items() if present]
+    removed = [pair for pair, present in follows.items() if not present]
+    followed, unfollowed = [], []
+
+    if added:
+        users = _existing_users({id for pair in added for id in pair})
+        rows = [{"user_following_id": actor, "user_being_followed_id": target}
+                for actor, target in added
+                if actor in users and target in users]
+
+        if rows:
+            for actor, target in db.session.execute(
+                    insert(Follow).values(rows).on_conflict_do_nothing()
+                    .returning(Follow.user_following_id,
+                               Follow.user_being_followed_id)):
+                deltas[actor]["following"] += 1
+                deltas[target]["followers"] += 1
+                followed.append((actor, target))
+                changed["follows+"] += 1
+                timeline.backfill_follow(actor, users[target])
+
+    if removed:
+        for actor, target in db.session.execute(
+                db.delete(Follow)
+                .where(tuple_(Follow.user_following_id,
+                              Follow.user_being_followed_id).in_(removed))
+                .returning(Follow.user_following_id,
+                           Follow.user_being_followed_id)
+                .execution_options(synchronize_session=False)):
+            deltas[actor]["following"] -= 1
+            deltas[target]["followers"] -= 1
+            unfollowed.append((actor, target))
+            changed["follows-"] += 1
+            timeline.remove_follow(actor, target)
+
+    recommendations.follows_changed(followed, unfollowed)
+    graph.follows_changed({**dict.fromkeys(followed, True),
+                           **dict.fromkeys(unfollowed, False)})
+
+
+def drain(batch_size):
+    """Apply and commit up to `batch_size` queued ops.
+
+    Returns (ops taken, Counter of rows changed).
+    """
+
+    queue = edgequeue.get_queue()
+    taken = queue.take(batch_size)
+    if not taken:
+        return 0, Counter()
+
+    try:
+        changed = apply([op for _, op in taken])
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    queue.done(taken[-1][0])
+    return len(taken), changed
+
+
+def overlay(items, user_id, kind, load):
+    """Show a user their queued changes on the first page of a list.
+
+    `items` are the page's users or messages, as loaded from the
+    database; `load(ids)` loads more of them. Queued additions go first
+    and queued removals are dropped.
+    """
+
+    changes = edgequeue.pending(user_id, kind)
+    if not changes:
+        return items
+
+    shown = {item.id for item in items}
+    added = [id for id, present in changes.items()
+             if present and id not in shown]
+
+    return ((load(added) if added else []) +
+            [item for item in items if changes.get(item.id, True)])
@@ -0,0 +1,172 @@
+"""An in-memory index of who follows whom.
+
+With FOLLOW_INDEX on, each app process holds the whole follows table as
+sorted integer arrays (see `FollowIndex`), so follow checks (see
+`User.following_ids()`) and followee lists (see `timeline.feed_version()`)
+are a binary search or an array slice rather than a query. graph.py
+builds it at startup and keeps it current.
+
+Run gunicorn with --preload and the workers start out sharing one copy
+of the arrays; each then only holds its own copies of the users whose
+follows have changed since. Once those copies add up to COMPACT_RATIO of
+the shared arrays (deleting a popular account changes every follower),
+they're folded into a new pair of arrays of the worker's own.
+"""
+
+import threading
+from array import array
+from bisect import bisect_left
+
+from flask import current_app, has_app_context
+
+# Compact once changed users' copies hold this many follows per follow in
+# the shared arrays.
+COMPACT_RATIO = 0.25
+
+
+class FollowIndex:
+    """Each user's followees, as a sorted array of user ids.
+
+    Starts from a graph.Graph's arrays, which are never changed: a user
+    whose follows change gets a new array of their own in `changed`, so
+    readers never see one half-updated. `compact()` swaps in new arrays
+    holding everyone's current follows.
+    """
+
+    def __init__(self, offsets, targets):
+        # Swapped as one, so readers never pair one's offsets with the
+        # other's targets.
+        self.base = (offsets, targets)
+        self.changed = {}
+        self.changed_edges = 0
+        self.compactions = 0
+        self.lock = threading.Lock()
+        # Kept by graph.py: the database time it last caught up from, and
+        # when (by time.monotonic()) it did that and pruned the log.
+        self.since = None
+        self.polled = self.pruned = 0.0
+
+    @property
+    def offsets(self):
+        return self.base[0]
+
+    @property
+    def targets(self):
+        return self.base[1]
+
+    def _row(self, user_id):
+        """(array, start, end) of this user's followees."""
+
+        # `changed` first: compact() swaps in the new base before it
+        # empties `changed`.
+        row = self.changed.get(user_id)
+        if row is not None:
+            return row, 0, len(row)
+        offsets, targets = self.base
+        if not 0 <= user_id < len(offsets) - 1:
+            return targets, 0, 0
+        return targets, offsets[user_id], offsets[user_id + 1]
+
+    def following(self, user_id):
+        """The ids this user follows, as a sorted array."""
+
+        row, start, end = self._row(user_id)
+        return row[start:end]
+
+    def follows(self, user_id, other_id):
+        """Does this user follow the other?"""
+
+        row, start, end = self._row(user_id)
+        i = bisect_left(row, other_id, start, end)
+        return i < end and row[i] == other_id
+
+    def set_following(self, user_id, followed_ids):
+        """Replace this user's followees."""
+
+        row = array("i", sorted(followed_ids))
+        old = self.changed.get(user_id)
+        self.changed_edges += len(row) - (len(old) if old is not None else 0)
+        self.changed[user_id] = row
+
+    def compact(self):
+        """Fold the changed users' follows into new shared arrays. Call
+        with the lock held."""
+
+        users = max(len(self.offsets) - 1, max(self.changed, default=-1) + 1)
+        offsets, targets = array("q", [0]), array("i")
+        for user_id in range(users):
+            row, start, end = self._row(user_id)
+            targets.extend(row[start:end])
+            offsets.append(len(targets))
+
+        self.base = (offsets, targets)
+        self.changed = {}
+        self.changed_edges = 0
+        self.compactions += 1
+
+    def compact_if_needed(self):
+        """compact() if the changed users' copies have grown too big. Call
+        with the lock held."""
+
+        if self.changed_edges > COMPACT_RATIO * len(self.targets):
+            self.compact()
+
+    def update(self, changes):
+        """Apply {(follower id, followed id): present?} changes."""
+
+        by_follower = {}
+        for (follower, followed), present in changes.items():
+            by_follower.setdefault(follower, {})[followed] = present
+
+        with self.lock:
+            for follower, followed in by_follower.items():
+                ids = set(self.following(follower))
+                ids |= {id for id, present in followed.items() if present}
+                ids -= {id for id, present in followed.items()
+                        if not present}
+                self.set_following(follower, ids)
+            self.compact_if_needed()
+
+    @property
+    def edges(self):
+        base = self.offsets[-1] if len(self.offsets) else 0
+        for user_id, row in self.changed.items():
+            if 0 <= user_id < len(self.offsets) - 1:
+                base -= self.offsets[user_id + 1] - self.offsets[user_id]
+            base += len(row)
+        return base
+
+    def nbytes(self):
+        """Bytes held in arrays: the shared ones and the changed copies."""
+
+        return sum(row.itemsize * len(row) for row in
+                   (self.offsets, self.targets, *self.changed.values()))
+
+    def stats(self):
+        edges = self.edges
+        nbytes = self.nbytes()
+        return {
+            "users": len(self.offsets) - 1,
+            "edges": edges,
+            "changed_users": len(self.changed),
+            "changed_edges": self.changed_edges,
+            "compactions": self.compactions,
+            "bytes": nbytes,
+            "bytes_per_million_edges": (round(nbytes / edges * 1_000_000)
+                                        if edges else None),
+        }
+
+
+def get_index():
+    """This app's FollowIndex, or None if FOLLOW_INDEX is off."""
+
+    if not has_app_context():
+        return None
+    return current_app.extensions.get("follow_index")
+
+
+def pending(session):
+    """Follow changes made in this session's transaction but not yet
+    committed, as {(follower id, followed id): present?}."""
+
+    return session.info.get("follow_index_changes", {})
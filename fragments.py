@@ -0,0 +1,161 @@
+"""Caching rendered pieces of templates.
+
+Templates mark the parts of a message or user card that look the same to
+every viewer:
+
+    {% cache "message", msg.id, msg.user.profile_version %}
+      ...
+    {% endcache %}
+
+The first argument is the kind of object and the second its id; the rest
+are versions of whatever else the fragment shows. The rendered HTML is
+stored under all of them plus the template and line, so a new profile
+version simply misses and renders afresh. Viewer-specific bits (like and
+follow buttons, which depend on who's looking) stay outside the blocks.
+
+Entries are also dropped once their object changes: a user's fragments
+when their profile is edited or they're deleted, a message's when it's
+deleted. Storage is a cache.py backend, picked with FRAGMENT_CACHE_URL.
+"""
+
+from flask import current_app
+from jinja2 import nodes
+from jinja2.ext import Extension
+from markupsafe import Markup
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from models import db, User, Message
+import cache
+
+PREFIX = "fragments"
+
+KINDS = {User: "user", Message: "message"}
+
+
+def _backend():
+    return current_app.extensions["warbler_fragments"]
+
+
+def _key(kind, id):
+    return f"{PREFIX}:{kind}:{id}:"
+
+
+def render(location, kind, id, versions, caller):
+    """The cached fragment for these keys, or caller()'s, cached."""
+
+    if not current_app.config["FRAGMENT_CACHE"]:
+        return caller()
+
+    backend = _backend()
+    key = _key(kind, id) + ":".join(map(str, [*versions, location]))
+
+    html = backend.get(key)
+    if html is not None:
+        backend.stats.add("hits")
+        return Markup(html)
+
+    backend.stats.add("misses")
+    html = caller()
+    backend.set(key, str(html))
+    backend.stats.add("sets")
+    return html
+
+
+def invalidate(kind, *ids):
+    """Drop the fragments of these users or messages."""
+
+    backend = _backend()
+    for id in ids:
+        backend.clear(_key(kind, id))
+    backend.stats.add("invalidations", len(ids))
+
+
+def stats():
+    """Fragment cache metrics, as a dict."""
+
+    backend = _backend()
+    return {
+        "backend": type(backend).__name__,
+        "entries": backend.size(),
+        **backend.stats.as_dict(),
+    }
+
+
+class FragmentCacheExtension(Extension):
+    """The {% cache kind, id, *versions %} ... {% endcache %} tag."""
+
+    tags = {"cache"}
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        kind = parser.parse_expression()
+        parser.stream.expect("comma")
+        id = parser.parse_expression()
+        versions = []
+        while parser.stream.skip_if("comma"):
+            versions.append(parser.parse_expression())
+        body = parser.parse_statements(("name:endcache",), drop_needle=True)
+
+        location = nodes.Const(f"{parser.name}:{lineno}")
+        call = self.call_method(
+            "_render", [location, kind, id, nodes.List(versions)])
+        return nodes.CallBlock(call, [], [], body).set_lineno(lineno)
+
+    def _render(self, location, kind, id, versions, caller):
+        return render(location, kind, id, versions, caller)
+
+
+def _stale(session):
+    return session.info.setdefault("fragments_stale", set())
+
+
+@event.listens_for(Session, "after_flush")
+def _after_flush(session, flush_context):
+    stale = _stale(session)
+
+    for obj in session.deleted:
+        if type(obj) in KINDS:
+            stale.add((KINDS[type(obj)], obj.id))
+
+    for obj in session.dirty:
+        if isinstance(obj, User) and any(
+                db.inspect(obj).attrs[name].history.has_changes()
+                for name in User.PROFILE_FIELDS):
+            stale.add(("user", obj.id))
+
+
+@event.listens_for(Session, "after_commit")
+def _after_commit(session):
+    stale = session.info.pop("fragments_stale", None)
+    if stale and current_app:
+        for kind, id in stale:
+            invalidate(kind, id)
+
+
+@event.listens_for(Session, "after_rollback")
+def _after_rollback(session):
+    session.info.pop("fragments_stale", None)
+
+
+def _after_drop(target, connection, **kw):
+    # Recreated tables reuse ids, so nothing rendered from before is right.
+    if current_app:
+        kinds = {model.__table__: kind for model, kind in KINDS.items()}
+        _backend().clear(f"{PREFIX}:{kinds[target]}:")
+
+
+for model in KINDS:
+    event.listen(model.__table__, "after_drop", _after_drop)
+
+
+def init_app(app):
+    """Add the {% cache %} tag, and set up storage from FRAGMENT_CACHE_*."""
+
+    app.jinja_env.add_extension(FragmentCacheExtension)
+    app.extensions["warbler_fragments"] = cache.make_backend(
+        app.config["FRAGMENT_CACHE_URL"],
+        cache.Stats(),
+        max_entries=app.config["FRAGMENT_CACHE_MAX_ENTRIES"],
+        ttl=app.config["FRAGMENT_CACHE_TTL"],
+    )
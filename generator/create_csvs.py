@@ -3,87 +3,258 @@
 Students won't need to run this for the exercise; they will just use the CSV
 files that this generates. You should only need to run this if you wanted to
 tweak the CSV formats or generate fewer/more rows.
+
+Run it from the top of the project:
+
+    python generator/create_csvs.py
+    python generator/create_csvs.py --users 1000000 --messages 10000000 \\
+        --follows 20000000 --likes 5000000 --workers 8 --out /tmp/warbler
+
+Output is the same for a given --seed no matter how many --workers run it.
+Image URLs come from the offline pools in image_urls.py; pass --unsplash
+to fetch fresh header images instead (needs UNSPLASH_CID).
 """
 
+import argparse
+import csv
 import os
-from dotenv import load_dotenv
+import random
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from time import perf_counter
 
-import csv
-from random import choice, randint, sample
-from itertools import permutations
-import requests
 from faker import Faker
-from helpers import get_random_datetime
-
-load_dotenv()
 
-UNSPLASH_CID = os.environ['UNSPLASH_CID']
+from helpers import (
+    get_random_datetime, message_author, sample_follows, sample_likes)
+from image_urls import HEADER_IMAGE_URLS, PROFILE_IMAGE_URLS
 
 MAX_WARBLER_LENGTH = 140
 
 USERS_CSV_HEADERS = ['email', 'username', 'image_url', 'password', 'bio', 'header_image_url', 'location']
 MESSAGES_CSV_HEADERS = ['text', 'timestamp', 'user_id']
 FOLLOWS_CSV_HEADERS = ['user_being_followed_id', 'user_following_id']
+LIKES_CSV_HEADERS = ['user_id', 'message_id']
 
 NUM_USERS = 300
 NUM_MESSAGES = 1000
 NUM_FOLLWERS = 5000
+NUM_LIKES = 0
+
+# bcrypt hash of "password"
+PASSWORD_HASH = '$2b$12$Q1PUFjhN/AWRQ21LbGYvjeLpZZB6lfZ1BPwifHALGO6oIbyC3CmJe'
+
+# Rows per part file; parts are what worker processes work on.
+PART_SIZE = 200_000
+
+# Rows buffered before each write.
+CHUNK_SIZE = 10_000
+
+# Faker is slow, so each part draws from pools of fake text made up front.
+POOL_SIZE = 2000
+
+
+def fetch_unsplash_header_urls():
+    """Get header image URLs from the Unsplash API.
+
+    NOTE: You will need to create a dev account at unsplash.com,
+    generate an access key and set that to an environment
+    variable to successfully ping the API.
+    """
+
+    import requests
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    cid = os.environ['UNSPLASH_CID']
+
+    resp = requests.get(
+        "https://api.unsplash.com/topics/wallpapers/photos"
+        f"?per_page=30&orientation=landscape&client_id={cid}"
+    )
+    return [photo['urls']['regular'] for photo in resp.json()]
+
+
+def part_rng(seed, table, part):
+    """A random generator for one part of one table's output."""
+
+    return random.Random(f"{seed}:{table}:{part}")
+
+
+def fake_pools(rng):
+    """Pools of fake text, seeded from `rng`."""
+
+    fake = Faker()
+    fake.seed_instance(rng.random())
+
+    return dict(
+        user_names=[fake.user_name() for _ in range(POOL_SIZE)],
+        domains=[fake.free_email_domain() for _ in range(50)],
+        bios=[fake.sentence() for _ in range(POOL_SIZE)],
+        cities=[fake.city() for _ in range(POOL_SIZE)],
+        texts=[fake.paragraph()[:MAX_WARBLER_LENGTH]
+               for _ in range(POOL_SIZE)],
+    )
+
+
+def write_chunked(path, rows):
+    """Write rows to a headerless CSV, CHUNK_SIZE rows at a time."""
+
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        chunk = []
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) == CHUNK_SIZE:
+                writer.writerows(chunk)
+                chunk = []
+        writer.writerows(chunk)
+
+
+def user_rows(first_id, last_id, rng, header_image_urls, password):
+    pools = fake_pools(rng)
+
+    for user_id in range(first_id, last_id + 1):
+        # The id suffix keeps usernames and emails unique at any size.
+        username = f"{rng.choice(pools['user_names'])}{user_id}"
+        yield (
+            f"{username}@{rng.choice(pools['domains'])}",
+            username,
+            rng.choice(PROFILE_IMAGE_URLS),
+            password,
+            rng.choice(pools['bios']),
+            rng.choice(header_image_urls),
+            rng.choice(pools['cities'])[:30],
+        )
+
+
+def message_rows(first_id, count, num_users, rng, now, seed):
+    pools = fake_pools(rng)
+
+    for message_id in range(first_id, first_id + count):
+        yield (
+            rng.choice(pools['texts']),
+            get_random_datetime(rng=rng, now=now),
+            message_author(message_id, num_users, seed),
+        )
+
+
+def write_part(job):
+    """Write one part file. Runs in a worker process."""
+
+    table, part, path, args, header_image_urls, now, password = job
+    rng = part_rng(args.seed, table, part)
+    first = part * PART_SIZE
+
+    if table == 'users':
+        last = min(first + PART_SIZE, args.users)
+        rows = user_rows(first + 1, last, rng, header_image_urls, password)
+    elif table == 'messages':
+        count = min(PART_SIZE, args.messages - first)
+        rows = message_rows(first + 1, count, args.users, rng, now,
+                            args.seed)
+    elif table == 'follows':
+        followers = range(first + 1, min(first + PART_SIZE, args.users) + 1)
+        rows = sample_follows(args.users, args.follows, rng,
+                              exponent=args.exponent, followers=followers)
+    else:
+        likers = range(first + 1, min(first + PART_SIZE, args.users) + 1)
+        rows = sample_likes(
+            args.users, args.messages, args.likes, rng, likers=likers,
+            author_of=lambda message_id: message_author(
+                message_id, args.users, args.seed))
+
+    write_chunked(path, rows)
+    return path
+
+
+def parts_for(table, args):
+    """How many parts a table is split into."""
+
+    if table == 'messages':
+        rows = args.messages
+    elif table in ('follows', 'likes') and not getattr(args, table):
+        rows = 0
+    else:
+        # users, and follows/likes, which are split by user id range
+        rows = args.users
+
+    return -(-rows // PART_SIZE)
+
+
+def generate(args, header_image_urls, password=PASSWORD_HASH):
+    """Write every table's CSV into args.out."""
+
+    tables = [
+        ('users', USERS_CSV_HEADERS),
+        ('messages', MESSAGES_CSV_HEADERS),
+        ('follows', FOLLOWS_CSV_HEADERS),
+        ('likes', LIKES_CSV_HEADERS),
+    ]
+
+    # Timestamps are relative to the start of today, so a given seed gives
+    # the same output all day.
+    now = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+
+    jobs = [
+        (table, part, os.path.join(args.out, f'{table}.part{part:05d}.csv'),
+         args, header_image_urls, now, password)
+        for table, _ in tables
+        for part in range(parts_for(table, args))
+    ]
+
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        part_paths = list(pool.map(write_part, jobs))
+
+    # Stitch the parts together in order, behind one header row.
+    for table, headers in tables:
+        with open(os.path.join(args.out, f'{table}.csv'), 'w',
+                  newline='') as out:
+            csv.writer(out).writerow(headers)
+            for path in part_paths:
+                if os.path.basename(path).startswith(f'{table}.part'):
+                    with open(path) as part:
+                        shutil.copyfileobj(part, out)
+                    os.remove(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument('--users', type=int, default=NUM_USERS)
+    parser.add_argument('--messages', type=int, default=NUM_MESSAGES)
+    parser.add_argument('--follows', type=int, default=NUM_FOLLWERS,
+                        help="approximate number of follows")
+    parser.add_argument('--likes', type=int, default=NUM_LIKES,
+                        help="approximate number of likes")
+    parser.add_argument('--exponent', type=float, default=1.0,
+                        help="power-law exponent for follower popularity")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--out', default='generator')
+    parser.add_argument('--bcrypt-rounds', type=int,
+                        help="re-hash the shared password at this cost")
+    parser.add_argument('--unsplash', action='store_true',
+                        help="fetch header images from the Unsplash API")
+    args = parser.parse_args()
+
+    os.makedirs(args.out, exist_ok=True)
+
+    header_image_urls = (fetch_unsplash_header_urls() if args.unsplash
+                         else HEADER_IMAGE_URLS)
+
+    password = PASSWORD_HASH
+    if args.bcrypt_rounds:
+        import bcrypt
+        password = bcrypt.hashpw(
+            b"password", bcrypt.gensalt(args.bcrypt_rounds)).decode()
+
+    start = perf_counter()
+    generate(args, header_image_urls, password)
+    print(f"Wrote {args.users} users, {args.messages} messages, "
+          f"~{args.follows} follows and ~{args.likes} likes to {args.out} "
+          f"in {perf_counter() - start:.1f}s")
+
 
-fake = Faker()
-
-# Generate random profile image URLs to use for users
-
-image_urls = [
-    f"https://randomuser.me/api/portraits/{kind}/{i}.jpg"
-    for kind, count in [("lego", 10), ("men", 100), ("women", 100)]
-    for i in range(count)
-]
-
-# Generate random header image URLs to use for users
-# NOTE: You will need to create a dev account at unsplash.com, 
-# generate an access key and set that to an environment
-# variable to successfully ping the API. 
-
-header_image_urls = [
-    requests.get(
-        "https://api.unsplash.com/topics/wallpapers/photos" \
-        f"?per_page=30&orientation=landscape&client_id={UNSPLASH_CID}"
-    ).json()[i]['urls']['regular'] for i in range(0,29)
-]
-
-with open('generator/users.csv', 'w') as users_csv:
-    users_writer = csv.DictWriter(users_csv, fieldnames=USERS_CSV_HEADERS)
-    users_writer.writeheader()
-
-    for i in range(NUM_USERS):
-        users_writer.writerow(dict(
-            email=fake.email(),
-            username=fake.user_name(),
-            image_url=choice(image_urls),
-            password='$2b$12$Q1PUFjhN/AWRQ21LbGYvjeLpZZB6lfZ1BPwifHALGO6oIbyC3CmJe',
-            bio=fake.sentence(),
-            header_image_url=choice(header_image_urls),
-            location=fake.city()
-        ))
-
-with open('generator/messages.csv', 'w') as messages_csv:
-    messages_writer = csv.DictWriter(messages_csv, fieldnames=MESSAGES_CSV_HEADERS)
-    messages_writer.writeheader()
-
-    for i in range(NUM_MESSAGES):
-        messages_writer.writerow(dict(
-            text=fake.paragraph()[:MAX_WARBLER_LENGTH],
-            timestamp=get_random_datetime(),
-            user_id=randint(1, NUM_USERS)
-        ))
-
-# Generate follows.csv from random pairings of users
-
-with open('generator/follows.csv', 'w') as follows_csv:
-    all_pairs = list(permutations(range(1, NUM_USERS + 1), 2))
-
-    users_writer = csv.DictWriter(follows_csv, fieldnames=FOLLOWS_CSV_HEADERS)
-    users_writer.writeheader()
-
-    for followed_user, follower in sample(all_pairs, NUM_FOLLWERS):
-        users_writer.writerow(dict(user_being_followed_id=followed_user, user_following_id=follower))
+if __name__ == '__main__':
+    main()
@@ -1,14 +1,107 @@
 """Support functions for CSV generation."""
 
 from datetime import datetime
-from random import uniform
+import random
 
 
-def get_random_datetime(year_gap=2):
-    """Get a random datetime within the last few years."""
+def get_random_datetime(year_gap=2, rng=random, now=None):
+    """Get a random datetime within the last few years (before `now`)."""
 
-    now = datetime.now()
+    now = now or datetime.now()
     then = now.replace(year=now.year - year_gap)
-    random_timestamp = uniform(then.timestamp(), now.timestamp())
+    random_timestamp = rng.uniform(then.timestamp(), now.timestamp())
 
     return datetime.fromtimestamp(random_timestamp)
+
+
+def zipf_cum_weights(n, exponent=1.0):
+    """Cumulative weights giving item i a probability proportional to
+    1 / (i + 1) ** exponent, for use with random.choices(cum_weights=...).
+    """
+
+    total = 0.0
+    cum_weights = []
+    for rank in range(1, n + 1):
+        total += rank ** -exponent
+        cum_weights.append(total)
+
+    return cum_weights
+
+
+def sample_follows(num_users, num_follows, rng, exponent=1.0,
+                   followers=None):
+    """Yield about `num_follows` distinct (followed, follower) id pairs.
+
+    User ids run from 1 to `num_users`. Who gets followed follows a power
+    law (a few users have most of the followers), and how many users each
+    follower follows is exponentially distributed. Pass a range of ids as
+    `followers` to generate just those users' follows, with the same
+    average per follower. Works one follower at a time, so memory stays
+    small.
+    """
+
+    user_ids = range(1, num_users + 1)
+    cum_weights = zipf_cum_weights(num_users, exponent)
+    mean_degree = num_follows / num_users
+
+    for follower in followers or user_ids:
+        degree = min(num_users - 1,
+                     round(rng.expovariate(1 / mean_degree)))
+        followed = set()
+
+        # Popular users get drawn repeatedly; top up a few times so the
+        # follower still ends up near their target degree.
+        for _ in range(5):
+            followed.update(rng.choices(user_ids, cum_weights=cum_weights,
+                                        k=degree - len(followed)))
+            followed.discard(follower)
+            if len(followed) >= degree:
+                break
+
+        for followed_id in sorted(followed):
+            yield followed_id, follower
+
+
+def message_author(message_id, num_users, seed=0):
+    """The id of the user who wrote message `message_id`.
+
+    A hash of the id (splitmix64), so authors are spread uniformly over
+    users and anything can look one up without the messages CSV.
+    """
+
+    x = (message_id + seed * 0x9E3779B97F4A7C15) & 0xFFFFFFFFFFFFFFFF
+    x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & 0xFFFFFFFFFFFFFFFF
+    x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & 0xFFFFFFFFFFFFFFFF
+    x ^= x >> 31
+
+    return x % num_users + 1
+
+
+def sample_likes(num_users, num_messages, num_likes, rng, likers=None,
+                 author_of=None):
+    """Yield about `num_likes` distinct (user_id, message_id) pairs.
+
+    Each user likes an exponentially distributed number of messages, picked
+    uniformly. Pass a range of ids as `likers` to generate just those
+    users' likes. Users can't like their own messages, so pass
+    `author_of(message_id)` to skip those.
+    """
+
+    mean_likes = num_likes / num_users
+    message_ids = range(1, num_messages + 1)
+
+    for user_id in likers or range(1, num_users + 1):
+        count = min(num_messages, round(rng.expovariate(1 / mean_likes)))
+        liked = set()
+
+        # Top up a few times to make up for skipped own messages.
+        for _ in range(5):
+            liked.update(rng.sample(message_ids, count - len(liked)))
+            if author_of:
+                liked = {message_id for message_id in liked
+                         if author_of(message_id) != user_id}
+            if len(liked) >= count:
+                break
+
+        for message_id in sorted(liked):
+            yield user_id, message_id
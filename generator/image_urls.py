@@ -0,0 +1,131 @@
+"""Offline image URL pools for CSV generation.
+
+HEADER_IMAGE_URLS were collected once from the Unsplash "wallpapers" topic
+(see fetch_unsplash_header_urls in create_csvs.py), so generating data
+needs no API key or network access.
+"""
+
+PROFILE_IMAGE_URLS = [
+    f"https://randomuser.me/api/portraits/{kind}/{i}.jpg"
+    for kind, count in [("lego", 10), ("men", 100), ("women", 100)]
+    for i in range(count)
+]
+
+HEADER_IMAGE_URLS = [
+    ("https://images.unsplash.com/photo-1573996987033-47fd3a4ca35e?"
+     "crop=entropy&cs=tinysrgb&fit=max&fm=jpg"
+     "&ixid=Mnw0MDQ3ODB8MHwxfHRvcGljfHxibzhqUUtUYUUwWXx8fHx8Mnx8MTY3NTEyOTI0NQ"
+     "&ixlib=rb-4.0.3&q=80&w=1080"),
+    ("https://images.unsplash.com/photo-1574001412492-7555e61a9b53?"
+     "crop=entropy&cs=tinysrgb&fit=max&fm=jpg"
+     "&ixid=Mnw0MDQ3ODB8MHwxfHRvcGljfHxibzhqUUtUYUUwWXx8fHx8Mnx8MTY3NTEyOTI0NQ"
+     "&ixlib=rb-4.0.3&q=80&w=1080"),
+    ("https://images.unsplash.com/photo-1575015642299-5b92fcbd0ba4?"
+     "crop=entropy&cs=tinysrgb&fit=max&fm=jpg"
+     "&ixid=Mnw0MDQ3ODB8MHwxfHRvcGljfHxibzhqUUtUYUUwWXx8fHx8Mnx8MTY3NTEyOTI0NQ"
+     "&ixlib=rb-4.0.3&q=80&w=1080"),
+    ("https://images.unsplash.com/photo-1647598939382-5637f4eeb7b9?"
+     "crop=entropy&cs=tinysrgb&fit=max&fm=jpg"
+     "&ixid=Mnw0MDQ3ODB8MHwxfHRvcGljfHxibzhqUUtUYUUwWXx8fHx8Mnx8MTY3NTEyOTI0NQ"
+     "&ixlib=rb-4.0.3&q=80&w=1080"),
+    ("https://images.unsplash.com/photo-1653061853347-4fbf052530e9?"
+     "crop=entropy&cs=tinysrgb&fit=max&fm=jpg"
+     "&ixid=Mnw0MDQ3ODB8MHwxfHRvcGljfHxibzhqUUtUYUUwWXx8fHx8Mnx8MTY3NTEyOTI0NQ"
+     "&ixlib=rb-4.0.3&q=80&w=1080"),
+    ("https://images.unsplash.com/photo-1668353064375-d3dcd3346d53?"
+     "crop=entropy&cs=tinysrgb&fit=max&fm=jpg"
+     "&ixid=Mnw0MDQ3ODB8MHwxfHRvcGljfHxibzhqUUtUYUUwWXx8fHx8Mnx8MTY3NTEyOTI0NQ"
+     "&ixlib=rb-4.0.3&q=80&w=1080"),
+    ("https://images.unsplash.com/photo-1669375957059-0cd563ba4a02?"
+     "crop=entropy&cs=tinysrgb&fit=max&fm=jpg"
+     "&ixid=Mnw0MDQ3ODB8MHwxfHRvcGljfHxibzhqUUtUYUUwWXx8fHx8Mnx8MTY3NTEyOTI0NQ"
+     "&ixlib=rb-4.0.3&q=80&w=1080"),
+    ("https://images.unsplash.com/photo-1673844968943-694c71e94e93?"
+     "crop=entropy&cs=tinysrgb&fit=max&fm=jpg"
+     "&ixid=Mnw0MDQ3ODB8MHwxfHRvcGljfHxibzhqUUtUYUUwWXx8fHx8Mnx8MTY3NTEyOTI0NQ"
+     "&ixlib=rb-4.0.3&q=80&w=1080"),
+    ("https://images.unsplash.com/photo-1673950455470-d872dcec6eb1?"
+     "crop=entropy&cs=tinysrgb&fit=max&fm=jpg"
+     "&ixid=Mnw0MDQ3ODB8MHwxfHRvcGljfHxibzhqUUtUYUUwWXx8fHx8Mnx8MTY3NTEyOTI0NQ"
+     "&ixlib=rb-4.0.3&q=80&w=1080"),
+    ("https://images.unsplash.com/photo-1674240568812-d7481f3699a7?"
+     "crop=entropy&cs=tinysrgb&fit=max&fm=jpg"
+     "&ixid=Mnw0MDQ3ODB8MHwxfHRvcGljfHxibzhqUUtUYUUwWXx8fHx8Mnx8MTY3NTEyOTI0NQ"
+     "&ixlib=rb-4.0.3&q=80&w=1080"),
+    ("https://images.unsplash.com/photo-1674318012388-141651b08a51?"
+     "crop=entropy&cs=tinysrgb&fit=max&fm=jpg"
+     "&ixid=Mnw0MDQ3ODB8MHwxfHRvcGljfHxibzhqUUtUYUUwWXx8fHx8Mnx8MTY3NTEyOTI0NQ"
+     "&ixlib=rb-4.0.3&q=80&w=1080"),
+    ("https://images.unsplash.com/photo-1674394006641-b680753c502b?"
+     "crop=entropy&cs=tinysrgb&fit=max&fm=jpg"
+     "&ixid=Mnw0MDQ3ODB8MHwxfHRvcGljfHxibzhqUUtUYUUwWXx8fHx8Mnx8MTY3NTEyOTI0NQ"
+     "&ixlib=rb-4.0.3&q=80&w=1080"),
+    ("https://images.unsplash.com/photo-1674407728563-f30774195b0f?"
+     "crop=entropy&cs=tinysrgb&fit=max&fm=jpg"
+     "&ixid=Mnw0MDQ3ODB8MHwxfHRvcGljfHxibzhqUUtUYUUwWXx8fHx8Mnx8MTY3NTEyOTI0NQ"
+     "&ixlib=rb-4.0.3&q=80&w=1080"),
+    ("https://images.unsplash.com/photo-1674420628423-bf7a338af32d?"
+     "crop=entropy&cs=tinysrgb&fit=max&fm=jpg"
+     "&ixid=Mnw0MDQ3ODB8MHwxfHRvcGljfHxibzhqUUtUYUUwWXx8fHx8Mnx8MTY3NTEyOTI0NQ"
+     "&ixlib=rb-4.0.3&q=80&w=1080"),
+    ("https://images.unsplash.com/photo-1674493310933-e681279e5664?"
+     "crop=entropy&cs=tinysrgb&fit=max&fm=jpg"
+     "&ixid=Mnw0MDQ3ODB8MHwxfHRvcGljfHxibzhqUUtUYUUwWXx8fHx8Mnx8MTY3NTEyOTI0NQ"
+     "&ixlib=rb-4.0.3&q=80&w=1080"),
+    ("https://images.unsplash.com/photo-1674500021669-27da4b40772a?"
+     "crop=entropy&cs=tinysrgb&fit=max&fm=jpg"
+     "&ixid=Mnw0MDQ3ODB8MHwxfHRvcGljfHxibzhqUUtUYUUwWXx8fHx8Mnx8MTY3NTEyOTI0NQ"
+     "&ixlib=rb-4.0.3&q=80&w=1080"),
+    ("https://images.unsplash.com/photo-1674505681324-3ef7edf8415b?"
+     "crop=entropy&cs=tinysrgb&fit=max&fm=jpg"
+     "&ixid=Mnw0MDQ3ODB8MHwxfHRvcGljfHxibzhqUUtUYUUwWXx8fHx8Mnx8MTY3NTEyOTI0NQ"
+     "&ixlib=rb-4.0.3&q=80&w=1080"),
+    ("https://images.unsplash.com/photo-1674530493752-719b5514a7f2?"
+     "crop=entropy&cs=tinysrgb&fit=max&fm=jpg"
+     "&ixid=Mnw0MDQ3ODB8MHwxfHRvcGljfHxibzhqUUtUYUUwWXx8fHx8Mnx8MTY3NTEyOTI0NQ"
+     "&ixlib=rb-4.0.3&q=80&w=1080"),
+    ("https://images.unsplash.com/photo-1674575496466-5119fd691bf4?"
+     "crop=entropy&cs=tinysrgb&fit=max&fm=jpg"
+     "&ixid=Mnw0MDQ3ODB8MHwxfHRvcGljfHxibzhqUUtUYUUwWXx8fHx8Mnx8MTY3NTEyOTI0NQ"
+     "&ixlib=rb-4.0.3&q=80&w=1080"),
+    ("https://images.unsplash.com/photo-1674580351112-42fdbbae9c86?"
+     "crop=entropy&cs=tinysrgb&fit=max&fm=jpg"
+     "&ixid=Mnw0MDQ3ODB8MHwxfHRvcGljfHxibzhqUUtUYUUwWXx8fHx8Mnx8MTY3NTEyOTI0NQ"
+     "&ixlib=rb-4.0.3&q=80&w=1080"),
+    ("https://images.unsplash.com/photo-1674653743689-c8e507e3dee8?"
+     "crop=entropy&cs=tinysrgb&fit=max&fm=jpg"
+     "&ixid=Mnw0MDQ3ODB8MHwxfHRvcGljfHxibzhqUUtUYUUwWXx8fHx8Mnx8MTY3NTEyOTI0NQ"
+     "&ixlib=rb-4.0.3&q=80&w=1080"),
+    ("https://images.unsplash.com/photo-1674653844677-b98dfbbc0ac5?"
+     "crop=entropy&cs=tinysrgb&fit=max&fm=jpg"
+     "&ixid=Mnw0MDQ3ODB8MHwxfHRvcGljfHxibzhqUUtUYUUwWXx8fHx8Mnx8MTY3NTEyOTI0NQ"
+     "&ixlib=rb-4.0.3&q=80&w=1080"),
+    ("https://images.unsplash.com/photo-1674673858080-fb524d0280a4?"
+     "crop=entropy&cs=tinysrgb&fit=max&fm=jpg"
+     "&ixid=Mnw0MDQ3ODB8MHwxfHRvcGljfHxibzhqUUtUYUUwWXx8fHx8Mnx8MTY3NTEyOTI0NQ"
+     "&ixlib=rb-4.0.3&q=80&w=1080"),
+    ("https://images.unsplash.com/photo-1674690017732-63c3c5f8088c?"
+     "crop=entropy&cs=tinysrgb&fit=max&fm=jpg"
+     "&ixid=Mnw0MDQ3ODB8MHwxfHRvcGljfHxibzhqUUtUYUUwWXx8fHx8Mnx8MTY3NTEyOTI0NQ"
+     "&ixlib=rb-4.0.3&q=80&w=1080"),
+    ("https://images.unsplash.com/photo-1674754666443-696bc5b522f3?"
+     "crop=entropy&cs=tinysrgb&fit=max&fm=jpg"
+     "&ixid=Mnw0MDQ3ODB8MHwxfHRvcGljfHxibzhqUUtUYUUwWXx8fHx8Mnx8MTY3NTEyOTI0NQ"
+     "&ixlib=rb-4.0.3&q=80&w=1080"),
+    ("https://images.unsplash.com/photo-1674754666581-4e6657392655?"
+     "crop=entropy&cs=tinysrgb&fit=max&fm=jpg"
+     "&ixid=Mnw0MDQ3ODB8MHwxfHRvcGljfHxibzhqUUtUYUUwWXx8fHx8Mnx8MTY3NTEyOTI0NQ"
+     "&ixlib=rb-4.0.3&q=80&w=1080"),
+    ("https://images.unsplash.com/photo-1674756142722-14266beb51d6?"
+     "crop=entropy&cs=tinysrgb&fit=max&fm=jpg"
+     "&ixid=Mnw0MDQ3ODB8MHwxfHRvcGljfHxibzhqUUtUYUUwWXx8fHx8Mnx8MTY3NTEyOTI0NQ"
+     "&ixlib=rb-4.0.3&q=80&w=1080"),
+    ("https://images.unsplash.com/photo-1674824959440-09442ed75a8e?"
+     "crop=entropy&cs=tinysrgb&fit=max&fm=jpg"
+     "&ixid=Mnw0MDQ3ODB8MHwxfHRvcGljfHxibzhqUUtUYUUwWXx8fHx8Mnx8MTY3NTEyOTI0NQ"
+     "&ixlib=rb-4.0.3&q=80&w=1080"),
+    ("https://images.unsplash.com/photo-1674856320411-8c63716007d6?"
+     "crop=entropy&cs=tinysrgb&fit=max&fm=jpg"
+     "&ixid=Mnw0MDQ3ODB8MHwxfHRvcGljfHxibzhqUUtUYUUwWXx8fHx8Mnx8MTY3NTEyOTI0NQ"
+     "&ixlib=rb-4.0.3&q=80&w=1080"),
+]
@@ -0,0 +1,230 @@
+"""The follows graph as compact integer arrays.
+
+`load_follows()` reads the whole follows table with one COPY and builds
+a `Graph` in CSR ("compressed sparse row") form: user u's followees are
+`targets[offsets[u]:offsets[u + 1]]`, sorted. That's 4 bytes per follow
+plus 8 per user id, against hundreds of bytes per row as ORM objects or
+Python sets, and it pickles to worker processes as two flat buffers.
+
+With FOLLOW_INDEX on, `init_app()` also loads one at startup as the app's
+followindex.FollowIndex, and keeps it current:
+
+- follows added or removed through edges.py or deletions.py call
+  `follows_changed()`, which holds them in the session until it commits
+  and then updates this process's index;
+- it also logs the followers in `follow_changes` (pruned of entries
+  older than FOLLOW_INDEX_KEEP_HOURS as it goes), and before a request,
+  at most every FOLLOW_INDEX_POLL_SECONDS, each process reloads the
+  followees of users logged since it last looked. An index that hasn't
+  looked for longer than the log is kept is loaded afresh instead.
+
+Follows changed any other way (seed.py, or the ORM relationships) aren't
+seen until the next restart.
+
+The index is always read from the primary, even in requests whose reads
+go to a replica (see routing.py): a lagging replica could miss logged
+changes, and its clock would set where the next look starts.
+"""
+
+from array import array
+from datetime import timedelta
+from itertools import groupby
+from time import monotonic
+
+from flask import current_app
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from models import db, Follow, FollowChange
+import followindex
+
+# How much earlier than its last look an index looks again, to catch
+# changes committed by transactions that started before then.
+SLACK = timedelta(minutes=1)
+
+COPY_FOLLOWS = (
+    "COPY (SELECT user_following_id, user_being_followed_id FROM follows "
+    "ORDER BY user_following_id, user_being_followed_id) TO STDOUT")
+
+
+def _primary():
+    """Bind arguments that run a statement on the primary."""
+
+    return {"bind": db.engine}
+
+
+class Graph:
+    """Who follows whom, indexed by user id."""
+
+    def __init__(self, offsets, targets):
+        self.offsets = offsets
+        self.targets = targets
+
+    @property
+    def max_user_id(self):
+        return len(self.offsets) - 2
+
+    @property
+    def edges(self):
+        return len(self.targets)
+
+    def following(self, user_id):
+        """The ids this user follows, as a sorted array."""
+
+        if not 0 <= user_id <= self.max_user_id:
+            return array("i")
+        return self.targets[self.offsets[user_id]:self.offsets[user_id + 1]]
+
+    def nbytes(self):
+        return (self.offsets.itemsize * len(self.offsets) +
+                self.targets.itemsize * len(self.targets))
+
+
+class _EdgeReader:
+    """A file-like sink for COPY that parses "follower<TAB>followed" lines
+    into two arrays as they arrive."""
+
+    def __init__(self):
+        self.sources = array("i")
+        self.targets = array("i")
+        self.rest = b""
+
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode()
+        data = self.rest + data
+        end = data.rfind(b"\n") + 1
+        self.rest = data[end:]
+
+        numbers = array("i", map(int, data[:end].split()))
+        self.sources.extend(numbers[0::2])
+        self.targets.extend(numbers[1::2])
+
+
+def build(sources, targets, max_user_id):
+    """A Graph from edge arrays sorted by (source, target)."""
+
+    counts = array("q", bytes(8 * (max_user_id + 2)))
+    for source in sources:
+        counts[source + 1] += 1
+
+    total = 0
+    for i, count in enumerate(counts):
+        total += count
+        counts[i] = total
+
+    return Graph(counts, targets)
+
+
+def load_follows():
+    """Read the follows table into a Graph."""
+
+    connection = db.session.connection(bind_arguments=_primary())
+    max_user_id = connection.scalar(db.text(
+        "SELECT coalesce(max(id), 0) FROM users"))
+
+    reader = _EdgeReader()
+    with connection.connection.cursor() as cursor:
+        cursor.copy_expert(COPY_FOLLOWS, reader)
+
+    return build(reader.sources, reader.targets, max_user_id)
+
+
+def load_index():
+    """Read the follows table into a FollowIndex."""
+
+    since = db.session.scalar(db.select(db.func.now()),
+                              bind_arguments=_primary())
+    follows = load_follows()
+
+    index = followindex.FollowIndex(follows.offsets, follows.targets)
+    index.since = since
+    index.polled = index.pruned = monotonic()
+    return index
+
+
+def follows_changed(changes):
+    """Note {(follower id, followed id): present?} follow changes made in
+    this transaction, for the follow indexes."""
+
+    if followindex.get_index() is None or not changes:
+        return
+
+    db.session.info.setdefault("follow_index_changes", {}).update(changes)
+    db.session.execute(db.insert(FollowChange), [
+        {"user_id": follower}
+        for follower in sorted({follower for follower, _ in changes})
+    ])
+
+    # Writes go to the primary, so the log is pruned from here, hourly.
+    index = followindex.get_index()
+    if monotonic() - index.pruned >= 3600:
+        keep = timedelta(hours=current_app.config["FOLLOW_INDEX_KEEP_HOURS"])
+        db.session.execute(
+            db.delete(FollowChange)
+            .where(FollowChange.changed_at < db.func.now() - keep))
+        index.pruned = monotonic()
+
+
+@event.listens_for(Session, "after_commit")
+def _apply_changes(session):
+    changes = session.info.pop("follow_index_changes", None)
+    index = followindex.get_index()
+    if changes and index is not None:
+        index.update(changes)
+
+
+@event.listens_for(Session, "after_rollback")
+def _drop_changes(session):
+    session.info.pop("follow_index_changes", None)
+
+
+def catch_up(index):
+    """Reload the followees of users whose follows other processes have
+    changed since `index` last looked."""
+
+    since, user_ids = db.session.execute(db.select(
+        db.func.now(),
+        db.select(db.func.array_agg(FollowChange.user_id.distinct()))
+        .where(FollowChange.changed_at >= index.since - SLACK)
+        .scalar_subquery()), bind_arguments=_primary()).one()
+
+    if user_ids:
+        rows = db.session.execute(
+            db.select(Follow.user_following_id, Follow.user_being_followed_id)
+            .where(Follow.user_following_id.in_(user_ids))
+            .order_by(Follow.user_following_id,
+                      Follow.user_being_followed_id),
+            bind_arguments=_primary()).all()
+        followees = {follower: [followed for _, followed in group]
+                     for follower, group in groupby(rows, lambda row: row[0])}
+        with index.lock:
+            for user_id in user_ids:
+                index.set_following(user_id, followees.get(user_id, ()))
+            index.compact_if_needed()
+
+    index.since = since
+    index.polled = monotonic()
+
+
+def _before_request():
+    index = followindex.get_index()
+    if index is None:
+        return
+
+    age = monotonic() - index.polled
+    if age > current_app.config["FOLLOW_INDEX_KEEP_HOURS"] * 3600:
+        current_app.extensions["follow_index"] = load_index()
+    elif age >= current_app.config["FOLLOW_INDEX_POLL_SECONDS"]:
+        catch_up(index)
+
+
+def init_app(app):
+    """Load the follow index, if FOLLOW_INDEX is on."""
+
+    if app.config["FOLLOW_INDEX"]:
+        with app.app_context():
+            app.extensions["follow_index"] = load_index()
+            db.session.commit()
+
+    app.before_request(_before_request)
@@ -0,0 +1,140 @@
+"""HTTP caching policy: validators, 304s and Cache-Control.
+
+Pages that can tell cheaply whether they've changed call `check()` with
+the versions of everything they show (see User.profile_version and
+User.activity_version) before doing the work of rendering. The versions
+become a weak ETag; a request whose If-None-Match (or If-Modified-Since)
+already matches gets a 304 straight away. Such pages are sent as
+"private, no-cache" (browsers keep them but ask each time) unless the
+route passes other Cache-Control directives.
+
+For logged-in users, ETags also cover likes and follows still queued in
+edgequeue.py (not yet counted in activity_version), and change every half
+WTF_CSRF_TIME_LIMIT, since pages carry a CSRF token that expires. A page with flashed messages
+waiting is never tagged: it's only right once.
+
+Static files linked with `url_for('static', ...)` get a `v=` hash of their
+contents in the URL and are cached for a year as immutable. Other static
+requests are revalidated with Flask's own ETag and Last-Modified.
+
+Anything else is sent no-store, as before.
+"""
+
+import hashlib
+import os
+from datetime import timezone
+from functools import lru_cache
+from time import time
+
+from flask import abort, current_app, g, request, session
+
+import edgequeue
+
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+
+def etag(*parts):
+    """A short tag for these version parts."""
+
+    return hashlib.sha1(repr(parts).encode()).hexdigest()[:20]
+
+
+def _fresh(tag, last_modified):
+    if request.if_none_match:
+        return request.if_none_match.contains_weak(tag)
+    if last_modified is not None and request.if_modified_since:
+        last_modified = last_modified.replace(microsecond=0,
+                                              tzinfo=timezone.utc)
+        return last_modified <= request.if_modified_since
+    return False
+
+
+def check(*parts, last_modified=None, **directives):
+    """Answer with a 304 now if the client has this version of the page.
+
+    `parts` are whatever versions the page is built from; the current
+    user's id is added. Otherwise, the response gets a weak ETag (and
+    `last_modified`, a naive UTC datetime, if given), and Cache-Control
+    `directives` such as public=True, max_age=60.
+    """
+
+    if "_flashes" in session:
+        return
+
+    if g.get("user"):
+        limit = current_app.config.get("WTF_CSRF_TIME_LIMIT") or 3600
+        queued = [sorted(edgequeue.pending(g.user.id, kind).items())
+                  for kind in ("like", "follow")]
+        parts = (g.user.id, int(time() // (limit / 2)), queued, *parts)
+
+    g.etag = etag(*parts)
+    g.last_modified = last_modified
+    g.cache_directives = directives or {"private": True, "no_cache": True}
+
+    if _fresh(g.etag, last_modified):
+        response = current_app.response_class(status=304)
+        _tag(response)
+        abort(response)
+
+
+def _tag(response):
+    response.set_etag(g.etag, weak=True)
+    if g.last_modified is not None:
+        response.last_modified = g.last_modified.replace(tzinfo=timezone.utc)
+    for name, value in g.cache_directives.items():
+        setattr(response.cache_control, name, value)
+    response.vary.add("Cookie")
+
+
+@lru_cache(maxsize=None)
+def _file_hash(path, mtime):
+    with open(path, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()[:12]
+
+
+def static_version(filename):
+    """A hash of a static file's contents, or None if there's no such file."""
+
+    path = os.path.join(current_app.static_folder, filename)
+    try:
+        return _file_hash(path, os.path.getmtime(path))
+    except OSError:
+        return None
+
+
+def add_static_version(endpoint, values):
+    if endpoint == "static" and "v" not in values:
+        version = static_version(values.get("filename", ""))
+        if version is not None:
+            values["v"] = version
+
+
+def apply_policy(response):
+    if request.endpoint == "static":
+        if response.status_code == 200 and request.args.get("v"):
+            response.cache_control.no_cache = None
+            response.cache_control.public = True
+            response.cache_control.max_age = IMMUTABLE_MAX_AGE
+            response.cache_control.immutable = True
+        else:
+            response.cache_control.no_cache = True
+
+    elif g.get("etag") and response.status_code == 200:
+        _tag(response)
+
+    elif not response.cache_control:
+        # https://developer.mozilla.org/en-US/docs/Web/HTTP/Headers/Cache-Control
+        response.cache_control.no_store = True
+
+    return response
+
+
+def init_app(app):
+    app.url_defaults(add_static_version)
+    app.after_request(apply_policy)
+
+    @app.before_request
+    def forget_etag():
+        g.pop("etag", None)
+        g.pop("last_modified", None)
+        g.pop("cache_directives", None)
@@ -0,0 +1,326 @@
+"""Full-text search of messages, ranked.
+
+`tokenize()` splits a message into lowercased words, keeping hashtags and
+@mentions whole ("#python", "@alice"). A search finds the messages with
+all of its tokens, best first: "#python" only finds the hashtag, while a
+plain "python" finds the word, "#python" or "@python". Pages are read with
+cursors (see pagination.py) on (rank, message id).
+
+Only the newest MESSAGE_SEARCH_CANDIDATES matches are ranked, so a search
+for a common word reads that many rows rather than every message with
+the word in it. Older matches aren't found; and as new matches push the
+oldest out, paging through a busy search can skip one now and then.
+
+Backends, picked with MESSAGE_SEARCH:
+
+- "postgres" (the default): each message's tokens are stored as a
+  tsvector in `message_search`, under a GIN index, and ranked with
+  ts_rank. A message's row goes with it, by ON DELETE CASCADE (or, with
+  messages partitioned, partitions.py's trigger);
+- "sqlite": an FTS5 table in a SQLite file at MESSAGE_SEARCH_PATH, ranked
+  with bm25, for local testing. It's only written once the database
+  transaction commits, and only by this process.
+
+Either way, routes call `message_added()` and `messages_deleted()` as
+messages come and go, and `flask index-messages` rebuilds the index from
+the messages table (after a bulk load, say).
+"""
+
+import os
+import re
+import sqlite3
+import threading
+
+from flask import current_app
+from sqlalchemy import event
+from sqlalchemy.dialects.postgresql import TSQUERY, insert
+from sqlalchemy.orm import Session
+
+from models import db, Message, MessageSearch, User
+from pagination import decode_cursor, keyset_query, make_page
+
+TOKEN = re.compile(r"(?<!\w)[#@]\w+|\w+")
+
+# Pages are keyed on (rank, message id), both descending.
+ORDER = (db.column("rank", db.Float), db.column("id", db.Integer))
+
+# Tokens past these aren't searched for.
+MAX_QUERY_LENGTH = 140
+MAX_QUERY_TOKENS = 8
+
+
+def tokenize(text):
+    """A message's (or search's) tokens, in order."""
+
+    return TOKEN.findall(text.lower())
+
+
+def query_terms(search):
+    """The tokens a search needs, each as the alternatives that satisfy
+    it: a hashtag or mention only itself, a word itself or either tag."""
+
+    tokens = dict.fromkeys(tokenize(search[:MAX_QUERY_LENGTH]))
+    return [(token,) if token[0] in "#@"
+            else (token, f"#{token}", f"@{token}")
+            for token in list(tokens)[:MAX_QUERY_TOKENS]]
+
+
+class PostgresIndex:
+    """The message_search table."""
+
+    def add(self, messages):
+        rows = [{"message_id": msg.id, "vector": _tsvector(msg.text)}
+                for msg in messages]
+        rows = [row for row in rows if row["vector"]]
+        if rows:
+            query = insert(MessageSearch).values(rows)
+            db.session.execute(query.on_conflict_do_update(
+                index_elements=[MessageSearch.message_id],
+                set_={"vector": query.excluded.vector}))
+
+    def remove(self, message_ids):
+        """Nothing to do: rows go with their messages."""
+
+    def clear(self):
+        db.session.execute(db.delete(MessageSearch))
+
+    def search(self, terms, before_key, after_key, per_page, candidates):
+        query = db.cast(" & ".join(
+            "(" + " | ".join(f"'{token}'" for token in term) + ")"
+            for term in terms), TSQUERY)
+        # The planner reads these backwards along the primary key when the
+        # words are common, or from the GIN index when they're rare.
+        hits = (db.select(MessageSearch.message_id, MessageSearch.vector)
+                .where(MessageSearch.vector.op("@@")(query))
+                .order_by(MessageSearch.message_id.desc())
+                .limit(candidates)
+                .subquery("hits"))
+        # ts_rank() is a real; as a double it survives the trip through
+        # a cursor and back exactly.
+        order = (db.cast(db.func.ts_rank(hits.c.vector, query), db.Float),
+                 hits.c.message_id)
+
+        return keyset_query(
+            db.session.query(*order), order, before_key, after_key, per_page,
+        ).all()
+
+    def stats(self):
+        rows, table_bytes, index_bytes = db.session.execute(db.text(
+            "SELECT count(*), pg_table_size('message_search'), "
+            "pg_relation_size('ix_message_search_vector') "
+            "FROM message_search")).one()
+        return {"messages": rows, "table_bytes": table_bytes,
+                "index_bytes": index_bytes}
+
+
+def _tsvector(text):
+    # Tokens are word characters after an optional # or @, so need no
+    # escaping inside the quotes.
+    return " ".join(f"'{token}':{position}"
+                    for position, token in enumerate(tokenize(text), 1))
+
+
+SQLITE_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS message_index USING fts5(
+    tokens,
+    tokenize = "unicode61 remove_diacritics 0 tokenchars '#@_'"
+);
+"""
+
+
+class SQLiteIndex:
+    """An FTS5 table of each message's tokens, by message id."""
+
+    def __init__(self, path):
+        self.path = path
+        self.local = threading.local()
+        self._connection().executescript(SQLITE_SCHEMA)
+
+    def _connection(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30,
+                                   isolation_level=None)
+            conn.execute("PRAGMA journal_mode = WAL")
+            self.local.conn = conn
+        return conn
+
+    def add(self, messages):
+        _pending(db.session).update(
+            {msg.id: " ".join(tokenize(msg.text)) for msg in messages})
+
+    def remove(self, message_ids):
+        _pending(db.session).update(dict.fromkeys(message_ids))
+
+    def clear(self):
+        _pending(db.session)[None] = None
+
+    def apply(self, changes):
+        """Write {message id: tokens, or None to remove} changes; a None
+        id clears everything first."""
+
+        conn = self._connection()
+        with conn:
+            conn.execute("BEGIN")
+            if None in changes:
+                conn.execute("DELETE FROM message_index")
+            conn.executemany(
+                "DELETE FROM message_index WHERE rowid = ?",
+                [(id,) for id in changes if id is not None])
+            conn.executemany(
+                "INSERT INTO message_index (rowid, tokens) VALUES (?, ?)",
+                [(id, tokens) for id, tokens in changes.items()
+                 if id is not None and tokens])
+
+    def search(self, terms, before_key, after_key, per_page, candidates):
+        match = " AND ".join(
+            "(" + " OR ".join(f'"{token}"' for token in term) + ")"
+            for term in terms)
+        # bm25() only works in the MATCH query itself, which FTS5 can
+        # stop reading once it has the newest `candidates`.
+        sql = ("WITH hits AS MATERIALIZED ("
+               "SELECT -bm25(message_index) AS rank, rowid AS id "
+               "FROM message_index WHERE message_index MATCH ? "
+               "ORDER BY rowid DESC LIMIT ?) "
+               "SELECT rank, id FROM hits ")
+
+        if after_key is not None:
+            sql += "WHERE (rank, id) > (?, ?) ORDER BY rank, id LIMIT ?"
+            params = (match, candidates, *after_key, per_page + 1)
+        elif before_key is not None:
+            sql += ("WHERE (rank, id) < (?, ?) "
+                    "ORDER BY rank DESC, id DESC LIMIT ?")
+            params = (match, candidates, *before_key, per_page + 1)
+        else:
+            sql += "ORDER BY rank DESC, id DESC LIMIT ?"
+            params = (match, candidates, per_page + 1)
+
+        return self._connection().execute(sql, params).fetchall()
+
+    def stats(self):
+        conn = self._connection()
+        rows = conn.execute("SELECT count(*) FROM message_index").fetchone()
+        pages, page_size = (conn.execute("PRAGMA page_count").fetchone(),
+                            conn.execute("PRAGMA page_size").fetchone())
+        return {"messages": rows[0], "file_bytes": pages[0] * page_size[0]}
+
+
+def _pending(session):
+    return session.info.setdefault("message_search_changes", {})
+
+
+@event.listens_for(Session, "after_commit")
+def _apply_changes(session):
+    changes = session.info.pop("message_search_changes", None)
+    if changes:
+        current_app.extensions["message_search"].apply(changes)
+
+
+@event.listens_for(Session, "after_rollback")
+def _drop_changes(session):
+    session.info.pop("message_search_changes", None)
+
+
+def get_index():
+    return current_app.extensions["message_search"]
+
+
+def message_added(msg):
+    """Index a message just posted (and flushed, so it has an id)."""
+
+    get_index().add([msg])
+
+
+def messages_deleted(message_ids):
+    """Take messages being deleted out of the index."""
+
+    get_index().remove(message_ids)
+
+
+def index_messages(where=None, batch_size=10000):
+    """Index the messages matching `where` (or all of them), committing a
+    batch at a time. Returns how many were read."""
+
+    index = get_index()
+    last_id, count = 0, 0
+    while True:
+        query = (db.select(Message.id, Message.text)
+                 .where(Message.id > last_id)
+                 .order_by(Message.id)
+                 .limit(batch_size))
+        if where is not None:
+            query = query.where(where)
+
+        messages = db.session.execute(query).all()
+        if not messages:
+            return count
+
+        index.add(messages)
+        db.session.commit()
+        last_id = messages[-1].id
+        count += len(messages)
+
+
+def rebuild(batch_size=10000):
+    """Clear the index and index every message. Returns how many."""
+
+    get_index().clear()
+    return index_messages(batch_size=batch_size)
+
+
+def search_keys(search, before=None, after=None, per_page=50):
+    """Get one page of the newest MESSAGE_SEARCH_CANDIDATES messages
+    matching `search` as (rank, message id) pairs, best first.
+    `before`/`after` are page cursors."""
+
+    before_key = decode_cursor(before, ORDER)
+    after_key = decode_cursor(after, ORDER)
+
+    terms = query_terms(search or "")
+    rows = (get_index().search(
+        terms, before_key, after_key, per_page,
+        current_app.config["MESSAGE_SEARCH_CANDIDATES"]) if terms else [])
+
+    return make_page([tuple(row) for row in rows], per_page,
+                     lambda row: row, before_key, after_key)
+
+
+def search_messages(search, before=None, after=None, per_page=50):
+    """Get one page of the messages matching `search`, best first.
+
+    See search_keys(). Returns a Page of messages; any deleted since they
+    were indexed, or by users being deleted (see deletions.py), are left
+    out.
+    """
+
+    page = search_keys(search, before, after, per_page)
+
+    ids = [message_id for _, message_id in page.items]
+    by_id = {msg.id: msg for msg in (
+        Message
+        .query
+        .join(Message.user)
+        .options(db.contains_eager(Message.user))
+        .filter(Message.id.in_(ids))
+        .filter(User.disabled_at.is_(None)))} if ids else {}
+    page.items = [by_id[id] for id in ids if id in by_id]
+
+    return page
+
+
+def stats():
+    return get_index().stats()
+
+
+def init_app(app):
+    """Set up the MESSAGE_SEARCH backend."""
+
+    backend = app.config["MESSAGE_SEARCH"]
+    if backend == "postgres":
+        app.extensions["message_search"] = PostgresIndex()
+    elif backend == "sqlite":
+        path = app.config["MESSAGE_SEARCH_PATH"]
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        app.extensions["message_search"] = SQLiteIndex(path)
+    else:
+        raise ValueError(f"Unknown MESSAGE_SEARCH: {backend}")
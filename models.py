@@ -2,11 +2,17 @@
 
 from datetime import datetime
 
-from flask_bcrypt import Bcrypt
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.dialects.postgresql import TSVECTOR
+from sqlalchemy.orm import Session
 
-bcrypt = Bcrypt()
-db = SQLAlchemy()
+import edgequeue
+import followindex
+import passwords
+from routing import RoutingSession
+
+db = SQLAlchemy(session_options={"class_": RoutingSession})
 
 DEFAULT_IMAGE_URL = (
     "https://icon-library.com/images/default-user-icon/" +
@@ -36,6 +42,38 @@ class Follow(db.Model):
     )
 
 
+# The primary key covers "who follows X"; this covers "who does X follow".
+db.Index(
+    "ix_follows_following_followed",
+    Follow.user_following_id,
+    Follow.user_being_followed_id,
+)
+
+
+class FollowChange(db.Model):
+    """A user whose follows changed, for other processes' follow indexes
+    to catch up on (see graph.py)."""
+
+    __tablename__ = 'follow_changes'
+
+    id = db.Column(
+        db.BigInteger,
+        primary_key=True,
+    )
+
+    user_id = db.Column(
+        db.Integer,
+        nullable=False,
+    )
+
+    changed_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        server_default=db.func.now(),
+        index=True,
+    )
+
+
 class User(db.Model):
     """User in the system."""
 
@@ -87,16 +125,94 @@ class User(db.Model):
         nullable=False,
     )
 
-    messages = db.relationship('Message', backref="user")
+    # Denormalized counts, kept current by counters.py and rebuilt in bulk
+    # by counters.reconcile().
+    messages_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default="0",
+    )
+
+    following_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default="0",
+    )
 
-    messages_liked = db.relationship("Message", secondary="likes",
-                                     backref="users_who_liked")
+    followers_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default="0",
+    )
+
+    likes_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default="0",
+    )
+
+    # Set once a user has enough followers that their messages are merged
+    # into followers' timelines at read time instead of being fanned out.
+    fanout_on_read = db.Column(
+        db.Boolean,
+        nullable=False,
+        default=False,
+        server_default=db.false(),
+    )
+
+    # Bumped whenever what other pages show of the user changes (see
+    # _bump_profile_version()), so copies of it can tell they're stale.
+    profile_version = db.Column(
+        db.Integer,
+        nullable=False,
+        default=1,
+        server_default="1",
+    )
+
+    # Bumped with every change to the user's counters (see counters.py):
+    # their messages, likes and follows in either direction. Pages showing
+    # those use it as their version (see httpcache.py).
+    activity_version = db.Column(
+        db.Integer,
+        nullable=False,
+        default=1,
+        server_default="1",
+    )
+
+    # Set when the user asks for their account to be deleted. From then
+    # on they can't log in and aren't shown, while deletions.py deletes
+    # their messages, likes and follows in batches, and finally them.
+    disabled_at = db.Column(
+        db.DateTime,
+        nullable=True,
+    )
+
+    PROFILE_FIELDS = ("username", "image_url", "header_image_url", "bio",
+                      "location")
+
+    # Deleting a user or message leaves its messages, likes and follows to
+    # the foreign keys' ON DELETE CASCADE, rather than loading them all to
+    # delete them (or, for messages, to set their user_id to NULL).
+    messages = db.relationship('Message', backref="user",
+                               passive_deletes=True)
+
+    messages_liked = db.relationship(
+        "Message",
+        secondary="likes",
+        backref=db.backref("users_who_liked", passive_deletes=True),
+        passive_deletes=True,
+    )
     followers = db.relationship(
         "User",
         secondary="follows",
         primaryjoin=(Follow.user_being_followed_id == id),
         secondaryjoin=(Follow.user_following_id == id),
-        backref="following",
+        backref=db.backref("following", passive_deletes=True),
+        passive_deletes=True,
     )
 
     def __repr__(self):
@@ -106,10 +222,10 @@ class User(db.Model):
     def signup(cls, username, email, password, image_url=DEFAULT_IMAGE_URL):
         """Sign up user.
 
-        Hashes password and adds user to session.
+        Hashes password (see passwords.py) and adds user to session.
         """
 
-        hashed_pwd = bcrypt.generate_password_hash(password).decode('UTF-8')
+        hashed_pwd = passwords.hash_password(password)
 
         user = User(
             username=username,
@@ -129,32 +245,168 @@ class User(db.Model):
         It searches for a user whose password hash matches this password
         and, if it finds such a user, returns that user object.
 
-        If this can't find matching user (or if password is wrong), returns
-        False.
+        If this can't find matching user (or if password is wrong, or the
+        account is being deleted), returns False.
+
+        A password hash made with an outdated cost is replaced; the caller
+        commits it.
         """
 
-        user = cls.query.filter_by(username=username).one_or_none()
+        user = (cls.query
+                .filter_by(username=username)
+                .filter(cls.disabled_at.is_(None))
+                .one_or_none())
 
         if user:
-            is_auth = bcrypt.check_password_hash(user.password, password)
+            is_auth = passwords.check_password(user.password, password)
             if is_auth:
+                new_hash = passwords.rehash(user.password, password)
+                if new_hash:
+                    user.password = new_hash
                 return user
 
         return False
 
+    def liked_message_ids(self, messages):
+        """Which of these messages has this user liked?
+
+        Returns a set of message ids, found with one query against likes,
+        and including this user's queued likes and unlikes.
+        """
+
+        message_ids = [msg.id for msg in messages]
+        if not message_ids:
+            return set()
+
+        liked = set(db.session.scalars(
+            db.select(Like.message_id)
+            .where(Like.user_id == self.id)
+            .where(Like.message_id.in_(message_ids))
+        ))
+
+        return _with_pending(liked, message_ids, self.id, "like")
+
+    def following_ids(self, users):
+        """Which of these users (or user ids) does this user follow?
+
+        Returns a set of user ids, found with one query against follows
+        (or, with FOLLOW_INDEX on, none; see followindex.py). Answers are
+        remembered until the follows could have changed (see
+        follow_checks()), so is_following() on any of them is then free.
+        """
+
+        return _check_follows(self.id, users, following=True)
+
+    def followed_by_ids(self, users):
+        """Which of these users (or user ids) follow this user?"""
+
+        return _check_follows(self.id, users, following=False)
+
     def is_followed_by(self, other_user):
         """Is this user followed by `other_user`?"""
 
-        found_user_list = [
-            user for user in self.followers if user == other_user]
-        return len(found_user_list) == 1
+        return bool(self.followed_by_ids([other_user]))
 
     def is_following(self, other_user):
-        """Is this user following `other_use`?"""
+        """Is this user following `other_user`?"""
+
+        return bool(self.following_ids([other_user]))
+
+
+@event.listens_for(User, "before_update")
+def _bump_profile_version(mapper, connection, user):
+    state = db.inspect(user)
+    if any(state.attrs[name].history.has_changes()
+           for name in User.PROFILE_FIELDS):
+        user.profile_version += 1
+
+
+def follow_checks(session=None):
+    """Remembered follow checks: {(follower id, followed id): bool}.
+
+    Kept in the session and forgotten whenever it flushes changes or ends
+    a transaction. The app also forgets them at the end of each request.
+    """
+
+    session = session or db.session
+    return session.info.setdefault("follow_checks", {})
+
+
+def _check_follows(user_id, users, following):
+    ids = {getattr(user, "id", user) for user in users}
+    pair = ((lambda other: (user_id, other)) if following
+            else (lambda other: (other, user_id)))
+
+    index = followindex.get_index()
+    if index is not None:
+        changes = followindex.pending(db.session)
+        found = {other for other in ids
+                 if changes.get(pair(other), index.follows(*pair(other)))}
+    else:
+        found = _query_follows(user_id, ids, pair, following)
+
+    # Users see their own queued follows, but not others'.
+    if following:
+        found = _with_pending(found, ids, user_id, "follow")
+    return found
+
+
+def _query_follows(user_id, ids, pair, following):
+    # Pending follow changes would otherwise only be seen by a query.
+    if db.session.autoflush:
+        db.session.flush()
+
+    checks = follow_checks()
+    unknown = [other for other in ids if pair(other) not in checks]
 
-        found_user_list = [
-            user for user in self.following if user == other_user]
-        return len(found_user_list) == 1
+    if unknown:
+        mine, theirs = ((Follow.user_following_id,
+                         Follow.user_being_followed_id) if following
+                        else (Follow.user_being_followed_id,
+                              Follow.user_following_id))
+        found = set(db.session.scalars(
+            db.select(theirs)
+            .where(mine == user_id)
+            .where(theirs.in_(unknown))
+        ))
+        for other in unknown:
+            checks[pair(other)] = other in found
+
+    return {other for other in ids if checks[pair(other)]}
+
+
+def _with_pending(found, ids, user_id, kind):
+    """Apply this user's queued edge changes to `found`, a subset of ids."""
+
+    pending = edgequeue.pending(user_id, kind)
+    if not pending:
+        return found
+
+    return ({id for id in found if pending.get(id, True)} |
+            {id for id in ids if pending.get(id)})
+
+
+@event.listens_for(Session, "after_flush")
+@event.listens_for(Session, "after_transaction_end")
+def _forget_follow_checks(session, *args):
+    session.info.pop("follow_checks", None)
+
+
+# Accounts being deleted are few too; deletions.py finds them with this.
+db.Index(
+    "ix_users_disabled",
+    User.disabled_at,
+    postgresql_where=User.disabled_at.isnot(None),
+)
+
+
+# Fan-out-on-read authors are few; feeds look them up through this rather
+# than through every follow of the reader.
+db.Index(
+    "ix_users_fanout_on_read",
+    User.id,
+    postgresql_where=User.fanout_on_read,
+)
 
 
 class Message(db.Model):
@@ -184,6 +436,40 @@ class Message(db.Model):
         nullable=False,
     )
 
+
+db.Index(
+    "ix_messages_user_timestamp",
+    Message.user_id,
+    Message.timestamp.desc(),
+    Message.id.desc(),
+)
+
+
+class MessageSearch(db.Model):
+    """A message's words, hashtags and mentions, for full-text search (see
+    messagesearch.py)."""
+
+    __tablename__ = "message_search"
+
+    message_id = db.Column(
+        db.Integer,
+        db.ForeignKey("messages.id", ondelete="cascade"),
+        primary_key=True,
+    )
+
+    vector = db.Column(
+        TSVECTOR,
+        nullable=False,
+    )
+
+
+db.Index(
+    "ix_message_search_vector",
+    MessageSearch.vector,
+    postgresql_using="gin",
+)
+
+
 class Like(db.Model):
     """A like on a message"""
     __tablename__ = "likes"
@@ -202,6 +488,160 @@ class Like(db.Model):
     )
 
 
+# Deleting a message deletes its likes (and counts its likers) by message.
+db.Index("ix_likes_message", Like.message_id)
+
+
+class TimelineEntry(db.Model):
+    """A message delivered to a user's home timeline."""
+
+    __tablename__ = "timeline_entries"
+
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey("users.id", ondelete="cascade"),
+        primary_key=True,
+    )
+
+    message_id = db.Column(
+        db.Integer,
+        db.ForeignKey("messages.id", ondelete="cascade"),
+        primary_key=True,
+    )
+
+    author_id = db.Column(
+        db.Integer,
+        db.ForeignKey("users.id", ondelete="cascade"),
+        nullable=False,
+    )
+
+    timestamp = db.Column(
+        db.DateTime,
+        nullable=False,
+    )
+
+
+db.Index(
+    "ix_timeline_entries_user_timestamp",
+    TimelineEntry.user_id,
+    TimelineEntry.timestamp.desc(),
+    TimelineEntry.message_id.desc(),
+)
+
+db.Index(
+    "ix_timeline_entries_user_author",
+    TimelineEntry.user_id,
+    TimelineEntry.author_id,
+)
+
+# For deleting a message's entries along with it.
+db.Index("ix_timeline_entries_message", TimelineEntry.message_id)
+
+
+class LikeBucket(db.Model):
+    """How many likes a message got in one stretch of time (see
+    trending.py)."""
+
+    __tablename__ = "like_buckets"
+
+    message_id = db.Column(
+        db.Integer,
+        db.ForeignKey("messages.id", ondelete="cascade"),
+        primary_key=True,
+    )
+
+    bucket = db.Column(
+        db.DateTime,
+        primary_key=True,
+    )
+
+    count = db.Column(
+        db.Integer,
+        nullable=False,
+    )
+
+
+# Trending scores read just the buckets in their window.
+db.Index("ix_like_buckets_bucket", LikeBucket.bucket)
+
+
+class TrendingMessage(db.Model):
+    """A message's place in a window's precomputed trending list."""
+
+    __tablename__ = "trending_messages"
+
+    window = db.Column(
+        db.String(8),
+        primary_key=True,
+    )
+
+    rank = db.Column(
+        db.Integer,
+        primary_key=True,
+    )
+
+    message_id = db.Column(
+        db.Integer,
+        db.ForeignKey("messages.id", ondelete="cascade"),
+        nullable=False,
+    )
+
+    score = db.Column(
+        db.Float,
+        nullable=False,
+    )
+
+    refreshed_at = db.Column(
+        db.DateTime,
+        nullable=False,
+    )
+
+
+class FollowSuggestion(db.Model):
+    """Someone a user might follow: followed by `mutuals` of their
+    followees (see recommendations.py)."""
+
+    __tablename__ = "follow_suggestions"
+
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey("users.id", ondelete="cascade"),
+        primary_key=True,
+    )
+
+    suggested_user_id = db.Column(
+        db.Integer,
+        db.ForeignKey("users.id", ondelete="cascade"),
+        primary_key=True,
+    )
+
+    mutuals = db.Column(
+        db.Integer,
+        nullable=False,
+    )
+
+
+# A user's suggestions, best first, in one index range.
+db.Index(
+    "ix_follow_suggestions_user_mutuals",
+    FollowSuggestion.user_id,
+    FollowSuggestion.mutuals.desc(),
+    FollowSuggestion.suggested_user_id,
+)
+
+
+class SuggestionRefresh(db.Model):
+    """A user whose follows changed since their suggestions were made."""
+
+    __tablename__ = "suggestion_refreshes"
+
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey("users.id", ondelete="cascade"),
+        primary_key=True,
+    )
+
+
 def connect_db(app):
     """Connect this database to provided Flask app.
 
@@ -0,0 +1,168 @@
+"""Keyset (cursor) pagination for Warbler list views.
+
+Lists are ordered newest-first on a tuple of columns, such as
+(timestamp, id) for messages or (id,) for users. A cursor is an opaque,
+URL-safe encoding of the key of the first or last row on a page. Each page
+is fetched with a row comparison against that key, so it costs one index
+range scan no matter how deep it is.
+"""
+
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import datetime
+
+from werkzeug.exceptions import BadRequest
+
+from models import db
+
+
+class Page:
+    """One page of results, with cursors to the pages around it."""
+
+    def __init__(self, items, next_cursor=None, prev_cursor=None):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+    def __repr__(self):
+        return f"<Page: {len(self.items)} items>"
+
+
+def _encode_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+def _decode_value(value, column):
+    if column.type.python_type is datetime:
+        return datetime.fromisoformat(value)
+    return column.type.python_type(value)
+
+
+def encode_cursor(key):
+    """Encode a row's key tuple as an opaque cursor string."""
+
+    raw = json.dumps([_encode_value(value) for value in key])
+    return urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor, order):
+    """Decode a cursor into a key tuple for the `order` columns.
+
+    Returns None if there's no cursor; raises BadRequest if it's malformed.
+    """
+
+    if not cursor:
+        return None
+
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(urlsafe_b64decode(padded.encode()))
+        if len(values) != len(order):
+            raise ValueError(cursor)
+        return tuple(
+            _decode_value(value, column)
+            for value, column in zip(values, order)
+        )
+    except (ValueError, TypeError):
+        raise BadRequest("Invalid page cursor.")
+
+
+def keyset_query(query, order, before_key=None, after_key=None, per_page=50):
+    """Restrict `query` to the rows of one page, plus one to detect more.
+
+    Rows come back newest-first, except for `after_key` pages, which come
+    back oldest-first and are flipped by `make_page`.
+    """
+
+    if after_key is not None:
+        return (query
+                .filter(db.tuple_(*order) > db.tuple_(*after_key))
+                .order_by(*[column.asc() for column in order])
+                .limit(per_page + 1))
+
+    if before_key is not None:
+        query = query.filter(db.tuple_(*order) < db.tuple_(*before_key))
+
+    return (query
+            .order_by(*[column.desc() for column in order])
+            .limit(per_page + 1))
+
+
+def windowed_keyset_query(query, order, before_key=None, after_key=None,
+                          per_page=50, windows=()):
+    """Like keyset_query(), but look near the cursor first.
+
+    `order` must start with a timestamp column. Each of `windows` (a list
+    of timedeltas, shortest first) in turn bounds how far from the cursor
+    (or, for a first page, from now) rows may be; the first window holding
+    a full page wins, and the last resort is no bound at all. On a table
+    partitioned by time (see partitions.py) a window only reads the
+    partitions it covers. Returns the rows.
+    """
+
+    timestamp = order[0]
+    if after_key is not None:
+        anchor = after_key[0]
+    elif before_key is not None:
+        anchor = before_key[0]
+    else:
+        anchor = datetime.utcnow()
+
+    for window in windows:
+        if after_key is not None:
+            bound = timestamp <= anchor + window
+        else:
+            bound = timestamp >= anchor - window
+
+        rows = keyset_query(query.filter(bound), order, before_key, after_key,
+                            per_page).all()
+        if len(rows) > per_page:
+            return rows
+
+    return keyset_query(query, order, before_key, after_key, per_page).all()
+
+
+def make_page(rows, per_page, key, before_key=None, after_key=None):
+    """Build a Page from rows fetched by `keyset_query`."""
+
+    rows = list(rows)
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+
+    if after_key is not None:
+        rows.reverse()
+        has_newer, has_older = has_more, True
+    else:
+        has_newer, has_older = before_key is not None, has_more
+
+    return Page(
+        rows,
+        next_cursor=encode_cursor(key(rows[-1])) if has_older and rows
+        else None,
+        prev_cursor=encode_cursor(key(rows[0])) if has_newer and rows
+        else None,
+    )
+
+
+def paginate(query, order, before=None, after=None, per_page=50, key=None,
+             windows=()):
+    """Get one page of `query`, ordered newest-first on `order`.
+
+    `before`/`after` are cursors from a previous page's `next_cursor` /
+    `prev_cursor`. `key` maps a result row to its key tuple; by default it
+    reads the attributes named after the `order` columns. `windows` are
+    for windowed_keyset_query().
+    """
+
+    if key is None:
+        def key(row):
+            return tuple(getattr(row, column.key) for column in order)
+
+    before_key = decode_cursor(before, order)
+    after_key = decode_cursor(after, order)
+
+    rows = windowed_keyset_query(query, order, before_key, after_key,
+                                 per_page, windows)
+    return make_page(rows, per_page, key, before_key, after_key)
@@ -0,0 +1,224 @@
+"""Monthly partitions of the messages table.
+
+`db.create_all()` makes `messages` a plain table. `partition_messages()`
+converts it, in place, into one partitioned by month of `timestamp`:
+
+    flask partition-messages               # once; blocks writes while it runs
+    flask create-message-partitions        # monthly, to stay ahead
+    flask detach-message-partitions 2022-01  # archive months before this
+
+Each month is its own table (messages_2024_05, ...) with its own copy of
+the indexes, plus a default partition for anything outside them. Queries
+that bound `timestamp` only touch the months in range: the feed loads its
+page's messages by (id, timestamp), and profile pages look back through
+growing time windows (see pagination.paginate()).
+
+Partitioning changes some guarantees:
+
+- a unique index on a partitioned table has to include the partition key,
+  so the primary key becomes (id, timestamp). Ids are still unique, since
+  they all come from one sequence;
+- for the same reason, likes, timeline_entries, the trending tables and
+  message_search can't have foreign keys to messages. A trigger deletes a
+  message's rows in them instead, as ON DELETE CASCADE did; nothing stops
+  a like of a message that doesn't exist, but the app only likes messages
+  it has just loaded.
+
+Detaching a month leaves its table in place (for pg_dump and DROP) and
+deletes the feed entries and search index rows pointing into it; likes of
+archived messages stay, and stop showing on likes pages.
+"""
+
+from datetime import datetime
+
+from models import db, Message
+
+TABLE = Message.__tablename__
+
+CASCADE_FUNCTION = """
+CREATE OR REPLACE FUNCTION messages_delete_cascade() RETURNS trigger AS $$
+BEGIN
+    DELETE FROM likes WHERE message_id = OLD.id;
+    DELETE FROM timeline_entries WHERE message_id = OLD.id;
+    DELETE FROM like_buckets WHERE message_id = OLD.id;
+    DELETE FROM trending_messages WHERE message_id = OLD.id;
+    DELETE FROM message_search WHERE message_id = OLD.id;
+    RETURN OLD;
+END
+$$ LANGUAGE plpgsql
+"""
+
+
+def month_start(when):
+    return datetime(when.year, when.month, 1)
+
+
+def add_months(month, n):
+    year, month = divmod(month.year * 12 + month.month - 1 + n, 12)
+    return datetime(year, month + 1, 1)
+
+
+def partition_name(month):
+    return f"{TABLE}_{month.year:04d}_{month.month:02d}"
+
+
+def partition_month(name):
+    """The month a partition_name() is for; ValueError for others."""
+
+    year, month = name.rsplit("_", 2)[1:]
+    return datetime(int(year), int(month), 1)
+
+
+def is_partitioned():
+    """Has messages been converted to a partitioned table?"""
+
+    return db.session.scalar(db.text(
+        "SELECT relkind = 'p' FROM pg_class WHERE oid = to_regclass(:name)"
+    ), {"name": TABLE}) or False
+
+
+def partitions():
+    """(name, first month) of each monthly partition, oldest first."""
+
+    names = db.session.scalars(db.text("""
+        SELECT inhrelid::regclass::text FROM pg_inherits
+        WHERE inhparent = to_regclass(:name)
+    """), {"name": TABLE})
+
+    months = []
+    for name in names:
+        try:
+            months.append((name, partition_month(name)))
+        except ValueError:
+            continue  # the default partition
+    return sorted(months, key=lambda partition: partition[1])
+
+
+def create_partitions(through, start=None):
+    """Make sure there's a partition for every month up to `through`.
+
+    Starts from `start`'s month, or else the month after the newest
+    partition (or this month, if there are none). Rows for a new month
+    mustn't already be in the default partition. Returns the names of the
+    partitions made.
+    """
+
+    existing = dict(partitions())
+    if start is not None:
+        month = month_start(start)
+    elif existing:
+        month = add_months(max(existing.values()), 1)
+    else:
+        month = month_start(datetime.utcnow())
+
+    made = []
+    while month <= month_start(through):
+        name = partition_name(month)
+        if name not in existing:
+            db.session.execute(db.text(
+                f"CREATE TABLE {name} PARTITION OF {TABLE} "
+                f"FOR VALUES FROM ('{month.isoformat()}') "
+                f"TO ('{add_months(month, 1).isoformat()}')"))
+            made.append(name)
+        month = add_months(month, 1)
+
+    return made
+
+
+def partition_messages(months_ahead=3):
+    """Convert messages into a table partitioned by month.
+
+    Copies every row, so writes to messages are locked out while it runs.
+    Makes partitions from the oldest message's month to `months_ahead`
+    months from now. Does nothing if it's already partitioned.
+    """
+
+    if is_partitioned():
+        return []
+
+    db.session.execute(db.text(f"LOCK TABLE {TABLE} IN ACCESS EXCLUSIVE MODE"))
+
+    # The same catalog reads as seed.py's: indexes to rebuild, and foreign
+    # keys in and out.
+    indexes = db.session.scalars(db.text("""
+        SELECT pg_get_indexdef(indexrelid) FROM pg_index
+        WHERE indrelid = to_regclass(:name)
+          AND NOT EXISTS (SELECT 1 FROM pg_constraint
+                          WHERE conindid = indexrelid)
+    """), {"name": TABLE}).all()
+    outgoing = db.session.execute(db.text("""
+        SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint
+        WHERE contype = 'f' AND conrelid = to_regclass(:name)
+    """), {"name": TABLE}).all()
+    incoming = db.session.execute(db.text("""
+        SELECT conrelid::regclass::text, conname FROM pg_constraint
+        WHERE contype = 'f' AND confrelid = to_regclass(:name)
+    """), {"name": TABLE}).all()
+
+    for table, name in incoming:
+        db.session.execute(db.text(
+            f'ALTER TABLE {table} DROP CONSTRAINT "{name}"'))
+
+    db.session.execute(db.text(
+        f"ALTER TABLE {TABLE} RENAME TO {TABLE}_unpartitioned"))
+    db.session.execute(db.text(
+        f"CREATE TABLE {TABLE} "
+        f"(LIKE {TABLE}_unpartitioned INCLUDING DEFAULTS) "
+        f'PARTITION BY RANGE ("timestamp")'))
+    db.session.execute(db.text(
+        f"ALTER SEQUENCE {TABLE}_id_seq OWNED BY {TABLE}.id"))
+
+    oldest = db.session.scalar(db.text(
+        f'SELECT min("timestamp") FROM {TABLE}_unpartitioned'))
+    made = create_partitions(add_months(datetime.utcnow(), months_ahead),
+                             start=oldest)
+    db.session.execute(db.text(
+        f"CREATE TABLE {TABLE}_default PARTITION OF {TABLE} DEFAULT"))
+
+    db.session.execute(db.text(
+        f"INSERT INTO {TABLE} SELECT * FROM {TABLE}_unpartitioned"))
+    db.session.execute(db.text(f"DROP TABLE {TABLE}_unpartitioned"))
+
+    # Built once the rows are in, which is cheaper than maintaining them.
+    db.session.execute(db.text("SET LOCAL maintenance_work_mem = '256MB'"))
+    db.session.execute(db.text(
+        f'ALTER TABLE {TABLE} ADD PRIMARY KEY (id, "timestamp")'))
+    for definition in indexes:
+        db.session.execute(db.text(definition))
+    for name, definition in outgoing:
+        db.session.execute(db.text(
+            f'ALTER TABLE {TABLE} ADD CONSTRAINT "{name}" {definition}'))
+
+    db.session.execute(db.text(CASCADE_FUNCTION))
+    db.session.execute(db.text(
+        f"CREATE TRIGGER {TABLE}_delete_cascade AFTER DELETE ON {TABLE} "
+        f"FOR EACH ROW EXECUTE FUNCTION messages_delete_cascade()"))
+
+    return made
+
+
+def detach_partitions(before):
+    """Detach the monthly partitions wholly before `before`'s month.
+
+    Returns the names of the tables detached.
+    """
+
+    cutoff = month_start(before)
+    detached = []
+
+    for name, month in partitions():
+        if month >= cutoff:
+            break
+
+        db.session.execute(db.text(
+            f"ALTER TABLE {TABLE} DETACH PARTITION {name}"))
+        db.session.execute(db.text(
+            'DELETE FROM timeline_entries '
+            'WHERE "timestamp" >= :start AND "timestamp" < :end'
+        ), {"start": month, "end": add_months(month, 1)})
+        db.session.execute(db.text(
+            f"DELETE FROM message_search "
+            f"WHERE message_id IN (SELECT id FROM {name})"))
+        detached.append(name)
+
+    return detached
@@ -0,0 +1,271 @@
+"""Password hashing, off the request workers.
+
+bcrypt is meant to be slow: at the default cost of 12 one hash or check
+takes a few hundred milliseconds of CPU. Done inline, that time blocks
+the web worker serving the request, so a burst of logins stalls every
+other page. Here hashes and checks run in a small process pool instead:
+
+- at most PASSWORD_HASH_WORKERS + PASSWORD_HASH_QUEUE hashes are in hand
+  at once, running or waiting for a worker, across every app process on
+  the host: they share one set of slots (see `Slots`) under
+  PASSWORD_HASH_SLOTS_PATH. Past that, callers get an immediate 503
+  (`PasswordServiceBusy`, with a Retry-After) rather than piling up behind
+  the queue;
+- the cost factor is BCRYPT_LOG_ROUNDS. `rehash()` makes a new hash when
+  a stored one was made with a different cost, so logins can upgrade it;
+- `stats()` reports counts, rejections, and time spent hashing and
+  waiting for a worker.
+
+A request still waits for its own hash. What the slots bound is how many
+requests, and so (with gunicorn's sync workers) how many web workers, are
+tied up with hashing at once; the rest keep serving other pages.
+
+With PASSWORD_HASH_WORKERS = 0 work runs in the calling thread (still
+subject to the queue limit), which is simplest for scripts and tests.
+"""
+
+import fcntl
+import multiprocessing
+import os
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from time import perf_counter, time
+
+import bcrypt
+from flask import current_app
+from werkzeug.exceptions import ServiceUnavailable
+
+
+class PasswordServiceBusy(ServiceUnavailable):
+    """Too many hashes are queued already; try again shortly."""
+
+    description = "Too many sign-ins right now. Please try again shortly."
+
+    def __init__(self, retry_after=1):
+        super().__init__(retry_after=retry_after)
+
+
+def _timed(func, submitted, *args):
+    """Run func(*args) and return (result, seconds waited, seconds taken).
+
+    Runs in a pool worker, so waits are measured by the wall clock:
+    perf_counter() isn't comparable between processes.
+    """
+
+    started = time()
+    start = perf_counter()
+    result = func(*args)
+    return result, max(0, started - submitted), perf_counter() - start
+
+
+def _hash(password, rounds):
+    return bcrypt.hashpw(password.encode(), bcrypt.gensalt(rounds)).decode()
+
+
+def _check(pw_hash, password):
+    return bcrypt.checkpw(password.encode(), pw_hash.encode())
+
+
+class Stats:
+    """Hashing counts and timings."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = {"hashes": 0, "checks": 0, "rehashes": 0,
+                       "rejected": 0}
+        self.timings = {"hash_ms": [0, 0.0, 0.0], "wait_ms": [0, 0.0, 0.0]}
+
+    def add(self, field, n=1):
+        with self.lock:
+            self.counts[field] += n
+
+    def time(self, field, seconds):
+        with self.lock:
+            timing = self.timings[field]
+            timing[0] += 1
+            timing[1] += seconds * 1000
+            timing[2] = max(timing[2], seconds * 1000)
+
+    def as_dict(self):
+        with self.lock:
+            stats = dict(self.counts)
+            for field, (n, total, longest) in self.timings.items():
+                stats[field] = {
+                    "mean": round(total / n, 2) if n else None,
+                    "max": round(longest, 2),
+                }
+        return stats
+
+
+class Slots:
+    """A fixed number of slots shared by every process using `path`.
+
+    Each slot is a lock file, held with flock() while a job has it. The
+    lock goes with the open file, so a process that dies lets go of its
+    slots, and two opens in one process (one per thread) exclude each
+    other too.
+    """
+
+    def __init__(self, path, count):
+        self.path = path
+        self.count = count
+        os.makedirs(path, exist_ok=True)
+
+    def acquire(self):
+        """Take a free slot, or return None if they're all taken."""
+
+        for i in range(self.count):
+            slot = open(os.path.join(self.path, f"slot-{i}"), "a")
+            try:
+                fcntl.flock(slot, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return slot
+            except BlockingIOError:
+                slot.close()
+        return None
+
+    def release(self, slot):
+        slot.close()
+
+
+class PasswordService:
+    """Hashes and checks passwords in a bounded process pool.
+
+    Services with the same `slots_path` share their slots; without one, a
+    service has slots of its own.
+    """
+
+    def __init__(self, rounds=12, workers=2, max_queue=8, retry_after=1,
+                 slots_path=None):
+        self.rounds = rounds
+        self.workers = workers
+        self.retry_after = retry_after
+        self.stats = Stats()
+
+        # One slot per running or waiting job.
+        self.slots = Slots(
+            slots_path or tempfile.mkdtemp(prefix="warbler-passwords-"),
+            max(1, workers) + max_queue)
+
+        self.pool = None
+        self.pool_lock = threading.Lock()
+
+    def _get_pool(self):
+        # Started on first use, so importing the app doesn't start
+        # processes. Workers are spawned, not forked, so they don't inherit
+        # the app's database connections.
+        with self.pool_lock:
+            if self.pool is None:
+                self.pool = ProcessPoolExecutor(
+                    self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+            return self.pool
+
+    def _run(self, func, *args):
+        slot = self.slots.acquire()
+        if slot is None:
+            self.stats.add("rejected")
+            raise PasswordServiceBusy(self.retry_after)
+
+        try:
+            if self.workers:
+                future = self._get_pool().submit(_timed, func, time(), *args)
+                result, waited, took = future.result()
+            else:
+                result, waited, took = _timed(func, time(), *args)
+        finally:
+            self.slots.release(slot)
+
+        self.stats.time("wait_ms", waited)
+        self.stats.time("hash_ms", took)
+        return result
+
+    def hash(self, password):
+        """Hash a password with the configured cost."""
+
+        if not password:
+            raise ValueError("Password must be non-empty.")
+
+        self.stats.add("hashes")
+        return self._run(_hash, password, self.rounds)
+
+    def check(self, pw_hash, password):
+        """Does this password match this hash?"""
+
+        self.stats.add("checks")
+        return self._run(_check, pw_hash, password)
+
+    def needs_rehash(self, pw_hash):
+        """Was this hash made with a different cost than the configured one?"""
+
+        try:
+            return int(pw_hash.split("$")[2]) != self.rounds
+        except (IndexError, ValueError):
+            return True
+
+    def rehash(self, pw_hash, password):
+        """A new hash of this (checked) password if `pw_hash` needs one."""
+
+        if not self.needs_rehash(pw_hash):
+            return None
+
+        self.stats.add("rehashes")
+        return self.hash(password)
+
+    def shutdown(self):
+        with self.pool_lock:
+            if self.pool is not None:
+                self.pool.shutdown()
+                self.pool = None
+
+
+def _service():
+    return current_app.extensions["warbler_passwords"]
+
+
+def hash_password(password):
+    """Hash a password; raises PasswordServiceBusy if the queue is full."""
+
+    return _service().hash(password)
+
+
+def check_password(pw_hash, password):
+    """Check a password; raises PasswordServiceBusy if the queue is full."""
+
+    return _service().check(pw_hash, password)
+
+
+def rehash(pw_hash, password):
+    """A new hash at the configured cost, or None if `pw_hash` is fine.
+
+    Only call this with a password already checked against `pw_hash`.
+    """
+
+    return _service().rehash(pw_hash, password)
+
+
+def stats():
+    """Hashing metrics, as a dict."""
+
+    service = _service()
+    return {
+        "rounds": service.rounds,
+        "workers": service.workers,
+        **service.stats.as_dict(),
+    }
+
+
+def init_app(app):
+    """Set up hashing from BCRYPT_LOG_ROUNDS and the PASSWORD_HASH_* config."""
+
+    old = app.extensions.get("warbler_passwords")
+    if old is not None:
+        old.shutdown()
+
+    app.extensions["warbler_passwords"] = PasswordService(
+        rounds=app.config["BCRYPT_LOG_ROUNDS"],
+        workers=app.config["PASSWORD_HASH_WORKERS"],
+        max_queue=app.config["PASSWORD_HASH_QUEUE"],
+        slots_path=app.config["PASSWORD_HASH_SLOTS_PATH"],
+    )
@@ -0,0 +1,123 @@
+"""Connection pool settings and telemetry.
+
+`engine_options(config)` builds SQLALCHEMY_ENGINE_OPTIONS from the DB_POOL_*
+settings. Engines get a `TimedQueuePool`, which records how long each
+checkout waited for a connection. `stats()` reports that as a histogram,
+along with each pool's live counts. /internal/pool serves it.
+
+With DB_POOLER set (for PgBouncer and the like in transaction mode) the
+app keeps no pool of its own: every checkout opens a connection to the
+pooler and closes it on checkin. psycopg2 never uses server-side prepared
+statements, and the app only changes settings with SET LOCAL, so nothing
+outlives the transaction that a pooler might hand to another client.
+"""
+
+import threading
+from bisect import bisect_left
+from time import perf_counter
+
+from sqlalchemy.exc import TimeoutError
+from sqlalchemy.pool import NullPool, QueuePool
+
+# Upper bounds (ms) of the checkout wait histogram's buckets; the last
+# bucket counts everything slower.
+WAIT_BUCKETS_MS = (1, 5, 10, 50, 100, 500, 1000, 5000)
+
+
+class WaitStats:
+    """Checkout wait times for one pool."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.buckets = [0] * (len(WAIT_BUCKETS_MS) + 1)
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.timeouts = 0
+
+    def record(self, seconds, timed_out=False):
+        ms = seconds * 1000
+        with self.lock:
+            self.buckets[bisect_left(WAIT_BUCKETS_MS, ms)] += 1
+            self.total_ms += ms
+            self.max_ms = max(self.max_ms, ms)
+            self.timeouts += timed_out
+
+    def as_dict(self):
+        with self.lock:
+            checkouts = sum(self.buckets)
+            labels = [f"<={ms}ms" for ms in WAIT_BUCKETS_MS]
+            labels.append(f">{WAIT_BUCKETS_MS[-1]}ms")
+            return {
+                "checkouts": checkouts,
+                "timeouts": self.timeouts,
+                "wait_ms_mean": (round(self.total_ms / checkouts, 3)
+                                 if checkouts else None),
+                "wait_ms_max": round(self.max_ms, 3),
+                "wait_ms_histogram": dict(zip(labels, self.buckets)),
+            }
+
+
+class TimedQueuePool(QueuePool):
+    """A QueuePool that records how long checkouts wait."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.wait_stats = WaitStats()
+
+    def recreate(self):
+        pool = super().recreate()
+        pool.wait_stats = self.wait_stats
+        return pool
+
+    def _do_get(self):
+        start = perf_counter()
+        try:
+            conn = super()._do_get()
+        except TimeoutError:
+            self.wait_stats.record(perf_counter() - start, timed_out=True)
+            raise
+        self.wait_stats.record(perf_counter() - start)
+        return conn
+
+
+def engine_options(config):
+    """SQLALCHEMY_ENGINE_OPTIONS for the DB_POOL_* / DB_POOLER settings."""
+
+    if config["DB_POOLER"]:
+        return {"poolclass": NullPool}
+
+    return {
+        "poolclass": TimedQueuePool,
+        "pool_size": config["DB_POOL_SIZE"],
+        "max_overflow": config["DB_POOL_MAX_OVERFLOW"],
+        "pool_timeout": config["DB_POOL_TIMEOUT"],
+        "pool_recycle": config["DB_POOL_RECYCLE"],
+        "pool_pre_ping": config["DB_POOL_PRE_PING"],
+    }
+
+
+def pool_stats(engine):
+    """Live counts and checkout waits for one engine's pool."""
+
+    pool = engine.pool
+    stats = {"pool": type(pool).__name__}
+
+    if isinstance(pool, QueuePool):
+        stats.update({
+            "size": pool.size(),
+            "checked_out": pool.checkedout(),
+            "checked_in": pool.checkedin(),
+            "overflow": max(0, pool.overflow()),
+            "max_overflow": pool._max_overflow,
+        })
+    if isinstance(pool, TimedQueuePool):
+        stats.update(pool.wait_stats.as_dict())
+
+    return stats
+
+
+def stats(engines):
+    """pool_stats() for each of a {bind name: engine} dict."""
+
+    return {name or "primary": pool_stats(engine)
+            for name, engine in engines.items()}
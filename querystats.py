@@ -0,0 +1,160 @@
+"""Per-request SQL statement statistics.
+
+Hooks SQLAlchemy engine events to count the statements each request runs,
+how long they take, and which ones repeat (the usual sign of an N+1 loop).
+Results go out in a `Server-Timing` response header and one structured log
+line per request.
+
+`count_queries()` and `QueryBudgetMixin` let tests put a ceiling on how
+many statements a route may issue.
+"""
+
+import json
+import logging
+from collections import Counter
+from contextlib import contextmanager
+from time import perf_counter
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+class QueryStats:
+    """Statements seen during one request (or one `count_queries` block)."""
+
+    def __init__(self):
+        self.statements = []
+
+    def record(self, statement, duration):
+        self.statements.append((statement, duration))
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+    @property
+    def total_time(self):
+        return sum(duration for _, duration in self.statements)
+
+    def slowest(self, n=3):
+        """The `n` slowest statements, as (statement, seconds) pairs."""
+
+        return sorted(self.statements, key=lambda s: s[1], reverse=True)[:n]
+
+    def duplicates(self):
+        """Statements run more than once, mapped to how many times."""
+
+        counts = Counter(statement for statement, _ in self.statements)
+        return {statement: n for statement, n in counts.items() if n > 1}
+
+
+logger = logging.getLogger("warbler.querystats")
+
+# Open `count_queries` blocks, innermost last.
+_counters = []
+
+
+# The start time lives on the execution context, which is thrown away with
+# the statement even when it fails and after_cursor_execute never runs.
+def _before_cursor_execute(conn, cursor, statement, parameters, context,
+                           executemany):
+    context._query_start = perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    duration = perf_counter() - context._query_start
+
+    for stats in _counters:
+        stats.record(statement, duration)
+
+    if has_request_context() and "query_stats" in g:
+        g.query_stats.record(statement, duration)
+
+
+event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+
+
+@contextmanager
+def count_queries():
+    """Collect statements run inside this block into a QueryStats."""
+
+    stats = QueryStats()
+    _counters.append(stats)
+    try:
+        yield stats
+    finally:
+        _counters.remove(stats)
+
+
+class QueryBudgetMixin:
+    """TestCase mixin for asserting how many statements code issues."""
+
+    @contextmanager
+    def assertMaxQueries(self, budget):
+        with count_queries() as stats:
+            yield stats
+
+        if stats.count > budget:
+            listing = "\n".join(statement for statement, _ in stats.statements)
+            self.fail(f"{stats.count} queries exceeded budget of {budget}:\n"
+                      f"{listing}")
+
+
+def _start_request():
+    g.query_stats = QueryStats()
+    g.request_start = perf_counter()
+
+
+def _report_request(response):
+    stats = g.pop("query_stats", None)
+    if stats is None:
+        return response
+
+    elapsed = perf_counter() - g.pop("request_start")
+    duplicates = stats.duplicates()
+
+    response.headers.add(
+        "Server-Timing",
+        f'db;dur={stats.total_time * 1000:.1f};desc="{stats.count} queries"',
+    )
+    response.headers.add("Server-Timing", f"app;dur={elapsed * 1000:.1f}")
+
+    logger.info(json.dumps({
+        "event": "request_queries",
+        "method": request.method,
+        "path": request.path,
+        "endpoint": request.endpoint,
+        "status": response.status_code,
+        "queries": stats.count,
+        "db_ms": round(stats.total_time * 1000, 2),
+        "total_ms": round(elapsed * 1000, 2),
+        "slowest": [
+            {"sql": statement[:200], "ms": round(duration * 1000, 2)}
+            for statement, duration in stats.slowest()
+        ],
+        "repeated": [
+            {"sql": statement[:200], "times": n}
+            for statement, n in duplicates.items()
+        ],
+    }))
+
+    return response
+
+
+def init_app(app):
+    """Collect and report statement statistics for every request.
+
+    The per-request lines go to the "warbler.querystats" logger, at INFO;
+    it logs to stderr unless logging is set up some other way.
+    """
+
+    if not logger.handlers and not logging.getLogger().handlers:
+        logger.addHandler(logging.StreamHandler())
+    if logger.level == logging.NOTSET:
+        logger.setLevel(logging.INFO)
+
+    app.before_request(_start_request)
+    app.after_request(_report_request)
@@ -0,0 +1,218 @@
+"""Who-to-follow suggestions: friends of friends.
+
+A user's suggestions are the people followed by the most of the people
+they follow (their `mutuals`), leaving out themselves and whoever they
+follow already. The best SUGGESTIONS_PER_USER are stored in
+`follow_suggestions`, for the home page and the user's own profile to read
+with one query (see `suggestions_for()`).
+
+`refresh_all()`, run by `flask refresh-suggestions --all`, rebuilds
+everyone's. It loads the follows graph into arrays (see graph.py), splits
+the user ids into ranges of SUGGESTION_RANGE_SIZE, works the ranges out
+in a pool of SUGGESTION_WORKERS processes, and writes and commits the
+results a range at a time.
+
+In between, a follow or unfollow (see edges.py) takes the followed user
+out of the follower's suggestions at once, and queues the follower in
+`suggestion_refreshes`. `refresh_queued()`, run by `flask
+refresh-suggestions`, recomputes just the queued users', in SQL.
+
+Either way, users whose suggestions were rewritten get a new
+activity_version, so pages showing them aren't answered from cache (see
+httpcache.py).
+"""
+
+import heapq
+import multiprocessing
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import aliased
+
+from models import db, User, Follow, FollowSuggestion, SuggestionRefresh
+import graph
+
+# The graph each pool worker works from; see _init_worker().
+_graph = None
+
+
+def suggest(follows, user_id, limit):
+    """[(suggested user id, mutuals)] for this user, best first, from a
+    graph.Graph."""
+
+    following = follows.following(user_id)
+    if not following:
+        return []
+
+    counts = Counter()
+    for followee in following:
+        counts.update(follows.following(followee))
+
+    counts.pop(user_id, None)
+    for followee in following:
+        counts.pop(followee, None)
+
+    return heapq.nlargest(limit, counts.items(),
+                          key=lambda item: (item[1], -item[0]))
+
+
+def _init_worker(follows):
+    global _graph
+    _graph = follows
+
+
+def _suggest_range(start, end, limit):
+    return [(user_id, suggested, mutuals)
+            for user_id in range(start, end)
+            for suggested, mutuals in suggest(_graph, user_id, limit)]
+
+
+def _replace(where, rows):
+    """Replace the suggestions of the users matching `where` (a filter on
+    User.id) with `rows` of (user id, suggested user id, mutuals)."""
+
+    db.session.execute(
+        db.delete(FollowSuggestion)
+        .where(where(FollowSuggestion.user_id))
+        .execution_options(synchronize_session=False))
+    if rows:
+        db.session.execute(insert(FollowSuggestion), [
+            {"user_id": user_id, "suggested_user_id": suggested,
+             "mutuals": mutuals}
+            for user_id, suggested, mutuals in rows
+        ])
+    db.session.execute(
+        db.update(User)
+        .where(where(User.id))
+        .values(activity_version=User.activity_version + 1)
+        .execution_options(synchronize_session=False))
+
+
+def _pool(workers, follows):
+    start_methods = multiprocessing.get_all_start_methods()
+    # Forked workers share the graph's pages instead of unpickling a copy.
+    context = multiprocessing.get_context(
+        "fork" if "fork" in start_methods else "spawn")
+    return ProcessPoolExecutor(workers, mp_context=context,
+                               initializer=_init_worker,
+                               initargs=(follows,))
+
+
+def refresh_all(limit, workers=0, range_size=10000):
+    """Rebuild every user's suggestions, committing a range of users at a
+    time. With `workers` = 0 it all runs in this process.
+
+    Returns the number of suggestions written.
+    """
+
+    follows = graph.load_follows()
+    db.session.commit()
+
+    ranges = [(start, min(start + range_size, follows.max_user_id + 1))
+              for start in range(1, follows.max_user_id + 1, range_size)]
+    starts, ends = [start for start, _ in ranges], [end for _, end in ranges]
+
+    if workers:
+        pool = _pool(workers, follows)
+        results = pool.map(_suggest_range, starts, ends,
+                           [limit] * len(ranges))
+    else:
+        pool = None
+        _init_worker(follows)
+        results = map(_suggest_range, starts, ends, [limit] * len(ranges))
+
+    written = 0
+    try:
+        for (start, end), rows in zip(ranges, results):
+            _replace(lambda id: id.between(start, end - 1), rows)
+            db.session.commit()
+            written += len(rows)
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+
+    return written
+
+
+def suggest_query(user_id, limit):
+    """suggest() for one user, as a query on the follows table."""
+
+    mine, theirs, already = (aliased(Follow), aliased(Follow),
+                             aliased(Follow))
+    suggested = theirs.user_being_followed_id
+    mutuals = db.func.count().label("mutuals")
+
+    return (db
+            .select(suggested, mutuals)
+            .join(mine, mine.user_being_followed_id
+                  == theirs.user_following_id)
+            .where(mine.user_following_id == user_id)
+            .where(suggested != user_id)
+            .where(~db.exists()
+                   .where(already.user_following_id == user_id)
+                   .where(already.user_being_followed_id == suggested))
+            .group_by(suggested)
+            .order_by(mutuals.desc(), suggested)
+            .limit(limit))
+
+
+def refresh_queued(limit, batch_size=100):
+    """Recompute up to `batch_size` queued users' suggestions, and commit.
+
+    Returns how many users were refreshed.
+    """
+
+    user_ids = db.session.scalars(
+        db.select(SuggestionRefresh.user_id)
+        .order_by(SuggestionRefresh.user_id)
+        .limit(batch_size)
+        .with_for_update(skip_locked=True)
+    ).all()
+    if not user_ids:
+        db.session.rollback()
+        return 0
+
+    rows = [(user_id, suggested, mutuals)
+            for user_id in user_ids
+            for suggested, mutuals in db.session.execute(
+                suggest_query(user_id, limit))]
+    _replace(lambda id: id.in_(user_ids), rows)
+    db.session.execute(
+        db.delete(SuggestionRefresh)
+        .where(SuggestionRefresh.user_id.in_(user_ids)))
+    db.session.commit()
+
+    return len(user_ids)
+
+
+def follows_changed(added, removed):
+    """Note follows just added or removed, as (follower, followed) pairs."""
+
+    if added:
+        db.session.execute(
+            db.delete(FollowSuggestion)
+            .where(db.tuple_(FollowSuggestion.user_id,
+                             FollowSuggestion.suggested_user_id).in_(added))
+            .execution_options(synchronize_session=False))
+
+    followers = sorted({follower for follower, _ in [*added, *removed]})
+    if followers:
+        db.session.execute(
+            insert(SuggestionRefresh)
+            .values([{"user_id": follower} for follower in followers])
+            .on_conflict_do_nothing())
+
+
+def suggestions_for(user_id, limit):
+    """This user's suggestions, best first, as (User, mutuals) pairs."""
+
+    return db.session.execute(
+        db.select(User, FollowSuggestion.mutuals)
+        .join(FollowSuggestion, FollowSuggestion.suggested_user_id == User.id)
+        .where(FollowSuggestion.user_id == user_id)
+        .where(User.disabled_at.is_(None))
+        .order_by(FollowSuggestion.mutuals.desc(),
+                  FollowSuggestion.suggested_user_id)
+        .limit(limit)
+    ).all()
@@ -0,0 +1,198 @@
+"""Sending reads to replicas.
+
+DATABASE_REPLICA_URLS gives the app one extra engine per read replica, the
+"replica_1", "replica_2", ... binds. `RoutingSession` runs the statements
+of GET and HEAD requests on one of them. Anything else runs on the
+primary, as does anything flushed, so writes always go to the primary.
+GET routes don't write: pages are computed from what's already stored.
+
+Replicas run a little behind the primary. `ReplicaMonitor` checks each
+one's replication lag every REPLICA_CHECK_INTERVAL seconds, and reads only
+go to replicas that answered and are less than REPLICA_MAX_LAG seconds
+behind. With none of those, reads go to the primary.
+
+So that users see what they've just done, a request that writes (any
+POST) keeps that browser's reads on the primary for the next
+READ_YOUR_WRITES_SECONDS. The deadline is kept in the (cookie) session.
+"""
+
+import random
+import threading
+from time import time
+
+from flask import current_app, g, has_request_context, request, session
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event, text
+from sqlalchemy.exc import DBAPIError
+
+REPLICA = "replica_"
+
+READ_METHODS = ("GET", "HEAD")
+
+# When this browser's reads can go back to replicas, as a Unix timestamp.
+PRIMARY_UNTIL_KEY = "primary_until"
+
+# Seconds since the last transaction replayed, or 0 if the replica has
+# replayed everything it has received (an idle primary sends nothing).
+LAG_QUERY = """
+SELECT CASE
+    WHEN NOT pg_is_in_recovery() THEN 0
+    WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+    ELSE COALESCE(
+        EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+END
+"""
+
+
+def replica_binds(urls):
+    """SQLALCHEMY_BINDS entries for these replica URLs."""
+
+    return {f"{REPLICA}{n}": url for n, url in enumerate(urls, 1)}
+
+
+def replica_keys(engines):
+    """The replica bind keys among `engines`."""
+
+    return sorted(key for key in engines
+                  if key is not None and key.startswith(REPLICA))
+
+
+class ReplicaMonitor:
+    """Which replicas are up and caught up enough to read from."""
+
+    def __init__(self, max_lag, check_interval):
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self.lock = threading.Lock()
+        # bind key -> (checked at, lag in seconds or None if unreachable)
+        self.status = {}
+
+    def lag(self, engine):
+        """How far `engine` is behind the primary, in seconds."""
+
+        if engine.dialect.name != "postgresql":
+            return 0.0
+        with engine.connect() as conn:
+            return float(conn.execute(text(LAG_QUERY)).scalar())
+
+    def check(self, key, engine):
+        """Measure `key`'s lag, unless it was measured recently."""
+
+        now = time()
+        with self.lock:
+            checked_at, lag = self.status.get(key, (0, None))
+            if now - checked_at < self.check_interval:
+                return lag
+            # Other threads use the last result while this one checks.
+            self.status[key] = (now, lag)
+
+        try:
+            lag = self.lag(engine)
+        except DBAPIError:
+            lag = None
+
+        with self.lock:
+            self.status[key] = (now, lag)
+        return lag
+
+    def mark_down(self, key):
+        """Stop reading from `key` until its next check."""
+
+        with self.lock:
+            self.status[key] = (time(), None)
+
+    def usable(self, engines):
+        """Keys of the replicas that reads can go to."""
+
+        keys = []
+        for key in replica_keys(engines):
+            lag = self.check(key, engines[key])
+            if lag is not None and lag < self.max_lag:
+                keys.append(key)
+        return keys
+
+    def as_dict(self, engines):
+        with self.lock:
+            status = dict(self.status)
+
+        return {
+            key: {
+                "lag_seconds": status.get(key, (0, None))[1],
+                "usable": key in status and status[key][1] is not None
+                and status[key][1] < self.max_lag,
+            }
+            for key in replica_keys(engines)
+        }
+
+
+def get_monitor():
+    return current_app.extensions["warbler_replicas"]
+
+
+def reads_from_replica():
+    """Is this a request whose reads can go to a replica?"""
+
+    return (has_request_context()
+            and request.method in READ_METHODS
+            and session.get(PRIMARY_UNTIL_KEY, 0) <= time())
+
+
+def replica_engine(engines):
+    """The engine this request reads from: a usable replica, or None.
+
+    Picked once per request, so a page reads from one consistent copy.
+    """
+
+    if "replica_key" not in g:
+        usable = get_monitor().usable(engines)
+        g.replica_key = random.choice(usable) if usable else None
+
+    return engines[g.replica_key] if g.replica_key is not None else None
+
+
+class RoutingSession(Session):
+    """A session that sends read-only requests' statements to replicas."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing and reads_from_replica():
+            engine = replica_engine(self._db.engines)
+            if engine is not None:
+                return engine
+
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind,
+                                **kwargs)
+
+
+def stats(engines):
+    """Each replica's last measured lag and whether it's read from."""
+
+    return get_monitor().as_dict(engines)
+
+
+def init_app(app, db):
+    """Set up the replica checks, and read-your-writes stickiness."""
+
+    monitor = ReplicaMonitor(
+        max_lag=app.config["REPLICA_MAX_LAG"],
+        check_interval=app.config["REPLICA_CHECK_INTERVAL"],
+    )
+    app.extensions["warbler_replicas"] = monitor
+
+    with app.app_context():
+        for key in replica_keys(db.engines):
+            def on_error(context, key=key):
+                if context.is_disconnect:
+                    monitor.mark_down(key)
+            event.listen(db.engines[key], "handle_error", on_error)
+
+    @app.before_request
+    def forget_replica():
+        g.pop("replica_key", None)
+
+    @app.after_request
+    def stick_to_primary(response):
+        if (request.method not in READ_METHODS
+                and app.config["READ_YOUR_WRITES_SECONDS"] > 0):
+            session[PRIMARY_UNTIL_KEY] = (
+                time() + app.config["READ_YOUR_WRITES_SECONDS"])
+        return response
@@ -0,0 +1,180 @@
+"""User search for /users?q=.
+
+Results come in tiers, best first: an exact username match, then usernames
+starting with the query, then usernames containing it, then users whose
+bio or location contains words starting with the query's words. Within a
+tier, newer users come first.
+
+Each tier is its own indexed query with a LIMIT, so a page costs about the
+same however many users there are:
+
+- exact and prefix matches use a btree on lower(username) with
+  text_pattern_ops;
+- substring matches use a trigram index where the pg_trgm extension
+  could be installed. Without it, they're only looked for among the
+  SUBSTRING_SCAN_LIMIT newest users, read backwards along the primary
+  key;
+- bio/location matches use a full-text GIN index.
+"""
+
+import re
+
+from sqlalchemy import event
+from sqlalchemy.exc import DBAPIError
+
+from models import db, User
+from pagination import decode_cursor, keyset_query, make_page, paginate
+
+USERNAME = db.func.lower(User.username)
+
+PROFILE = db.func.to_tsvector(
+    db.text("'simple'::regconfig"),
+    User.bio + " " + User.location,
+)
+
+db.Index(
+    "ix_users_username_prefix",
+    USERNAME.label("username_lower"),
+    postgresql_ops={"username_lower": "text_pattern_ops"},
+)
+
+db.Index(
+    "ix_users_profile_search",
+    PROFILE,
+    postgresql_using="gin",
+)
+
+# Pages are keyed on (tier score, user id), both descending.
+ORDER = (db.column("score", db.Integer), User.id)
+
+# Longer queries can't match a username anyway.
+MAX_QUERY_LENGTH = 30
+
+# Users scanned for substring matches when there's no trigram index.
+SUBSTRING_SCAN_LIMIT = 10000
+
+# Whether the trigram index is there, once checked (see has_trigram_index).
+_trigram_index = None
+
+
+@event.listens_for(User.__table__, "after_create")
+def _create_trigram_index(target, connection, **kw):
+    """Add the trigram index for substring matches, if pg_trgm is there."""
+
+    global _trigram_index
+    _trigram_index = None
+
+    try:
+        with connection.begin_nested():
+            connection.execute(db.text(
+                "CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+    except DBAPIError:
+        return
+
+    connection.execute(db.text(
+        "CREATE INDEX ix_users_username_trgm ON users "
+        "USING gin (lower(username) gin_trgm_ops)"))
+
+
+def has_trigram_index():
+    """Can substring matches use the trigram index? Checked once per
+    process (and again after the users table is created)."""
+
+    global _trigram_index
+    if _trigram_index is None:
+        _trigram_index = db.session.scalar(db.text(
+            "SELECT to_regclass('ix_users_username_trgm') IS NOT NULL"))
+    return _trigram_index
+
+
+def _escape_like(text):
+    return re.sub(r"([\\%_])", r"\\\1", text)
+
+
+def _tiers(search):
+    """(score, filter) for each tier the search runs, best first.
+
+    The filters are disjoint, so no user turns up in two tiers.
+    """
+
+    term = search.lower()
+    prefix = USERNAME.like(f"{_escape_like(term)}%", escape="\\")
+    contains = USERNAME.like(f"%{_escape_like(term)}%", escape="\\")
+
+    tiers = [
+        (3, USERNAME == term),
+        (2, prefix & (USERNAME != term)),
+    ]
+
+    substring = contains & ~prefix
+    if not has_trigram_index():
+        newest = (db.select(User.id)
+                  .order_by(User.id.desc())
+                  .limit(SUBSTRING_SCAN_LIMIT))
+        substring &= User.id.in_(newest.scalar_subquery())
+    tiers.append((1, substring))
+
+    words = re.findall(r"\w+", term)
+    if words:
+        query = db.func.to_tsquery(
+            db.text("'simple'::regconfig"),
+            " & ".join(f"{word}:*" for word in words),
+        )
+        tiers.append((0, PROFILE.op("@@")(query) & ~prefix & ~substring))
+
+    return tiers
+
+
+def search_users(search, before=None, after=None, per_page=50,
+                 columns=None):
+    """Get one page of users matching `search`, best matches first.
+
+    With no search, lists every user, newest first. Users whose accounts
+    are being deleted (see deletions.py) are left out. `before`/`after` are
+    page cursors (see pagination.py). Returns a Page of users, or with
+    `columns` (which must include User.id), of rows of just those.
+    """
+
+    query = User.query if columns is None else db.session.query(*columns)
+    query = query.filter(User.disabled_at.is_(None))
+
+    search = (search or "").strip()[:MAX_QUERY_LENGTH]
+    if not search:
+        return paginate(query, (User.id,), before, after, per_page)
+
+    before_key = decode_cursor(before, ORDER)
+    after_key = decode_cursor(after, ORDER)
+
+    tiers = _tiers(search)
+    if after_key is not None:
+        # Walking back up: the cursor's tier, then the better ones.
+        tiers = [(score, where) for score, where in reversed(tiers)
+                 if score >= after_key[0]]
+    elif before_key is not None:
+        tiers = [(score, where) for score, where in tiers
+                 if score <= before_key[0]]
+
+    rows = []
+    for score, where in tiers:
+        wanted = per_page - len(rows)
+        if wanted < 0:
+            break
+
+        # Within the cursor's tier, carry on from its user; later tiers
+        # are read from their start (an after key of 0 reads a whole tier
+        # oldest-first).
+        tier_before = tier_after = None
+        if after_key is not None:
+            tier_after = (after_key[1] if score == after_key[0] else 0,)
+        elif before_key is not None and score == before_key[0]:
+            tier_before = (before_key[1],)
+
+        users = keyset_query(query.filter(where), (User.id,),
+                             tier_before, tier_after, wanted).all()
+        rows += [(score, user) for user in users]
+
+    page = make_page(rows, per_page, lambda row: (row[0], row[1].id),
+                     before_key, after_key)
+    page.items = [user for _, user in page.items]
+
+    return page
@@ -1,19 +1,288 @@
-"""Seed database with sample data from CSV Files."""
+"""Seed database with sample data from CSV Files.
+
+    python seed.py                      # recreate tables, load generator/
+    python seed.py --copy /tmp/warbler  # same, with COPY: much faster
+    python seed.py --copy --append      # add rows to what's already there
+
+--copy streams each CSV into its table with PostgreSQL's COPY. On a fresh
+load, foreign keys and secondary indexes are dropped first and rebuilt
+once the rows are in, which is much cheaper than maintaining them row by
+row. --append keeps the existing tables (and their constraints) and only
+updates the counters and feeds the new rows touch; the ids the CSVs refer
+to must line up with what's already loaded.
+"""
+
+import argparse
+import csv
+import os
+from itertools import islice
+from time import perf_counter
 
-from csv import DictReader
 from app import db
-from models import User, Message, Follow
+from models import User, Message, Follow, Like, TimelineEntry
+import counters
+import messagesearch
+import timeline
+
+# Load order matters for the foreign keys when appending.
+TABLES = (
+    ('users', User),
+    ('messages', Message),
+    ('follows', Follow),
+    ('likes', Like),
+)
+
+
+# Rows per INSERT when not using COPY.
+BATCH_SIZE = 10_000
+
+
+def seed(directory='generator', copy=False, append=False):
+    """Load the users, messages, follows and (if there is one) likes CSVs.
+
+    Recreates the tables first unless `append`. Returns a dict of
+    table name -> (rows loaded, seconds taken).
+    """
+
+    if not append:
+        db.drop_all()
+        db.create_all()
+
+    paths = [(f'{directory}/{name}.csv', model) for name, model in TABLES]
+    paths = [(path, model) for path, model in paths if os.path.exists(path)]
+    tables = [model.__table__ for _, model in paths]
+
+    # Dropping constraints from tables that already have rows would mean
+    # rebuilding them over everything, not just the new rows.
+    deferred = copy and not append
+    if deferred:
+        constraints, indexes = _drop_constraints(tables)
+
+    last_message_id = db.session.scalar(
+        db.select(db.func.coalesce(db.func.max(Message.id), 0)))
+
+    stats = {}
+    staged = {}
+    for path, model in paths:
+        start = perf_counter()
+        table = model.__table__
+
+        # Appended follows and likes have no ids to tell them apart by, so
+        # they go through a temporary table that's kept for the updates
+        # below.
+        if append and model in (Follow, Like):
+            table = staged[model] = _staging_table(table)
+
+        if copy:
+            rows = _copy_csv(path, table)
+        else:
+            rows = _insert_csv(path, table)
+
+        if table is not model.__table__:
+            db.session.execute(db.insert(model.__table__).from_select(
+                [column.name for column in table.columns], db.select(table)))
+
+        stats[model.__tablename__] = (rows, perf_counter() - start)
+
+    if deferred:
+        start = perf_counter()
+        _restore_constraints(constraints, indexes)
+        stats['constraints'] = (0, perf_counter() - start)
+
+    if copy:
+        _reset_sequences(tables)
+
+    new_messages = Message.id > last_message_id
+
+    start = perf_counter()
+    if append:
+        counters.reconcile(_touched_users(new_messages, staged))
+    else:
+        counters.reconcile()
+    stats['counters'] = (0, perf_counter() - start)
+
+    start = perf_counter()
+    if append:
+        timeline.fan_out_loaded(new_messages, staged.get(Follow))
+    else:
+        # Feeds are the biggest table by far, so they get the same
+        # treatment as the loaded tables.
+        if deferred:
+            constraints, indexes = _drop_constraints(
+                [TimelineEntry.__table__])
+        timeline.rebuild_timelines()
+        if deferred:
+            _restore_constraints(constraints, indexes)
+    stats['timelines'] = (0, perf_counter() - start)
+
+    db.session.commit()
+
+    # Committed a batch at a time, once the rows it reads are in.
+    start = perf_counter()
+    indexed = messagesearch.index_messages(new_messages)
+    stats['search'] = (indexed, perf_counter() - start)
+
+    return stats
+
+
+def _staging_table(table):
+    """A temporary, constraint-free copy of `table`, dropped on commit."""
+
+    staging = db.Table(
+        f'staged_{table.name}',
+        db.MetaData(),
+        *[db.Column(column.name, column.type) for column in table.columns],
+        prefixes=['TEMPORARY'],
+        postgresql_on_commit='DROP',
+    )
+    staging.create(db.session.connection())
+    return staging
+
+
+def _touched_users(new_messages, staged):
+    """A select of the users whose counters appended rows change."""
+
+    selects = [db.select(Message.user_id).where(new_messages)]
+
+    if Follow in staged:
+        follows = staged[Follow]
+        selects += [db.select(follows.c.user_following_id),
+                    db.select(follows.c.user_being_followed_id)]
+
+    if Like in staged:
+        selects.append(db.select(staged[Like].c.user_id))
+
+    return db.union(*selects)
+
+
+def _insert_csv(path, table):
+    """INSERT a CSV's rows into `table`, BATCH_SIZE rows per statement.
+
+    Returns the row count.
+    """
+
+    rows = 0
+    with open(path, newline='') as f:
+        reader = csv.DictReader(f)
+        while batch := list(islice(reader, BATCH_SIZE)):
+            db.session.execute(db.insert(table), batch)
+            rows += len(batch)
+
+    return rows
+
+
+def _copy_csv(path, table):
+    """COPY a CSV (with a header row) into `table`; returns the row count.
+
+    The header names the columns. CSVs may leave out columns with server
+    defaults (like the counters) but not ones whose defaults are only set
+    in Python, which COPY never sees.
+    """
+
+    with open(path, newline='') as f:
+        header = next(csv.reader([f.readline()]))
+        for name in header:
+            if name not in table.columns:
+                raise ValueError(f"{path}: {table.name} has no column {name!r}")
+        columns = ", ".join(f'"{name}"' for name in header)
+
+        # Empty text fields load as '' like they do through DictReader,
+        # rather than COPY's default of NULL.
+        text = ", ".join(f'"{name}"' for name in header
+                         if isinstance(table.columns[name].type, db.String))
+        options = f", FORCE_NOT_NULL ({text})" if text else ""
+
+        cursor = db.session.connection().connection.cursor()
+        cursor.copy_expert(
+            f'COPY {table.name} ({columns}) FROM STDIN '
+            f'WITH (FORMAT csv{options})', f)
+        return cursor.rowcount
+
+
+def _drop_constraints(tables):
+    """Drop foreign keys into/out of `tables` and their secondary indexes.
+
+    Returns the (table, name, definition) of each foreign key and the
+    CREATE statement of each index, for _restore_constraints(). They're
+    read from the catalog since the foreign keys have database-made names.
+    """
+
+    names = [table.name for table in tables]
+
+    constraints = db.session.execute(db.text("""
+        SELECT conrelid::regclass::text, conname, pg_get_constraintdef(oid)
+        FROM pg_constraint
+        WHERE contype = 'f'
+          AND (conrelid::regclass::text = ANY(:names)
+               OR confrelid::regclass::text = ANY(:names))
+    """), {'names': names}).all()
+
+    # Primary keys and unique constraints stay: COPY should still reject
+    # duplicate rows.
+    indexes = db.session.execute(db.text("""
+        SELECT indexrelid::regclass::text, pg_get_indexdef(indexrelid)
+        FROM pg_index
+        WHERE indrelid::regclass::text = ANY(:names)
+          AND NOT EXISTS (SELECT 1 FROM pg_constraint
+                          WHERE conindid = indexrelid)
+    """), {'names': names}).all()
+
+    for table, name, _ in constraints:
+        db.session.execute(db.text(f'ALTER TABLE {table} DROP CONSTRAINT "{name}"'))
+    for name, _ in indexes:
+        db.session.execute(db.text(f'DROP INDEX {name}'))
+
+    return constraints, indexes
+
+
+def _restore_constraints(constraints, indexes):
+    db.session.execute(db.text("SET LOCAL maintenance_work_mem = '256MB'"))
+
+    for _, definition in indexes:
+        db.session.execute(db.text(definition))
+    for table, name, definition in constraints:
+        db.session.execute(db.text(
+            f'ALTER TABLE {table} ADD CONSTRAINT "{name}" {definition}'))
+
+
+def _reset_sequences(tables):
+    """Point serial id sequences past the highest loaded id.
+
+    COPY takes ids from the CSV when it has an id column, which doesn't
+    advance the sequence.
+    """
+
+    for table in tables:
+        if 'id' not in table.columns:
+            continue
+        db.session.execute(db.text(
+            f"SELECT setval(pg_get_serial_sequence('{table.name}', 'id'), "
+            f"COALESCE(MAX(id), 1), MAX(id) IS NOT NULL) FROM {table.name}"
+        ))
+
 
-db.drop_all()
-db.create_all()
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument('directory', nargs='?', default='generator',
+                        help="directory containing the CSV files")
+    parser.add_argument('--copy', action='store_true',
+                        help="load with COPY instead of INSERTs")
+    parser.add_argument('--append', action='store_true',
+                        help="add to the existing tables instead of "
+                             "recreating them")
+    args = parser.parse_args()
 
-with open('generator/users.csv') as users:
-    db.session.bulk_insert_mappings(User, DictReader(users))
+    start = perf_counter()
+    stats = seed(args.directory, copy=args.copy, append=args.append)
 
-with open('generator/messages.csv') as messages:
-    db.session.bulk_insert_mappings(Message, DictReader(messages))
+    for name, (rows, seconds) in stats.items():
+        if rows:
+            print(f"{name:<12}{rows:>12} rows {seconds:>8.1f}s "
+                  f"{rows / seconds if seconds else 0:>12,.0f} rows/s")
+        else:
+            print(f"{name:<12}{'':>17}{seconds:>8.1f}s")
+    print(f"Seeded in {perf_counter() - start:.1f}s")
 
-with open('generator/follows.csv') as follows:
-    db.session.bulk_insert_mappings(Follow, DictReader(follows))
 
-db.session.commit()
+if __name__ == '__main__':
+    main()
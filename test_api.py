@@ -0,0 +1,166 @@
+"""JSON API tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_api.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, User, Message, Follow, Like
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
+
+from app import app, CURR_USER_KEY
+import counters
+import deletions
+import timeline
+
+app.config['TESTING'] = True
+
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+db.drop_all()
+db.create_all()
+
+
+class APITestCase(TestCase):
+    def setUp(self):
+        db.session.rollback()
+        User.query.delete()
+
+        u1 = User.signup("u1", "u1@email.com", "password", None)
+        u2 = User.signup("u2", "u2@email.com", "password", None)
+        db.session.flush()
+        db.session.add(Follow(user_being_followed_id=u2.id,
+                              user_following_id=u1.id))
+        messages = [Message(text=f"m{i}", user_id=u2.id) for i in range(3)]
+        db.session.add_all(messages)
+        db.session.flush()
+        db.session.add(Like(user_id=u1.id, message_id=messages[0].id))
+        db.session.commit()
+        timeline.rebuild_timelines()
+        counters.reconcile()
+        db.session.commit()
+
+        self.u1_id = u1.id
+        self.u2_id = u2.id
+        self.message_ids = [msg.id for msg in messages]
+
+        self.client = app.test_client()
+        with self.client.session_transaction() as session:
+            session[CURR_USER_KEY] = self.u1_id
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def test_logged_out(self):
+        resp = app.test_client().get("/api/v1/timeline")
+
+        self.assertEqual(resp.status_code, 401)
+        self.assertIn("error", resp.json)
+
+    def test_timeline(self):
+        resp = self.client.get("/api/v1/timeline")
+
+        self.assertEqual(resp.status_code, 200)
+        data = resp.json["data"]
+        self.assertEqual([msg["id"] for msg in data],
+                         self.message_ids[::-1])
+        self.assertEqual(data[-1]["username"], "u2")
+        self.assertEqual(data[-1]["liked"], True)
+        self.assertEqual(data[0]["liked"], False)
+        self.assertTrue(data[0]["timestamp"].endswith("Z"))
+        self.assertIsNone(resp.json["next_cursor"])
+
+    def test_sparse_fields(self):
+        resp = self.client.get("/api/v1/timeline?fields=id,text")
+
+        self.assertEqual(resp.json["data"][0],
+                         {"id": self.message_ids[-1], "text": "m2"})
+
+        resp = self.client.get("/api/v1/users/1?fields=id,password")
+        self.assertEqual(resp.status_code, 400)
+        self.assertIn("password", resp.json["error"])
+
+    def test_pages(self):
+        app.config['PAGE_SIZE'] = 2
+        self.addCleanup(app.config.__setitem__, 'PAGE_SIZE', 50)
+
+        url = f"/api/v1/users/{self.u2_id}/messages?fields=text"
+        first = self.client.get(url).json
+        second = self.client.get(
+            f"{url}&before={first['next_cursor']}").json
+
+        self.assertEqual([msg["text"] for msg in first["data"]],
+                         ["m2", "m1"])
+        self.assertEqual(second["data"], [{"text": "m0"}])
+        self.assertIsNone(second["next_cursor"])
+
+    def test_user(self):
+        resp = self.client.get(f"/api/v1/users/{self.u2_id}")
+
+        data = resp.json["data"]
+        self.assertEqual(data["username"], "u2")
+        self.assertEqual(data["messages_count"], 3)
+        self.assertEqual(data["followed"], True)
+        self.assertNotIn("password", data)
+        self.assertNotIn("email", data)
+
+        self.assertEqual(self.client.get("/api/v1/users/0").status_code, 404)
+
+    def test_follows_and_likes(self):
+        following = self.client.get(
+            f"/api/v1/users/{self.u1_id}/following?fields=username").json
+        followers = self.client.get(
+            f"/api/v1/users/{self.u2_id}/followers?fields=username").json
+        likes = self.client.get(
+            f"/api/v1/users/{self.u1_id}/likes?fields=id").json
+
+        self.assertEqual(following["data"], [{"username": "u2"}])
+        self.assertEqual(followers["data"], [{"username": "u1"}])
+        self.assertEqual(likes["data"], [{"id": self.message_ids[0]}])
+
+    def test_search(self):
+        resp = self.client.get("/api/v1/users?q=u2&fields=id")
+
+        self.assertEqual(resp.json["data"], [{"id": self.u2_id}])
+
+    def test_batch(self):
+        ids = [self.message_ids[2], 0, self.message_ids[0]]
+        resp = self.client.get(
+            f"/api/v1/messages?ids={','.join(map(str, ids))}&fields=id")
+
+        self.assertEqual(resp.json["data"], [{"id": self.message_ids[2]},
+                                             {"id": self.message_ids[0]}])
+
+        resp = self.client.get(
+            f"/api/v1/users?ids={self.u2_id},{self.u1_id}&fields=username")
+        self.assertEqual(resp.json["data"],
+                         [{"username": "u2"}, {"username": "u1"}])
+
+    def test_author_disabled(self):
+        """Messages by users being deleted aren't served."""
+
+        deletions.disable(self.u2_id)
+        db.session.commit()
+
+        resp = self.client.get(
+            f"/api/v1/messages?ids={self.message_ids[0]}&fields=id")
+        self.assertEqual(resp.json["data"], [])
+        self.assertEqual(self.client.get(
+            f"/api/v1/messages/{self.message_ids[0]}").status_code, 404)
+        self.assertEqual(
+            self.client.get("/api/v1/timeline").json["data"], [])
+
+    def test_batch_limits(self):
+        ids = ",".join(map(str, range(app.config['API_MAX_BATCH'] + 1)))
+
+        self.assertEqual(
+            self.client.get(f"/api/v1/users?ids={ids}").status_code, 400)
+        self.assertEqual(
+            self.client.get("/api/v1/users?ids=1,x").status_code, 400)
+        self.assertEqual(self.client.get("/api/v1/messages").status_code, 400)
@@ -0,0 +1,196 @@
+"""User/message cache tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_cache.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, User, Message
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
+
+from app import app, CURR_USER_KEY
+from querystats import count_queries
+import cache
+import counters
+
+app.config['TESTING'] = True
+
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+db.drop_all()
+db.create_all()
+
+
+class CacheTestCase(TestCase):
+    def setUp(self):
+        db.session.rollback()
+        User.query.delete()
+
+        u1 = User.signup("u1", "u1@email.com", "password", None)
+        u2 = User.signup("u2", "u2@email.com", "password", None)
+        db.session.flush()
+
+        m1 = Message(text="m1-text", user_id=u1.id)
+        db.session.add(m1)
+        db.session.commit()
+
+        self.u1_id = u1.id
+        self.u2_id = u2.id
+        self.m1_id = m1.id
+
+        # A fresh, empty cache with zeroed stats
+        cache.init_app(app)
+        db.session.expunge_all()
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+        db.session.rollback()
+        app.config['CACHE_URL'] = 'local'
+        cache.init_app(app)
+
+    def get_user(self, user_id):
+        """cache.get_user() as a new request would, with an empty session."""
+
+        db.session.expunge_all()
+        with count_queries() as stats:
+            user = cache.get_user(user_id)
+        return user, stats.count
+
+    def test_read_through(self):
+        user, queries = self.get_user(self.u1_id)
+        self.assertEqual(queries, 1)
+
+        user, queries = self.get_user(self.u1_id)
+        self.assertEqual(queries, 0)
+        self.assertEqual(user.username, "u1")
+        self.assertTrue(db.inspect(user).persistent)
+
+        # Relationships still load as usual
+        self.assertEqual([msg.id for msg in user.messages], [self.m1_id])
+
+        stats = cache.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['sets']),
+                         (1, 1, 1))
+        self.assertEqual(stats['hit_rate'], 0.5)
+
+    def test_missing(self):
+        self.assertIsNone(cache.get_user(0))
+        self.assertIsNone(cache.get_message(0))
+        self.assertEqual(cache.stats()['entries'], 0)
+
+    def test_changes_invalidate(self):
+        user, _ = self.get_user(self.u1_id)
+        user.bio = "new bio"
+        db.session.commit()
+
+        user, queries = self.get_user(self.u1_id)
+        self.assertEqual(queries, 1)
+        self.assertEqual(user.bio, "new bio")
+
+    def test_adjust_invalidates_one_user(self):
+        self.get_user(self.u1_id)
+        self.get_user(self.u2_id)
+
+        counters.adjust(self.u1_id, likes=1)
+        db.session.commit()
+
+        user, queries = self.get_user(self.u1_id)
+        self.assertEqual(queries, 1)
+        self.assertEqual(user.likes_count, 1)
+
+        _, queries = self.get_user(self.u2_id)
+        self.assertEqual(queries, 0)
+
+    def test_bulk_delete_clears(self):
+        cache.get_message(self.m1_id)
+        self.assertEqual(cache.stats()['entries'], 1)
+
+        Message.query.delete()
+        db.session.commit()
+
+        self.assertEqual(cache.stats()['entries'], 0)
+        self.assertIsNone(cache.get_message(self.m1_id))
+
+    def test_deleting_user_drops_messages(self):
+        cache.get_message(self.m1_id)
+
+        User.query.filter_by(id=self.u1_id).delete()
+        db.session.commit()
+
+        self.assertEqual(cache.stats()['entries'], 0)
+        self.assertIsNone(cache.get_message(self.m1_id))
+
+    def test_not_cached_mid_change(self):
+        counters.adjust(self.u1_id, likes=1)
+
+        user, _ = self.get_user(self.u1_id)
+        self.assertEqual(user.likes_count, 1)
+        self.assertEqual(cache.stats()['sets'], 0)
+
+        db.session.rollback()
+
+        user, _ = self.get_user(self.u1_id)
+        self.assertEqual(user.likes_count, 0)
+
+    def test_lru(self):
+        stats = cache.Stats()
+        backend = cache.LRUBackend(stats, max_entries=2, ttl=60)
+
+        backend.set("a", 1)
+        backend.set("b", 2)
+        backend.get("a")
+        backend.set("c", 3)
+
+        self.assertIsNone(backend.get("b"))
+        self.assertEqual((backend.get("a"), backend.get("c")), (1, 3))
+        self.assertEqual(stats.as_dict()['evictions'], 1)
+
+        backend.ttl = 0
+        backend.set("d", 4)
+        self.assertIsNone(backend.get("d"))
+        self.assertEqual(stats.as_dict()['expirations'], 1)
+
+    def test_shared_backend(self):
+        app.config['CACHE_URL'] = 'memory'
+        cache.init_app(app)
+
+        self.get_user(self.u1_id)
+        user, queries = self.get_user(self.u1_id)
+
+        self.assertEqual(queries, 0)
+        self.assertEqual(user.email, "u1@email.com")
+        self.assertEqual(cache.stats()['backend'], "SharedBackend")
+
+        counters.adjust(self.u1_id, following=1)
+        db.session.commit()
+        self.assertEqual(cache.stats()['entries'], 0)
+
+    def test_show_message_cached(self):
+        with self.client.session_transaction() as session:
+            session[CURR_USER_KEY] = self.u1_id
+
+        self.client.get(f"/messages/{self.m1_id}")
+        db.session.expunge_all()
+
+        # Only the liked-ids lookup is left
+        with count_queries() as stats:
+            resp = self.client.get(f"/messages/{self.m1_id}")
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn("m1-text", resp.get_data(as_text=True))
+        self.assertEqual(stats.count, 1)
+
+    def test_stats_endpoint(self):
+        resp = self.client.get("/internal/cache")
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.json['backend'], "LRUBackend")
+
+        resp = self.client.get("/internal/cache",
+                               environ_base={'REMOTE_ADDR': '10.0.0.1'})
+        self.assertEqual(resp.status_code, 403)
@@ -0,0 +1,194 @@
+"""Background account deletion tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_deletions.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, User, Message, Follow, Like, TimelineEntry
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
+
+from app import app, CURR_USER_KEY
+import counters
+import deletions
+import timeline
+
+app.config['TESTING'] = True
+
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+db.drop_all()
+db.create_all()
+
+
+class DeletionsTestCase(TestCase):
+    def setUp(self):
+        db.session.rollback()
+        User.query.delete()
+
+        u1 = User.signup("u1", "u1@email.com", "password", None)
+        u2 = User.signup("u2", "u2@email.com", "password", None)
+        u3 = User.signup("u3", "u3@email.com", "password", None)
+        db.session.flush()
+
+        # u1, the one to delete, follows and is followed by both others,
+        # has messages they've liked, and likes theirs.
+        db.session.add_all([
+            Follow(user_being_followed_id=other.id, user_following_id=u1.id)
+            for other in (u2, u3)
+        ] + [
+            Follow(user_being_followed_id=u1.id, user_following_id=other.id)
+            for other in (u2, u3)
+        ])
+        messages = [Message(text=f"m{i}", user_id=u1.id) for i in range(3)]
+        others = [Message(text="other", user_id=other.id)
+                  for other in (u2, u3)]
+        db.session.add_all(messages + others)
+        db.session.flush()
+        db.session.add_all([Like(user_id=other.id, message_id=msg.id)
+                            for other in (u2, u3) for msg in messages])
+        db.session.add_all([Like(user_id=u1.id, message_id=msg.id)
+                            for msg in others])
+        db.session.commit()
+        timeline.rebuild_timelines()
+        counters.reconcile()
+        db.session.commit()
+
+        self.u1_id = u1.id
+        self.u2_id = u2.id
+        self.u3_id = u3.id
+
+        self.client = app.test_client()
+        with self.client.session_transaction() as session:
+            session[CURR_USER_KEY] = self.u1_id
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def counts(self, user_id):
+        user = db.session.get(User, user_id)
+        db.session.refresh(user)
+        return (user.messages_count, user.following_count,
+                user.followers_count, user.likes_count)
+
+    def test_delete_route_disables(self):
+        resp = self.client.post("/users/delete")
+
+        self.assertEqual(resp.status_code, 302)
+        with self.client.session_transaction() as session:
+            self.assertNotIn(CURR_USER_KEY, session)
+
+        # Nothing's deleted yet, but the account is gone from view
+        db.session.rollback()
+        self.assertIsNotNone(db.session.get(User, self.u1_id).disabled_at)
+        self.assertEqual(Message.query.filter_by(user_id=self.u1_id).count(),
+                         3)
+        self.assertFalse(User.authenticate("u1", "password"))
+
+        with self.client.session_transaction() as session:
+            session[CURR_USER_KEY] = self.u2_id
+        self.assertEqual(
+            self.client.get(f"/users/{self.u1_id}").status_code, 404)
+        html = self.client.get(
+            f"/users/{self.u2_id}/followers").get_data(as_text=True)
+        self.assertNotIn("@u1", html)
+        html = self.client.get("/users?q=u").get_data(as_text=True)
+        self.assertNotIn("@u1", html)
+
+    def test_logged_in_elsewhere(self):
+        deletions.disable(self.u1_id)
+        db.session.commit()
+
+        resp = self.client.get("/users/profile")
+
+        self.assertEqual(resp.status_code, 302)
+        self.assertEqual(resp.location, "/login")
+
+    def test_writes_from_elsewhere(self):
+        """Another session can't post, follow or like once the account is
+        disabled, nor once it's gone."""
+
+        deletions.disable(self.u1_id)
+        db.session.commit()
+        other = Message.query.filter_by(user_id=self.u2_id).one()
+
+        for url, data in (("/messages/new", {"text": "still here"}),
+                          (f"/users/follow/{self.u2_id}", {}),
+                          (f"/like/{other.id}", {})):
+            resp = self.client.post(url, data=data)
+            self.assertEqual(resp.location, "/login")
+            with self.client.session_transaction() as session:
+                self.assertNotIn(CURR_USER_KEY, session)
+                session[CURR_USER_KEY] = self.u1_id
+        self.assertEqual(Message.query.filter_by(user_id=self.u1_id).count(),
+                         3)
+
+        while deletions.step(batch_size=10):
+            pass
+        resp = self.client.post("/messages/new", data={"text": "gone"})
+        self.assertEqual(resp.location, "/login")
+
+    def test_batches(self):
+        deletions.disable(self.u1_id)
+        db.session.commit()
+
+        progress = deletions.progress()
+        self.assertEqual(progress[0]["remaining"], {
+            "messages": 3, "likes": 2, "following": 2, "followers": 2})
+
+        steps = []
+        while True:
+            deleted = deletions.step(batch_size=2)
+            if deleted is None:
+                break
+            steps.append(deleted[1:])
+
+        self.assertEqual(steps, [
+            ("message likes", 2), ("message likes", 2), ("message likes", 2),
+            ("message feed entries", 2), ("message feed entries", 2),
+            ("message feed entries", 2), ("message feed entries", 2),
+            ("message feed entries", 1),
+            ("messages", 2), ("messages", 1),
+            ("likes", 2),
+            ("following", 2),
+            ("followers", 2),
+            ("feed entries", 2),
+            ("user", 1),
+        ])
+        self.assertIsNone(db.session.get(User, self.u1_id))
+        self.assertEqual(deletions.progress(), [])
+
+        # Everyone else's counters kept up
+        self.assertEqual(self.counts(self.u2_id), (1, 0, 0, 0))
+        self.assertEqual(self.counts(self.u3_id), (1, 0, 0, 0))
+        counters.reconcile()
+        db.session.commit()
+        self.assertEqual(self.counts(self.u2_id), (1, 0, 0, 0))
+
+    def test_cli(self):
+        deletions.disable(self.u1_id)
+        db.session.commit()
+
+        result = app.test_cli_runner().invoke(args=["delete-accounts"])
+
+        self.assertIn(f"User #{self.u1_id}: deleted 1 user", result.output)
+        self.assertEqual(User.query.count(), 2)
+        self.assertEqual(TimelineEntry.query.filter_by(
+            author_id=self.u1_id).count(), 0)
+
+    def test_orm_delete(self):
+        """Deleting a User through the session leaves its rows to the
+        database's cascades, rather than loading them."""
+
+        db.session.delete(db.session.get(User, self.u1_id))
+        db.session.commit()
+
+        self.assertEqual(Message.query.count(), 2)
+        self.assertEqual(Like.query.count(), 0)
+        self.assertEqual(Follow.query.count(), 0)
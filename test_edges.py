@@ -0,0 +1,194 @@
+"""Like/follow write pipeline tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_edges.py
+
+
+import os
+import tempfile
+from unittest import TestCase
+
+from models import db, User, Message, Follow, Like, TimelineEntry
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
+
+from app import app, CURR_USER_KEY
+import edgequeue
+import edges
+
+app.config['TESTING'] = True
+
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+db.drop_all()
+db.create_all()
+
+
+class EdgesTestCase(TestCase):
+    def setUp(self):
+        db.session.rollback()
+        User.query.delete()
+
+        u1 = User.signup("u1", "u1@email.com", "password", None)
+        u2 = User.signup("u2", "u2@email.com", "password", None)
+        db.session.flush()
+
+        m1 = Message(text="m1-text", user_id=u1.id)
+        m2 = Message(text="m2-text", user_id=u2.id)
+        db.session.add_all([m1, m2])
+        db.session.commit()
+
+        self.u1_id = u1.id
+        self.u2_id = u2.id
+        self.m1_id = m1.id
+        self.m2_id = m2.id
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+        db.session.rollback()
+        app.config['EDGE_WRITES'] = 'sync'
+
+    def use_queue(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+
+        app.config['EDGE_WRITES'] = 'queue'
+        app.config['EDGE_QUEUE_PATH'] = os.path.join(directory.name, 'q.db')
+        edgequeue.init_app(app)
+
+    def counts(self, user_id):
+        db.session.expire_all()
+        user = db.session.get(User, user_id)
+        return (user.likes_count, user.following_count, user.followers_count)
+
+    def test_apply(self):
+        changed = edges.apply([
+            (edges.LIKE, self.u1_id, self.m2_id, True),
+            (edges.FOLLOW, self.u1_id, self.u2_id, True),
+        ])
+        db.session.commit()
+
+        self.assertEqual(changed, {"likes+": 1, "follows+": 1})
+        self.assertEqual(self.counts(self.u1_id), (1, 1, 0))
+        self.assertEqual(self.counts(self.u2_id), (0, 0, 1))
+
+        # u2's message was backfilled into u1's feed
+        self.assertEqual(
+            TimelineEntry.query.filter_by(user_id=self.u1_id,
+                                          message_id=self.m2_id).count(), 1)
+
+    def test_apply_idempotent(self):
+        ops = [(edges.LIKE, self.u1_id, self.m2_id, True)]
+        edges.apply(ops)
+        changed = edges.apply(ops)
+        db.session.commit()
+
+        self.assertEqual(changed, {})
+        self.assertEqual(Like.query.count(), 1)
+        self.assertEqual(self.counts(self.u1_id), (1, 0, 0))
+
+    def test_coalesce(self):
+        changed = edges.apply([
+            (edges.LIKE, self.u1_id, self.m2_id, True),
+            (edges.LIKE, self.u1_id, self.m2_id, False),
+            (edges.FOLLOW, self.u1_id, self.u2_id, False),
+            (edges.FOLLOW, self.u1_id, self.u2_id, True),
+        ])
+        db.session.commit()
+
+        self.assertEqual(changed, {"follows+": 1})
+        self.assertEqual(Like.query.count(), 0)
+        self.assertEqual(Follow.query.count(), 1)
+
+    def test_skips_invalid(self):
+        changed = edges.apply([
+            (edges.LIKE, self.u1_id, self.m1_id, True),
+            (edges.LIKE, self.u1_id, 0, True),
+            (edges.LIKE, 0, self.m2_id, True),
+            (edges.FOLLOW, self.u1_id, self.u1_id, True),
+            (edges.FOLLOW, self.u1_id, 0, True),
+        ])
+        db.session.commit()
+
+        self.assertEqual(changed, {})
+        self.assertEqual(self.counts(self.u1_id), (0, 0, 0))
+
+    def test_unfollow(self):
+        edges.apply([(edges.FOLLOW, self.u1_id, self.u2_id, True)])
+        changed = edges.apply([(edges.FOLLOW, self.u1_id, self.u2_id, False)])
+        db.session.commit()
+
+        self.assertEqual(changed, {"follows-": 1})
+        self.assertEqual(self.counts(self.u1_id), (0, 0, 0))
+        self.assertEqual(
+            TimelineEntry.query.filter_by(user_id=self.u1_id,
+                                          author_id=self.u2_id).count(), 0)
+
+    def test_queue(self):
+        self.use_queue()
+
+        with self.client.session_transaction() as session:
+            session[CURR_USER_KEY] = self.u1_id
+
+        self.client.post(f"/like/{self.m2_id}")
+        self.client.post(f"/users/follow/{self.u2_id}")
+
+        self.assertEqual(Like.query.count(), 0)
+        self.assertEqual(len(edgequeue.get_queue()), 2)
+
+        # u1 sees their own changes...
+        u1 = db.session.get(User, self.u1_id)
+        m2 = db.session.get(Message, self.m2_id)
+        self.assertEqual(u1.liked_message_ids([m2]), {self.m2_id})
+        self.assertTrue(u1.is_following(self.u2_id))
+
+        html = self.client.get(
+            f"/users/{self.u1_id}/following").get_data(as_text=True)
+        self.assertIn("@u2", html)
+        html = self.client.get(
+            f"/users/{self.u1_id}/likes").get_data(as_text=True)
+        self.assertIn("m2-text", html)
+
+        # ...but others don't
+        u2 = db.session.get(User, self.u2_id)
+        self.assertFalse(u2.is_followed_by(u1))
+
+        self.assertEqual(edges.drain(100)[0], 2)
+        self.assertEqual(len(edgequeue.get_queue()), 0)
+        self.assertEqual(self.counts(self.u1_id), (1, 1, 0))
+        self.assertEqual(self.counts(self.u2_id), (0, 0, 1))
+
+    def test_queue_cancels_out(self):
+        self.use_queue()
+
+        with self.client.session_transaction() as session:
+            session[CURR_USER_KEY] = self.u1_id
+
+        self.client.post(f"/like/{self.m2_id}")
+        self.client.post(f"/unlike/{self.m2_id}")
+
+        u1 = db.session.get(User, self.u1_id)
+        m2 = db.session.get(Message, self.m2_id)
+        self.assertEqual(u1.liked_message_ids([m2]), set())
+
+        taken, changed = edges.drain(100)
+        self.assertEqual((taken, changed), (2, {}))
+        self.assertEqual(Like.query.count(), 0)
+
+    def test_queue_redelivery(self):
+        """Ops applied but not yet marked done are harmless to reapply."""
+
+        self.use_queue()
+        queue = edgequeue.get_queue()
+        queue.put(edges.LIKE, self.u1_id, self.m2_id, True)
+
+        edges.apply([op for _, op in queue.take(100)])
+        db.session.commit()
+        edges.drain(100)
+
+        self.assertEqual(Like.query.count(), 1)
+        self.assertEqual(self.counts(self.u1_id), (1, 0, 0))
@@ -0,0 +1,199 @@
+"""In-memory follow index tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_followindex.py
+
+
+import os
+from array import array
+from unittest import TestCase, mock
+
+from models import db, User, Follow, FollowChange
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
+
+from app import app, CURR_USER_KEY
+from followindex import FollowIndex
+import deletions
+import edges
+import followindex
+import graph
+
+app.config['TESTING'] = True
+
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+db.drop_all()
+db.create_all()
+
+
+class FollowIndexTestCase(TestCase):
+    """The index on its own."""
+
+    def setUp(self):
+        # 1 follows 2 and 3; 3 follows 1.
+        self.index = FollowIndex(array("q", [0, 0, 2, 2, 3]),
+                                 array("i", [2, 3, 1]))
+
+    def test_lookups(self):
+        self.assertEqual(list(self.index.following(1)), [2, 3])
+        self.assertEqual(list(self.index.following(2)), [])
+        self.assertEqual(list(self.index.following(99)), [])
+        self.assertTrue(self.index.follows(1, 3))
+        self.assertFalse(self.index.follows(3, 2))
+        self.assertFalse(self.index.follows(99, 1))
+
+    def test_update(self):
+        targets = self.index.targets
+        with mock.patch.object(followindex, "COMPACT_RATIO", 10):
+            self.index.update({(1, 2): False, (1, 5): True, (2, 1): True,
+                               (7, 1): True})
+
+        self.assertEqual(list(self.index.following(1)), [3, 5])
+        self.assertEqual(list(self.index.following(2)), [1])
+        self.assertEqual(list(self.index.following(7)), [1])
+        # The arrays it started from are left alone
+        self.assertEqual(list(targets), [2, 3, 1])
+        self.assertEqual(self.index.edges, 5)
+        self.assertEqual(self.index.changed_edges, 4)
+
+    def test_compact(self):
+        """Once the changed users' copies are big enough, they're folded
+        into new arrays."""
+
+        targets = self.index.targets
+        with mock.patch.object(followindex, "COMPACT_RATIO", 1):
+            self.index.update({(1, 5): True})
+            self.assertEqual(self.index.compactions, 0)
+
+            self.index.update({(3, 1): False, (2, 1): True})
+
+        self.assertEqual(self.index.compactions, 1)
+        self.assertEqual(self.index.changed, {})
+        self.assertEqual(self.index.changed_edges, 0)
+        self.assertEqual(list(self.index.offsets), [0, 0, 3, 4, 4])
+        self.assertEqual(list(self.index.following(1)), [2, 3, 5])
+        self.assertEqual(list(self.index.following(2)), [1])
+        self.assertEqual(list(self.index.following(3)), [])
+        self.assertEqual(list(targets), [2, 3, 1])
+        self.assertEqual(self.index.edges, 4)
+
+    def test_stats(self):
+        stats = self.index.stats()
+
+        self.assertEqual(stats["edges"], 3)
+        self.assertEqual(stats["bytes"], 5 * 8 + 3 * 4)
+        self.assertEqual(stats["bytes_per_million_edges"],
+                         round(52 / 3 * 1_000_000))
+
+
+class FollowIndexAppTestCase(TestCase):
+    """The index as the app keeps it."""
+
+    def setUp(self):
+        db.session.rollback()
+        User.query.delete()
+        FollowChange.query.delete()
+
+        u1 = User.signup("u1", "u1@email.com", "password", None)
+        u2 = User.signup("u2", "u2@email.com", "password", None)
+        u3 = User.signup("u3", "u3@email.com", "password", None)
+        db.session.flush()
+        db.session.add(Follow(user_following_id=u1.id,
+                              user_being_followed_id=u2.id))
+        db.session.commit()
+
+        self.u1_id = u1.id
+        self.u2_id = u2.id
+        self.u3_id = u3.id
+
+        app.extensions["follow_index"] = self.index = graph.load_index()
+        db.session.commit()
+        self.addCleanup(app.extensions.pop, "follow_index")
+
+        self.client = app.test_client()
+        with self.client.session_transaction() as session:
+            session[CURR_USER_KEY] = self.u1_id
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def test_loaded(self):
+        self.assertTrue(self.index.follows(self.u1_id, self.u2_id))
+        self.assertFalse(self.index.follows(self.u2_id, self.u1_id))
+
+        with app.test_request_context():
+            u1 = db.session.get(User, self.u1_id)
+            u2 = db.session.get(User, self.u2_id)
+            self.assertTrue(u1.is_following(u2))
+            self.assertTrue(u2.is_followed_by(u1))
+            self.assertFalse(u2.is_following(u1))
+
+    def test_follow_routes(self):
+        self.client.post(f"/users/follow/{self.u3_id}")
+        self.assertTrue(self.index.follows(self.u1_id, self.u3_id))
+
+        self.client.post(f"/users/stop-following/{self.u2_id}")
+        self.assertFalse(self.index.follows(self.u1_id, self.u2_id))
+
+        self.assertEqual(db.session.scalars(
+            db.select(FollowChange.user_id)).all(),
+            [self.u1_id, self.u1_id])
+
+    def test_uncommitted(self):
+        """A follow is seen in its own transaction before the index has
+        it; a rolled back one never gets there."""
+
+        with app.test_request_context():
+            u1 = db.session.get(User, self.u1_id)
+            edges.follow(self.u1_id, self.u3_id)
+
+            self.assertTrue(u1.is_following(self.u3_id))
+            self.assertFalse(self.index.follows(self.u1_id, self.u3_id))
+
+            db.session.rollback()
+            self.assertFalse(u1.is_following(self.u3_id))
+            self.assertFalse(self.index.follows(self.u1_id, self.u3_id))
+
+    def test_catch_up(self):
+        """Follows made by other processes are seen when it catches up."""
+
+        db.session.add_all([
+            Follow(user_following_id=self.u2_id,
+                   user_being_followed_id=self.u3_id),
+            FollowChange(user_id=self.u2_id),
+        ])
+        db.session.execute(
+            db.delete(Follow).where(Follow.user_following_id == self.u1_id))
+        db.session.add(FollowChange(user_id=self.u1_id))
+        db.session.commit()
+
+        app.config['FOLLOW_INDEX_POLL_SECONDS'] = 0
+        self.addCleanup(app.config.__setitem__,
+                        'FOLLOW_INDEX_POLL_SECONDS', 1)
+        self.client.get("/users/profile")
+
+        self.assertEqual(list(self.index.following(self.u2_id)),
+                         [self.u3_id])
+        self.assertEqual(list(self.index.following(self.u1_id)), [])
+
+    def test_deletions(self):
+        deletions.disable(self.u2_id)
+        db.session.commit()
+        while deletions.step(batch_size=10):
+            pass
+
+        self.assertFalse(self.index.follows(self.u1_id, self.u2_id))
+
+    def test_stats_page(self):
+        resp = self.client.get("/internal/follow-index")
+        self.assertEqual(resp.json["edges"], 1)
+
+        app.extensions.pop("follow_index")
+        self.addCleanup(app.extensions.__setitem__, "follow_index",
+                        self.index)
+        self.assertEqual(
+            self.client.get("/internal/follow-index").status_code, 404)
@@ -0,0 +1,133 @@
+"""Template fragment cache tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_fragments.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, User, Message, Follow
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
+
+from app import app, CURR_USER_KEY
+import cache
+import fragments
+import timeline
+
+app.config['TESTING'] = True
+
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+db.drop_all()
+db.create_all()
+
+
+class FragmentsTestCase(TestCase):
+    def setUp(self):
+        db.session.rollback()
+        User.query.delete()
+
+        u1 = User.signup("u1", "u1@email.com", "password", None)
+        u2 = User.signup("u2", "u2@email.com", "password", None)
+        db.session.flush()
+        db.session.add(Follow(user_being_followed_id=u2.id,
+                              user_following_id=u1.id))
+        m1 = Message(text="m1-text", user_id=u2.id)
+        db.session.add(m1)
+        db.session.commit()
+        timeline.rebuild_timelines()
+        db.session.commit()
+
+        self.u1_id = u1.id
+        self.u2_id = u2.id
+        self.m1_id = m1.id
+
+        app.extensions["warbler_fragments"] = cache.make_backend(
+            "local", cache.Stats())
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def login(self, user_id):
+        with self.client.session_transaction() as session:
+            session[CURR_USER_KEY] = user_id
+
+    def test_cached_cards(self):
+        self.login(self.u1_id)
+
+        first = self.client.get("/").get_data(as_text=True)
+        second = self.client.get("/").get_data(as_text=True)
+
+        self.assertEqual(first, second)
+        self.assertIn("m1-text", second)
+        stats = fragments.stats()
+        self.assertEqual((stats["misses"], stats["hits"]), (1, 1))
+
+        self.client.get("/users")
+        self.client.get("/users")
+        self.assertEqual(fragments.stats()["hits"], 1 + 4)
+
+    def test_buttons_per_viewer(self):
+        self.login(self.u1_id)
+        self.client.get("/")
+
+        self.client.post(f"/like/{self.m1_id}")
+        html = self.client.get("/").get_data(as_text=True)
+
+        self.assertEqual(fragments.stats()["hits"], 1)
+        self.assertIn(f'action="/unlike/{self.m1_id}"', html)
+
+        # The author sees the same card with no like button
+        self.login(self.u2_id)
+        html = self.client.get(
+            f"/users/{self.u2_id}").get_data(as_text=True)
+        self.assertIn("m1-text", html)
+        self.assertNotIn(f'action="/like/{self.m1_id}"', html)
+
+    def test_profile_edit(self):
+        self.login(self.u1_id)
+        self.client.get("/")
+
+        self.login(self.u2_id)
+        self.client.post("/users/profile", data={
+            "username": "u2-renamed",
+            "email": "u2@email.com",
+            "image_url": "",
+            "header_image_url": "",
+            "bio": "",
+            "location": "",
+            "password": "password",
+        })
+        self.assertEqual(fragments.stats()["invalidations"], 1)
+
+        self.login(self.u1_id)
+        html = self.client.get("/").get_data(as_text=True)
+        self.assertIn("@u2-renamed", html)
+
+    def test_message_delete(self):
+        self.login(self.u1_id)
+        self.client.get("/")
+        self.assertEqual(fragments.stats()["entries"], 1)
+
+        self.login(self.u2_id)
+        self.client.post(f"/messages/{self.m1_id}/delete")
+
+        self.assertEqual(fragments.stats()["entries"], 0)
+        self.assertEqual(fragments.stats()["invalidations"], 1)
+
+    def test_disabled(self):
+        app.config['FRAGMENT_CACHE'] = False
+        self.addCleanup(app.config.__setitem__, 'FRAGMENT_CACHE', True)
+
+        self.login(self.u1_id)
+        self.client.get("/")
+        self.client.get("/")
+
+        self.assertEqual(fragments.stats()["entries"], 0)
@@ -0,0 +1,166 @@
+"""HTTP caching policy tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_httpcache.py
+
+
+import os
+import re
+from unittest import TestCase
+
+from models import db, User, Message, Follow
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
+
+from app import app, CURR_USER_KEY
+from querystats import count_queries
+import timeline
+
+app.config['TESTING'] = True
+
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+db.drop_all()
+db.create_all()
+
+
+class HTTPCacheTestCase(TestCase):
+    def setUp(self):
+        db.session.rollback()
+        User.query.delete()
+
+        u1 = User.signup("u1", "u1@email.com", "password", None)
+        u2 = User.signup("u2", "u2@email.com", "password", None)
+        db.session.flush()
+        db.session.add(Follow(user_being_followed_id=u2.id,
+                              user_following_id=u1.id))
+        m1 = Message(text="m1-text", user_id=u2.id)
+        db.session.add(m1)
+        db.session.commit()
+        timeline.rebuild_timelines()
+        db.session.commit()
+
+        self.u1_id = u1.id
+        self.u2_id = u2.id
+        self.m1_id = m1.id
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def login(self, user_id):
+        with self.client.session_transaction() as session:
+            session[CURR_USER_KEY] = user_id
+
+    def revalidate(self, url, etag):
+        db.session.expunge_all()
+        return self.client.get(url, headers={"If-None-Match": etag})
+
+    def test_feed(self):
+        self.login(self.u1_id)
+
+        resp = self.client.get("/")
+        etag = resp.headers["ETag"]
+        self.assertTrue(etag.startswith('W/"'))
+        self.assertIn("private", resp.headers["Cache-Control"])
+        self.assertIn("no-cache", resp.headers["Cache-Control"])
+
+        with count_queries() as stats:
+            resp = self.revalidate("/", etag)
+        self.assertEqual(resp.status_code, 304)
+        self.assertEqual(resp.get_data(), b"")
+        self.assertLessEqual(stats.count, 2)
+
+        # A followed user posts
+        self.login(self.u2_id)
+        self.client.post("/messages/new", data={"text": "new"})
+
+        self.login(self.u1_id)
+        resp = self.revalidate("/", etag)
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn("new", resp.get_data(as_text=True))
+
+    def test_own_likes(self):
+        self.login(self.u1_id)
+        etag = self.client.get("/").headers["ETag"]
+
+        self.client.post(f"/like/{self.m1_id}")
+        resp = self.revalidate("/", etag)
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn(f'action="/unlike/{self.m1_id}"',
+                      resp.get_data(as_text=True))
+
+    def test_profile(self):
+        self.login(self.u1_id)
+        url = f"/users/{self.u2_id}"
+        etag = self.client.get(url).headers["ETag"]
+        self.assertEqual(self.revalidate(url, etag).status_code, 304)
+
+        # Pages differ by viewer
+        self.login(self.u2_id)
+        self.assertEqual(self.revalidate(url, etag).status_code, 200)
+
+        self.client.post("/users/profile", data={
+            "username": "u2-renamed",
+            "email": "u2@email.com",
+            "image_url": "",
+            "header_image_url": "",
+            "bio": "",
+            "location": "",
+            "password": "password",
+        })
+        self.login(self.u1_id)
+        resp = self.revalidate(url, etag)
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn("@u2-renamed", resp.get_data(as_text=True))
+
+    def test_message(self):
+        self.login(self.u1_id)
+        url = f"/messages/{self.m1_id}"
+        etag = self.client.get(url).headers["ETag"]
+        self.assertEqual(self.revalidate(url, etag).status_code, 304)
+
+        self.client.post(f"/users/follow/{self.u2_id}")
+        self.client.post(f"/users/stop-following/{self.u2_id}")
+        self.assertEqual(self.revalidate(url, etag).status_code, 200)
+
+    def test_flashes_not_tagged(self):
+        self.login(self.u1_id)
+        with self.client.session_transaction() as session:
+            session["_flashes"] = [("message", "hello")]
+
+        resp = self.client.get("/")
+        self.assertNotIn("ETag", resp.headers)
+        self.assertIn("no-store", resp.headers["Cache-Control"])
+
+    def test_anonymous_home(self):
+        resp = self.client.get("/")
+        self.assertIn("public", resp.headers["Cache-Control"])
+        self.assertIn("max-age=300", resp.headers["Cache-Control"])
+
+        resp = self.client.get("/", headers={"If-None-Match":
+                                             resp.headers["ETag"]})
+        self.assertEqual(resp.status_code, 304)
+
+    def test_static(self):
+        html = self.client.get("/login").get_data(as_text=True)
+        url = re.search(r'href="(/static/stylesheets/style.css\?v=\w+)"',
+                        html).group(1)
+
+        resp = self.client.get(url)
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn("immutable", resp.headers["Cache-Control"])
+        self.assertIn("max-age=31536000", resp.headers["Cache-Control"])
+        resp.close()
+
+        resp = self.client.get("/static/stylesheets/style.css")
+        self.assertEqual(resp.headers["Cache-Control"], "no-cache")
+        resp.close()
+
+    def test_default_no_store(self):
+        resp = self.client.get("/login")
+        self.assertEqual(resp.headers["Cache-Control"], "no-store")
@@ -130,6 +130,16 @@ class MessageModelTestCase(TestCase):
         self.assertNotIn(msg2, u2.messages_liked)
         self.assertNotIn(u2, msg2.users_who_liked)
 
+    def test_liked_message_ids(self):
+        """Test looking up which of some messages a user has liked."""
+        u1 = User.query.get(self.u1_id)
+        msg1 = Message.query.get(self.msg1_id)
+        msg2 = Message.query.get(self.msg2_id)
+
+        self.assertEqual(u1.liked_message_ids([msg1, msg2]), {self.msg2_id})
+        self.assertEqual(u1.liked_message_ids([msg1]), set())
+        self.assertEqual(u1.liked_message_ids([]), set())
+
 #tests:
     #if message is assocated with creator (user.messages)
     #match Messsage.user_id to user.id
@@ -9,6 +9,7 @@ import os
 from unittest import TestCase
 
 from models import db, Message, User
+from querystats import QueryBudgetMixin
 
 # BEFORE we import our app, let's set an environmental variable
 # to use a different database for tests (we need to do this
@@ -71,3 +72,16 @@ class MessageAddViewTestCase(MessageBaseViewTestCase):
             self.assertEqual(resp.status_code, 302)
 
             Message.query.filter_by(text="Hello").one()
+
+
+class MessageShowViewTestCase(MessageBaseViewTestCase, QueryBudgetMixin):
+    def test_show_message(self):
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u1_id
+
+            with self.assertMaxQueries(4):
+                resp = c.get(f"/messages/{self.m1_id}")
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("m1-text", resp.get_data(as_text=True))
@@ -0,0 +1,187 @@
+"""Message search tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_messagesearch.py
+
+
+import os
+import tempfile
+from unittest import TestCase
+
+from models import db, User, Message, MessageSearch
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
+
+from app import app, CURR_USER_KEY
+import deletions
+import messagesearch
+
+app.config['TESTING'] = True
+
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+db.drop_all()
+db.create_all()
+
+TEXTS = [
+    "learning #python today",
+    "python python python",
+    "@python is a fine username",
+    "nothing to see here",
+    "ask bob@example.com about #flask",
+]
+
+
+class TokenizeTestCase(TestCase):
+    def test_tokenize(self):
+        self.assertEqual(
+            messagesearch.tokenize("Hi @Bob! #Python3 rocks, bob@example.com"),
+            ["hi", "@bob", "#python3", "rocks", "bob", "example", "com"])
+
+    def test_query_terms(self):
+        self.assertEqual(messagesearch.query_terms("#Flask python"),
+                         [("#flask",), ("python", "#python", "@python")])
+        self.assertEqual(messagesearch.query_terms("  !! "), [])
+
+
+class PostgresSearchTestCase(TestCase):
+    """Search with the default, PostgreSQL backend."""
+
+    def setUp(self):
+        db.session.rollback()
+        User.query.delete()
+        MessageSearch.query.delete()
+        db.session.commit()
+
+        user = User.signup("u1", "u1@email.com", "password", None)
+        db.session.commit()
+        self.user_id = user.id
+
+        self.client = app.test_client()
+        with self.client.session_transaction() as session:
+            session[CURR_USER_KEY] = self.user_id
+
+        # Posted through the route, so each is indexed as it's added
+        for text in TEXTS:
+            self.client.post("/messages/new", data={"text": text})
+        self.ids = {msg.text: msg.id for msg in Message.query}
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def found(self, search, **kwargs):
+        page = messagesearch.search_keys(search, **kwargs)
+        id_texts = {id: text for text, id in self.ids.items()}
+        return [id_texts[id] for _, id in page.items], page
+
+    def test_words_and_tags(self):
+        # Ranked: three mentions of python beat one
+        texts, _ = self.found("python")
+        self.assertEqual(texts[0], TEXTS[1])
+        self.assertEqual(sorted(texts), sorted(TEXTS[:3]))
+
+        self.assertEqual(self.found("#python")[0], [TEXTS[0]])
+        self.assertEqual(self.found("@python")[0], [TEXTS[2]])
+        self.assertEqual(self.found("#flask bob")[0], [TEXTS[4]])
+        self.assertEqual(self.found("python flask")[0], [])
+        self.assertEqual(self.found("")[0], [])
+
+    def test_candidates(self):
+        """Only the newest matches are ranked."""
+
+        self.addCleanup(app.config.__setitem__, 'MESSAGE_SEARCH_CANDIDATES',
+                        app.config['MESSAGE_SEARCH_CANDIDATES'])
+        app.config['MESSAGE_SEARCH_CANDIDATES'] = 2
+
+        self.assertEqual(self.found("python")[0], TEXTS[1:3])
+
+    def test_pages(self):
+        texts, page = self.found("python", per_page=2)
+        self.assertEqual(len(texts), 2)
+        self.assertIsNone(page.prev_cursor)
+
+        rest, next_page = self.found("python", per_page=2,
+                                     before=page.next_cursor)
+        self.assertEqual(sorted(texts + rest), sorted(TEXTS[:3]))
+        self.assertIsNone(next_page.next_cursor)
+
+        back, _ = self.found("python", per_page=2,
+                             after=next_page.prev_cursor)
+        self.assertEqual(back, texts)
+
+    def test_delete(self):
+        msg_id = self.ids[TEXTS[0]]
+        self.client.post(f"/messages/{msg_id}/delete")
+
+        self.assertEqual(self.found("#python")[0], [])
+
+    def test_account_deleted(self):
+        deletions.disable(self.user_id)
+        db.session.commit()
+        while deletions.step(batch_size=10):
+            pass
+
+        self.assertEqual(self.found("python")[0], [])
+
+    def test_author_disabled(self):
+        deletions.disable(self.user_id)
+        db.session.commit()
+
+        page = messagesearch.search_messages("python")
+        self.assertEqual(page.items, [])
+
+    def test_routes(self):
+        html = self.client.get(
+            "/messages/search?q=%23flask").get_data(as_text=True)
+        self.assertIn("bob@example.com", html)
+        self.assertNotIn("fine username", html)
+
+        resp = self.client.get("/api/v1/messages/search?q=python&fields=id")
+        self.assertEqual(resp.json["data"][0], {"id": self.ids[TEXTS[1]]})
+        self.assertEqual(len(resp.json["data"]), 3)
+
+        self.addCleanup(app.config.__setitem__, 'PAGE_SIZE',
+                        app.config['PAGE_SIZE'])
+        app.config['PAGE_SIZE'] = 2
+        html = self.client.get(
+            "/messages/search?q=python").get_data(as_text=True)
+        self.assertIn("q=python", html)
+        self.assertIn("More", html)
+
+    def test_rebuild(self):
+        messagesearch.get_index().clear()
+        db.session.commit()
+
+        self.assertEqual(self.found("python")[0], [])
+        result = app.test_cli_runner().invoke(args=["index-messages"])
+        self.assertIn(f"Indexed {len(TEXTS)} messages.", result.output)
+        self.assertEqual(len(self.found("python")[0]), 3)
+
+
+class SQLiteSearchTestCase(PostgresSearchTestCase):
+    """The same, with the SQLite FTS5 backend."""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        postgres = app.extensions["message_search"]
+        app.extensions["message_search"] = messagesearch.SQLiteIndex(
+            os.path.join(directory.name, "search.sqlite3"))
+        self.addCleanup(app.extensions.__setitem__, "message_search",
+                        postgres)
+
+        super().setUp()
+
+    def test_uncommitted(self):
+        """Only committed messages are written to the file."""
+
+        msg = Message(text="rolled back #python", user_id=self.user_id)
+        db.session.add(msg)
+        db.session.flush()
+        messagesearch.message_added(msg)
+        db.session.rollback()
+
+        self.assertEqual(self.found("#python")[0], [TEXTS[0]])
@@ -0,0 +1,164 @@
+"""Messages partitioning tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_partitions.py
+
+
+import os
+from datetime import datetime, timedelta
+from unittest import TestCase
+
+from models import (db, User, Message, Follow, Like, MessageSearch,
+                    TimelineEntry)
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
+
+from app import app, CURR_USER_KEY
+from pagination import windowed_keyset_query
+import messagesearch
+import partitions
+import timeline
+
+app.config['TESTING'] = True
+
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+db.drop_all()
+db.create_all()
+
+
+class PartitionsTestCase(TestCase):
+    def setUp(self):
+        db.session.rollback()
+        db.drop_all()
+        db.create_all()
+
+        u1 = User.signup("u1", "u1@email.com", "password", None)
+        u2 = User.signup("u2", "u2@email.com", "password", None)
+        db.session.flush()
+        db.session.add(Follow(user_being_followed_id=u2.id,
+                              user_following_id=u1.id))
+
+        self.now = datetime.utcnow()
+        old = Message(text="old", user_id=u2.id,
+                      timestamp=datetime(2023, 1, 15))
+        older = Message(text="older", user_id=u2.id,
+                        timestamp=datetime(2022, 12, 15))
+        recent = Message(text="recent", user_id=u2.id,
+                         timestamp=self.now - timedelta(hours=1))
+        db.session.add_all([old, older, recent])
+        db.session.flush()
+        db.session.add(Like(user_id=u1.id, message_id=recent.id))
+        db.session.commit()
+
+        timeline.rebuild_timelines()
+        db.session.commit()
+        messagesearch.index_messages()
+
+        self.u1_id = u1.id
+        self.u2_id = u2.id
+        self.recent_id = recent.id
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+        # Leave the plain schema the other test modules expect.
+        db.session.rollback()
+        for name in db.session.scalars(db.text(
+                "SELECT tablename FROM pg_tables "
+                "WHERE tablename LIKE 'messages\\_%'")):
+            db.session.execute(db.text(f"DROP TABLE {name}"))
+        db.session.commit()
+        db.drop_all()
+        db.create_all()
+
+    def plan(self, query):
+        sql = query.statement.compile(
+            db.engine, compile_kwargs={"literal_binds": True})
+        return "\n".join(db.session.scalars(db.text(f"EXPLAIN {sql}")))
+
+    def test_partition_messages(self):
+        made = partitions.partition_messages(months_ahead=1)
+        db.session.commit()
+
+        self.assertTrue(partitions.is_partitioned())
+        self.assertEqual(made[0], "messages_2022_12")
+        self.assertEqual(
+            [name for name, _ in partitions.partitions()], made)
+        self.assertEqual(Message.query.count(), 3)
+
+        # Running it again is harmless
+        self.assertEqual(partitions.partition_messages(), [])
+
+        # New messages keep taking ids from the old sequence
+        with self.client.session_transaction() as session:
+            session[CURR_USER_KEY] = self.u2_id
+        self.client.post("/messages/new", data={"text": "new"})
+        new = Message.query.filter_by(text="new").one()
+        self.assertGreater(new.id, self.recent_id)
+
+        page = timeline.get_timeline(db.session.get(User, self.u1_id))
+        self.assertEqual([msg.text for msg in page.items],
+                         ["new", "recent", "old", "older"])
+
+    def test_pruning(self):
+        partitions.partition_messages(months_ahead=1)
+        db.session.commit()
+
+        order = (Message.timestamp, Message.id)
+        query = Message.query.filter(Message.user_id == self.u2_id)
+        since = self.now - app.config['MESSAGE_WINDOWS'][0]
+        plan = self.plan(query.filter(Message.timestamp >= since)
+                         .order_by(Message.timestamp.desc()))
+
+        self.assertNotIn("messages_2023_01", plan)
+        self.assertIn(partitions.partition_name(self.now), plan)
+
+        # A first page too big for the window still finds everything
+        rows = windowed_keyset_query(query, order, per_page=2,
+                                     windows=app.config['MESSAGE_WINDOWS'])
+        self.assertEqual([msg.text for msg in rows],
+                         ["recent", "old", "older"])
+
+    def test_delete_cascades(self):
+        partitions.partition_messages(months_ahead=1)
+        db.session.commit()
+
+        with self.client.session_transaction() as session:
+            session[CURR_USER_KEY] = self.u2_id
+        self.client.post(f"/messages/{self.recent_id}/delete")
+
+        self.assertEqual(Like.query.count(), 0)
+        self.assertEqual(
+            TimelineEntry.query.filter_by(message_id=self.recent_id).count(),
+            0)
+        self.assertEqual(
+            MessageSearch.query.filter_by(message_id=self.recent_id).count(),
+            0)
+
+    def test_detach(self):
+        partitions.partition_messages(months_ahead=1)
+        db.session.commit()
+
+        detached = partitions.detach_partitions(datetime(2023, 2, 1))
+        db.session.commit()
+
+        self.assertEqual(detached, ["messages_2022_12", "messages_2023_01"])
+        self.assertEqual([msg.text for msg in Message.query], ["recent"])
+        self.assertEqual(
+            TimelineEntry.query.filter_by(user_id=self.u1_id).count(), 1)
+        self.assertEqual(
+            [row.message_id for row in MessageSearch.query],
+            [self.recent_id])
+
+        # The detached months are still there to archive
+        self.assertEqual(db.session.scalar(db.text(
+            "SELECT count(*) FROM messages_2023_01")), 1)
+
+        # New months can be added ahead
+        made = partitions.create_partitions(
+            partitions.add_months(self.now, 3))
+        self.assertEqual(len(made), 2)
@@ -0,0 +1,149 @@
+"""Password hashing service tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_passwords.py
+
+
+import os
+import tempfile
+import threading
+from unittest import TestCase, mock
+
+from models import db, User
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
+
+from app import app
+import passwords
+
+app.config['TESTING'] = True
+
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+db.drop_all()
+db.create_all()
+
+
+class PasswordsTestCase(TestCase):
+    def setUp(self):
+        db.session.rollback()
+        User.query.delete()
+
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.slots_path = directory.name
+
+        self.use_service(rounds=4)
+        User.signup("u1", "u1@email.com", "password", None)
+        db.session.commit()
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+        db.session.rollback()
+        passwords.init_app(app)
+
+    def use_service(self, **kwargs):
+        kwargs.setdefault("workers", 0)
+        kwargs.setdefault("slots_path", self.slots_path)
+        self.service = passwords.PasswordService(**kwargs)
+        app.extensions["warbler_passwords"] = self.service
+
+    def login(self):
+        return self.client.post(
+            "/login", data={"username": "u1", "password": "password"})
+
+    def test_pool(self):
+        service = passwords.PasswordService(rounds=4, workers=1)
+        try:
+            pw_hash = service.hash("secret")
+            self.assertTrue(pw_hash.startswith("$2b$04$"))
+            self.assertTrue(service.check(pw_hash, "secret"))
+            self.assertFalse(service.check(pw_hash, "wrong"))
+        finally:
+            service.shutdown()
+
+        stats = service.stats.as_dict()
+        self.assertEqual((stats["hashes"], stats["checks"]), (1, 2))
+        self.assertIsNotNone(stats["wait_ms"]["mean"])
+        self.assertGreater(stats["hash_ms"]["max"], 0)
+
+    def test_busy(self):
+        self.use_service(rounds=4, max_queue=0)
+
+        # Take the only slot, as a login already in progress would
+        slot = self.service.slots.acquire()
+        try:
+            with self.assertRaises(passwords.PasswordServiceBusy):
+                self.service.hash("secret")
+
+            resp = self.login()
+            self.assertEqual(resp.status_code, 503)
+            self.assertEqual(resp.headers["Retry-After"], "1")
+        finally:
+            self.service.slots.release(slot)
+
+        self.assertEqual(self.service.stats.as_dict()["rejected"], 2)
+        self.assertEqual(self.login().status_code, 302)
+
+    def test_busy_across_processes(self):
+        """The limit holds for concurrent logins however they're spread
+        over app processes: here a second service, as another gunicorn
+        worker would have, shares the first one's slots."""
+
+        self.use_service(rounds=4, max_queue=0)
+        checking, done = threading.Event(), threading.Event()
+        check = passwords._check
+
+        def slow_check(*args):
+            checking.set()
+            done.wait(10)
+            return check(*args)
+
+        responses = []
+        with mock.patch.object(passwords, "_check", slow_check):
+            login = threading.Thread(
+                target=lambda: responses.append(self.login()))
+            login.start()
+            try:
+                self.assertTrue(checking.wait(10))
+
+                self.use_service(rounds=4, max_queue=0)
+                resp = app.test_client().post(
+                    "/login", data={"username": "u1", "password": "password"})
+                self.assertEqual(resp.status_code, 503)
+            finally:
+                done.set()
+                login.join()
+
+        self.assertEqual(responses[0].status_code, 302)
+        resp = app.test_client().post(
+            "/login", data={"username": "u1", "password": "password"})
+        self.assertEqual(resp.status_code, 302)
+
+    def test_rehash_on_login(self):
+        self.login()
+        self.assertEqual(self.service.stats.as_dict()["rehashes"], 0)
+
+        self.use_service(rounds=5)
+        self.client.post("/logout")
+        resp = self.login()
+
+        self.assertEqual(resp.status_code, 302)
+        self.assertEqual(self.service.stats.as_dict()["rehashes"], 1)
+
+        db.session.expunge_all()
+        user = User.query.filter_by(username="u1").one()
+        self.assertTrue(user.password.startswith("$2b$05$"))
+        self.assertIsInstance(User.authenticate("u1", "password"), User)
+
+    def test_stats_endpoint(self):
+        self.login()
+
+        resp = self.client.get("/internal/passwords")
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.json["rounds"], 4)
+        self.assertEqual(resp.json["checks"], 1)
@@ -0,0 +1,115 @@
+"""Connection pool and replica routing tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_pool.py
+
+
+import os
+from unittest import TestCase
+
+from sqlalchemy import create_engine
+from sqlalchemy.exc import TimeoutError
+from sqlalchemy.pool import NullPool
+
+from models import db, User
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
+
+from app import app, CURR_USER_KEY
+import poolstats
+import routing
+
+app.config['TESTING'] = True
+
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+db.drop_all()
+db.create_all()
+
+
+class PoolTestCase(TestCase):
+    def setUp(self):
+        db.session.rollback()
+        User.query.delete()
+
+        u1 = User.signup("u1", "u1@email.com", "password", None)
+        db.session.commit()
+        self.u1_id = u1.id
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def add_replica(self):
+        """Point a second engine at the test database, as the replica."""
+
+        replica = create_engine(app.config['SQLALCHEMY_DATABASE_URI'],
+                                **poolstats.engine_options(app.config))
+        db.engines[f"{routing.REPLICA}1"] = replica
+
+        def remove():
+            db.session.rollback()
+            del db.engines[f"{routing.REPLICA}1"]
+            routing.get_monitor().status.clear()
+            replica.dispose()
+        self.addCleanup(remove)
+
+        return replica
+
+    def test_engine_options(self):
+        config = dict(app.config, DB_POOL_SIZE=3, DB_POOLER=False)
+        options = poolstats.engine_options(config)
+        self.assertIs(options["poolclass"], poolstats.TimedQueuePool)
+        self.assertEqual(options["pool_size"], 3)
+
+        config["DB_POOLER"] = True
+        self.assertEqual(poolstats.engine_options(config),
+                         {"poolclass": NullPool})
+
+    def test_wait_stats(self):
+        engine = create_engine(app.config['SQLALCHEMY_DATABASE_URI'],
+                               poolclass=poolstats.TimedQueuePool,
+                               pool_size=1, max_overflow=0, pool_timeout=0.1)
+        self.addCleanup(engine.dispose)
+
+        with engine.connect():
+            with self.assertRaises(TimeoutError):
+                engine.connect()
+
+        stats = poolstats.pool_stats(engine)
+        self.assertEqual(stats["checkouts"], 2)
+        self.assertEqual(stats["timeouts"], 1)
+        self.assertEqual(stats["checked_out"], 0)
+        self.assertGreaterEqual(stats["wait_ms_max"], 100)
+
+    def test_endpoint(self):
+        resp = self.client.get("/internal/pool")
+        self.assertEqual(resp.status_code, 200)
+
+        primary = resp.json["primary"]
+        self.assertEqual(primary["pool"], "TimedQueuePool")
+        self.assertGreater(primary["checkouts"], 0)
+
+        resp = self.client.get("/internal/pool",
+                               environ_base={"REMOTE_ADDR": "10.0.0.1"})
+        self.assertEqual(resp.status_code, 403)
+
+    def test_replica_routing(self):
+        replica = self.add_replica()
+        with self.client.session_transaction() as session:
+            session[CURR_USER_KEY] = self.u1_id
+        db.session.rollback()
+
+        resp = self.client.get(f"/users/{self.u1_id}")
+        self.assertEqual(resp.status_code, 200)
+        reads = poolstats.pool_stats(replica)["checkouts"]
+        self.assertGreater(reads, 0)
+
+        # Writes go to the primary
+        db.session.rollback()
+        self.client.post("/messages/new", data={"text": "hello"})
+        self.assertEqual(poolstats.pool_stats(replica)["checkouts"], reads)
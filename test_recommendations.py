@@ -0,0 +1,152 @@
+"""Who-to-follow suggestions tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_recommendations.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, User, Follow, FollowSuggestion, SuggestionRefresh
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
+
+from app import app, CURR_USER_KEY
+import graph
+import recommendations
+
+app.config['TESTING'] = True
+
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+db.drop_all()
+db.create_all()
+
+
+class RecommendationsTestCase(TestCase):
+    def setUp(self):
+        db.session.rollback()
+        User.query.delete()
+        SuggestionRefresh.query.delete()
+
+        users = [User.signup(f"u{i}", f"u{i}@email.com", "password", None)
+                 for i in range(5)]
+        db.session.flush()
+        u0, u1, u2, u3, u4 = users
+
+        # u0 follows u1 and u2; both of them follow u3, and u1 follows u4.
+        db.session.add_all([
+            Follow(user_following_id=follower.id,
+                   user_being_followed_id=followed.id)
+            for follower, followed in [(u0, u1), (u0, u2), (u1, u3),
+                                       (u2, u3), (u1, u4), (u1, u0)]
+        ])
+        db.session.commit()
+
+        self.ids = [user.id for user in users]
+
+        self.client = app.test_client()
+        with self.client.session_transaction() as session:
+            session[CURR_USER_KEY] = self.ids[0]
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def stored(self, user_id):
+        return db.session.execute(
+            db.select(FollowSuggestion.suggested_user_id,
+                      FollowSuggestion.mutuals)
+            .where(FollowSuggestion.user_id == user_id)
+            .order_by(FollowSuggestion.mutuals.desc(),
+                      FollowSuggestion.suggested_user_id)).all()
+
+    def test_graph(self):
+        u0, u1, u2, u3, u4 = self.ids
+        follows = graph.load_follows()
+
+        self.assertEqual(follows.edges, 6)
+        self.assertEqual(list(follows.following(u1)), sorted([u0, u3, u4]))
+        self.assertEqual(list(follows.following(u3)), [])
+        self.assertEqual(list(follows.following(u4 + 100)), [])
+
+    def test_suggest(self):
+        u0, u1, u2, u3, u4 = self.ids
+        follows = graph.load_follows()
+
+        self.assertEqual(recommendations.suggest(follows, u0, 10),
+                         [(u3, 2), (u4, 1)])
+        self.assertEqual(recommendations.suggest(follows, u0, 1), [(u3, 2)])
+        # u2 follows only u3, who follows no one
+        self.assertEqual(recommendations.suggest(follows, u2, 10), [])
+
+        # The SQL version agrees
+        self.assertEqual(
+            db.session.execute(
+                recommendations.suggest_query(u0, 10)).all(),
+            [(u3, 2), (u4, 1)])
+
+    def test_refresh_all(self):
+        u0, u1, u2, u3, u4 = self.ids
+
+        for workers in (0, 2):
+            FollowSuggestion.query.delete()
+            db.session.commit()
+
+            written = recommendations.refresh_all(
+                limit=10, workers=workers, range_size=2)
+
+            self.assertEqual(written, 3)
+            self.assertEqual(self.stored(u0), [(u3, 2), (u4, 1)])
+            # u1 follows u0, who follows u2
+            self.assertEqual(self.stored(u1), [(u2, 1)])
+
+    def test_follow_queues(self):
+        u0, u1, u2, u3, u4 = self.ids
+        recommendations.refresh_all(limit=10)
+        version = db.session.get(User, u0).activity_version
+
+        self.client.post(f"/users/follow/{u3}")
+
+        # Gone from u0's suggestions at once, and u0's queued
+        self.assertEqual(self.stored(u0), [(u4, 1)])
+        self.assertEqual(db.session.scalars(
+            db.select(SuggestionRefresh.user_id)).all(), [u0])
+
+        self.assertEqual(recommendations.refresh_queued(limit=10), 1)
+        self.assertEqual(recommendations.refresh_queued(limit=10), 0)
+        self.assertEqual(self.stored(u0), [(u4, 1)])
+
+        user = db.session.get(User, u0)
+        db.session.refresh(user)
+        self.assertGreater(user.activity_version, version)
+
+        self.client.post(f"/users/stop-following/{u1}")
+        recommendations.refresh_queued(limit=10)
+        self.assertEqual(self.stored(u0), [])
+
+    def test_sidebar(self):
+        u0, u1, u2, u3, u4 = self.ids
+        recommendations.refresh_all(limit=10)
+
+        html = self.client.get("/").get_data(as_text=True)
+        self.assertIn("Who to follow", html)
+        self.assertLess(html.index("@u3"), html.index("@u4"))
+        self.assertIn(f'action="/users/follow/{u3}"', html)
+
+        html = self.client.get(f"/users/{u0}").get_data(as_text=True)
+        self.assertIn("Who to follow", html)
+        html = self.client.get(f"/users/{u1}").get_data(as_text=True)
+        self.assertNotIn("Who to follow", html)
+
+    def test_cli(self):
+        runner = app.test_cli_runner()
+
+        result = runner.invoke(args=["refresh-suggestions", "--all"])
+        self.assertIn("Wrote 3 suggestions.", result.output)
+
+        self.client.post(f"/users/follow/{self.ids[3]}")
+        result = runner.invoke(args=["refresh-suggestions"])
+        self.assertIn("Refreshed 1 users' suggestions.", result.output)
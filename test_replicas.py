@@ -0,0 +1,184 @@
+"""Read replica routing tests.
+
+A second database, warbler_test_replica, stands in for the replica. It
+isn't kept up to date: it has a user, "ghost", that the primary doesn't,
+so the users page shows which database it was read from.
+"""
+
+# run these tests like:
+#
+#    python -m unittest test_replicas.py
+
+
+import os
+from time import time
+from unittest import TestCase, mock
+
+from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+
+from models import db, User, Follow, FollowChange
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
+
+from app import app, CURR_USER_KEY
+import cache
+import graph
+import routing
+
+app.config['TESTING'] = True
+
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+db.drop_all()
+db.create_all()
+
+REPLICA_URL = "postgresql:///warbler_test_replica"
+
+
+def create_database(url):
+    url = make_url(url)
+    engine = create_engine(url.set(database='postgres'),
+                           isolation_level='AUTOCOMMIT')
+    with engine.connect() as conn:
+        if not conn.exec_driver_sql(
+                "SELECT 1 FROM pg_database WHERE datname = %s",
+                (url.database,)).scalar():
+            conn.exec_driver_sql(f'CREATE DATABASE "{url.database}"')
+    engine.dispose()
+
+
+create_database(REPLICA_URL)
+
+
+class ReplicasTestCase(TestCase):
+    def setUp(self):
+        db.session.rollback()
+        User.query.delete()
+
+        u1 = User.signup("u1", "u1@email.com", "password", None)
+        db.session.commit()
+        self.u1_id = u1.id
+
+        # The replica has u1 too, and a user of its own
+        self.replica = self.add_replica(REPLICA_URL)
+        db.metadata.drop_all(self.replica)
+        db.metadata.create_all(self.replica)
+        users = db.session.execute(User.__table__.select()).mappings().all()
+        with self.replica.begin() as conn:
+            conn.execute(User.__table__.insert(), [dict(row) for row in users])
+            conn.execute(User.__table__.insert(), {
+                "id": self.u1_id + 1000, "username": "ghost",
+                "email": "ghost@email.com", "password": "x", "image_url": "", "header_image_url": "",
+                "bio": "", "location": "",
+            })
+
+        self.client = app.test_client()
+        with self.client.session_transaction() as session:
+            session[CURR_USER_KEY] = self.u1_id
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def add_replica(self, url):
+        key = f"{routing.REPLICA}{len(routing.replica_keys(db.engines)) + 1}"
+        replica = create_engine(url)
+        db.engines[key] = replica
+
+        def remove():
+            db.session.rollback()
+            db.engines.pop(key, None)
+            routing.get_monitor().status.clear()
+            replica.dispose()
+        self.addCleanup(remove)
+
+        return replica
+
+    def read_from_replica(self):
+        """Did the users page come from the replica?"""
+
+        db.session.rollback()
+        html = self.client.get("/users").get_data(as_text=True)
+        return "@ghost" in html
+
+    def test_reads_go_to_replica(self):
+        self.assertTrue(self.read_from_replica())
+
+        resp = self.client.get("/internal/replicas")
+        self.assertEqual(resp.json, {
+            "replica_1": {"lag_seconds": 0.0, "usable": True}})
+
+    def test_read_your_writes(self):
+        self.client.post("/messages/new", data={"text": "hello"})
+        self.assertFalse(self.read_from_replica())
+
+        with self.client.session_transaction() as session:
+            session[routing.PRIMARY_UNTIL_KEY] = time() - 1
+        self.assertTrue(self.read_from_replica())
+
+    def test_lagging_replica(self):
+        with mock.patch.object(routing.ReplicaMonitor, "lag",
+                               return_value=60.0):
+            self.assertFalse(self.read_from_replica())
+
+        # Until the next check, the last measurement stands
+        self.assertFalse(self.read_from_replica())
+
+        routing.get_monitor().status.clear()
+        self.assertTrue(self.read_from_replica())
+
+    def test_replica_down(self):
+        db.engines.pop("replica_1")
+        self.add_replica("postgresql:///warbler_no_such_database")
+
+        self.assertFalse(self.read_from_replica())
+        self.assertEqual(routing.stats(db.engines), {
+            "replica_1": {"lag_seconds": None, "usable": False}})
+
+    def test_skips_unusable_replicas(self):
+        self.add_replica("postgresql:///warbler_no_such_database")
+
+        for _ in range(5):
+            self.assertTrue(self.read_from_replica())
+
+    def test_cache_fills_from_primary(self):
+        """A user cached by a GET is the primary's copy, not the lagging
+        replica's."""
+
+        cache.init_app(app)
+        u1 = db.session.get(User, self.u1_id)
+        u1.bio = "fresh"
+        db.session.commit()
+
+        self.assertTrue(self.read_from_replica())
+        db.session.expunge_all()
+        self.client.get(f"/users/{self.u1_id}")
+
+        db.session.expunge_all()
+        self.assertEqual(cache.get_user(self.u1_id).bio, "fresh")
+        self.assertEqual(cache.stats()["hits"], 1)
+    def test_follow_index_catches_up_from_primary(self):
+        """The follow index looks for changes on the primary, which the
+        replica hasn't seen."""
+
+        index = app.extensions["follow_index"] = graph.load_index()
+        db.session.commit()
+        self.addCleanup(app.extensions.pop, "follow_index")
+
+        u2 = User.signup("u2", "u2@email.com", "password", None)
+        db.session.flush()
+        db.session.add_all([
+            Follow(user_following_id=self.u1_id,
+                   user_being_followed_id=u2.id),
+            FollowChange(user_id=self.u1_id),
+        ])
+        db.session.commit()
+
+        app.config['FOLLOW_INDEX_POLL_SECONDS'] = 0
+        self.addCleanup(app.config.__setitem__,
+                        'FOLLOW_INDEX_POLL_SECONDS', 1)
+        self.assertTrue(self.read_from_replica())
+
+        self.assertTrue(index.follows(self.u1_id, u2.id))
@@ -0,0 +1,144 @@
+"""User search tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_search.py
+
+
+import os
+from unittest import TestCase, mock
+
+from models import db, User
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
+
+from app import app, CURR_USER_KEY
+import search
+
+app.config['TESTING'] = True
+
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+db.drop_all()
+db.create_all()
+
+
+class SearchTestCase(TestCase):
+    def setUp(self):
+        db.session.rollback()
+        User.query.delete()
+
+        # Signed up in this order, so later ones have higher ids
+        for username, bio, location in [
+            ("alice", "", ""),
+            ("alicebob", "", ""),
+            ("alice_2", "", ""),
+            ("bobalice", "", ""),
+            ("carol", "Alice's biggest fan", ""),
+            ("dave", "", "Alice Springs"),
+            ("erin", "nothing to see", "nowhere"),
+        ]:
+            user = User.signup(username, f"{username}@email.com", "password",
+                               None)
+            user.bio = bio
+            user.location = location
+            db.session.commit()
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+        db.session.rollback()
+        app.config['PAGE_SIZE'] = 50
+
+    def usernames(self, page):
+        return [user.username for user in page.items]
+
+    def test_ranking(self):
+        """Exact, then prefix, then substring, then bio/location matches."""
+
+        page = search.search_users("Alice")
+
+        self.assertEqual(
+            self.usernames(page),
+            ["alice", "alice_2", "alicebob", "bobalice", "dave", "carol"])
+        self.assertIsNone(page.next_cursor)
+
+    def test_substring_scan_limit(self):
+        """Without the trigram index, substring matches are only looked
+        for among the newest users."""
+
+        if search.has_trigram_index():
+            self.skipTest("pg_trgm is installed")
+
+        with mock.patch.object(search, "SUBSTRING_SCAN_LIMIT", 2):
+            usernames = self.usernames(search.search_users("alice"))
+
+        self.assertNotIn("bobalice", usernames)
+        self.assertIn("dave", usernames)
+
+    def test_like_wildcards(self):
+        """% and _ in a search match themselves."""
+
+        usernames = self.usernames(search.search_users("alice_"))
+        self.assertEqual(usernames[0], "alice_2")
+        self.assertNotIn("alicebob", usernames)
+        self.assertEqual(self.usernames(search.search_users("%")), [])
+
+    def test_no_search(self):
+        """No search lists everyone, newest first."""
+
+        page = search.search_users("", per_page=2)
+        self.assertEqual(self.usernames(page), ["erin", "dave"])
+        self.assertIsNotNone(page.next_cursor)
+
+    def test_pages(self):
+        """Pages walk forward and back across tiers."""
+
+        first = search.search_users("alice", per_page=2)
+        self.assertEqual(self.usernames(first), ["alice", "alice_2"])
+        self.assertIsNone(first.prev_cursor)
+
+        second = search.search_users("alice", before=first.next_cursor,
+                                     per_page=2)
+        self.assertEqual(self.usernames(second)[0], "alicebob")
+
+        back = search.search_users("alice", after=second.prev_cursor,
+                                   per_page=2)
+        self.assertEqual(self.usernames(back), ["alice", "alice_2"])
+        self.assertIsNone(back.prev_cursor)
+
+    def test_indexes_used(self):
+        """Prefix and bio/location tiers can use their indexes."""
+
+        def plan(where):
+            sql = (db.select(User.id).where(where)
+                   .compile(db.engine,
+                            compile_kwargs={"literal_binds": True}))
+            return "\n".join(db.session.scalars(db.text(f"EXPLAIN {sql}")))
+
+        # The test table is tiny, so make seq scans look as costly as they
+        # are on a real users table.
+        db.session.execute(db.text("SET LOCAL enable_seqscan = off"))
+        tiers = dict(search._tiers("ali"))
+
+        self.assertIn("ix_users_username_prefix", plan(tiers[2]))
+        self.assertIn("ix_users_profile_search", plan(tiers[0]))
+
+    def test_list_users_view(self):
+        """The search page shows matches and keeps q on its pager links."""
+
+        app.config['PAGE_SIZE'] = 1
+
+        with self.client.session_transaction() as session:
+            session[CURR_USER_KEY] = User.query.filter_by(
+                username="erin").one().id
+
+        resp = self.client.get("/users?q=alice")
+        html = resp.get_data(as_text=True)
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn("@alice<", html)
+        self.assertNotIn("@alicebob", html)
+        self.assertIn("q=alice", html)
@@ -0,0 +1,154 @@
+"""Seed loader tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_seed.py
+
+
+import csv
+import os
+import tempfile
+from unittest import TestCase
+
+from models import db, User, Message, Follow, Like, TimelineEntry
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
+
+from app import app
+from seed import seed
+
+app.config['TESTING'] = True
+
+db.drop_all()
+db.create_all()
+
+USERS_HEADERS = ['email', 'username', 'image_url', 'password', 'bio',
+                 'header_image_url', 'location']
+
+
+def write_csv(directory, name, headers, rows):
+    with open(os.path.join(directory, f'{name}.csv'), 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(headers)
+        writer.writerows(rows)
+
+
+class SeedTestCase(TestCase):
+    def setUp(self):
+        # drop_all() waits on locks held by any open transaction
+        db.session.rollback()
+
+        self.dir = tempfile.TemporaryDirectory()
+
+        write_csv(self.dir.name, 'users', USERS_HEADERS,
+                  [(f"u{i}@email.com", f"u{i}", "", "HASHED", "", "", "")
+                   for i in range(1, 4)])
+        write_csv(self.dir.name, 'messages',
+                  ['text', 'timestamp', 'user_id'],
+                  [(f"msg {i}", f"2023-01-0{i} 00:00:00", i)
+                   for i in range(1, 4)])
+        # u1 follows u2 and u3
+        write_csv(self.dir.name, 'follows',
+                  ['user_being_followed_id', 'user_following_id'],
+                  [(2, 1), (3, 1)])
+        write_csv(self.dir.name, 'likes',
+                  ['user_id', 'message_id'],
+                  [(1, 2), (1, 3), (2, 3)])
+
+    def tearDown(self):
+        db.session.rollback()
+        self.dir.cleanup()
+
+    def check_loaded(self):
+        self.assertEqual(User.query.count(), 3)
+        self.assertEqual(Message.query.count(), 3)
+        self.assertEqual(Follow.query.count(), 2)
+        self.assertEqual(Like.query.count(), 3)
+
+        u1 = db.session.get(User, 1)
+        self.assertEqual(u1.following_count, 2)
+        self.assertEqual(u1.likes_count, 2)
+        self.assertEqual(db.session.get(User, 3).followers_count, 1)
+
+        # u1's own message plus one each from u2 and u3
+        self.assertEqual(
+            TimelineEntry.query.filter_by(user_id=1).count(), 3)
+
+    def test_seed(self):
+        stats = seed(self.dir.name)
+
+        self.assertEqual(stats['users'][0], 3)
+        self.check_loaded()
+
+    def test_seed_copy(self):
+        stats = seed(self.dir.name, copy=True)
+
+        self.assertEqual(stats['users'][0], 3)
+        self.assertEqual(stats['likes'][0], 3)
+        self.check_loaded()
+
+        # Constraints and indexes are back
+        inspector = db.inspect(db.engine)
+        self.assertEqual(len(inspector.get_foreign_keys('follows')), 2)
+        self.assertIn(
+            'ix_timeline_entries_user_timestamp',
+            [index['name'] for index in inspector.get_indexes(
+                'timeline_entries')])
+
+        # ...and the id sequence carries on after the loaded rows
+        user = User.signup("u4", "u4@email.com", "password", None)
+        db.session.commit()
+        self.assertEqual(user.id, 4)
+
+    def append(self, copy):
+        seed(self.dir.name, copy=copy)
+
+        # A feed entry that a full rebuild would put back
+        TimelineEntry.query.filter_by(user_id=1, message_id=1).delete()
+        db.session.commit()
+
+        write_csv(self.dir.name, 'users', USERS_HEADERS,
+                  [("u4@email.com", "u4", "", "HASHED", "", "", "")])
+        # u4 posts, and follows u2; u2 follows u4 and likes u4's message
+        write_csv(self.dir.name, 'messages',
+                  ['text', 'timestamp', 'user_id'],
+                  [("msg 4", "2023-01-04 00:00:00", 4)])
+        write_csv(self.dir.name, 'follows',
+                  ['user_being_followed_id', 'user_following_id'],
+                  [(2, 4), (4, 2)])
+        write_csv(self.dir.name, 'likes',
+                  ['user_id', 'message_id'],
+                  [(2, 4)])
+
+        stats = seed(self.dir.name, copy=copy, append=True)
+
+        self.assertEqual(stats['users'][0], 1)
+        self.assertEqual(stats['follows'][0], 2)
+        self.assertEqual(Message.query.count(), 4)
+        self.assertEqual(Follow.query.count(), 4)
+        self.assertEqual(Like.query.count(), 4)
+
+        u2 = db.session.get(User, 2)
+        u4 = db.session.get(User, 4)
+        self.assertEqual(
+            (u2.followers_count, u2.following_count, u2.likes_count),
+            (2, 1, 2))
+        self.assertEqual(
+            (u4.messages_count, u4.followers_count, u4.following_count),
+            (1, 1, 1))
+
+        def feed(user_id):
+            return {entry.message_id for entry in
+                    TimelineEntry.query.filter_by(user_id=user_id)}
+
+        # u4 gets their own message and a backfill of u2's; u2 gets u4's
+        self.assertEqual(feed(4), {2, 4})
+        self.assertEqual(feed(2), {2, 4})
+        # ...and other feeds are left alone
+        self.assertEqual(feed(1), {2, 3})
+
+    def test_seed_append(self):
+        self.append(copy=False)
+
+    def test_seed_copy_append(self):
+        self.append(copy=True)
@@ -0,0 +1,180 @@
+"""Home timeline tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_timeline.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, User, Message, Follow, TimelineEntry
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+import timeline
+
+app.config['TESTING'] = True
+
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+db.drop_all()
+db.create_all()
+
+
+class TimelineTestCase(TestCase):
+    def setUp(self):
+        User.query.delete()
+
+        u1 = User.signup("u1", "u1@email.com", "password", None)
+        u2 = User.signup("u2", "u2@email.com", "password", None)
+        db.session.flush()
+
+        # u1 follows u2
+        db.session.add(Follow(user_being_followed_id=u2.id,
+                              user_following_id=u1.id))
+        u1.following_count = 1
+        u2.followers_count = 1
+        db.session.commit()
+
+        self.u1_id = u1.id
+        self.u2_id = u2.id
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+        db.session.rollback()
+        app.config['TIMELINE_FANOUT_LIMIT'] = 10000
+
+    def post_as(self, user_id, text):
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = user_id
+
+            c.post("/messages/new", data={"text": text})
+
+        return Message.query.filter_by(text=text).one()
+
+    def timeline_ids(self, user_id):
+        return [entry.message_id for entry in
+                TimelineEntry.query.filter_by(user_id=user_id)]
+
+    def test_fan_out_on_post(self):
+        """Posting delivers the message to the author and their followers."""
+
+        msg = self.post_as(self.u2_id, "hello followers")
+
+        self.assertEqual(self.timeline_ids(self.u2_id), [msg.id])
+        self.assertEqual(self.timeline_ids(self.u1_id), [msg.id])
+
+    def test_unfollow_removes_entries(self):
+        """Unfollowing removes that author's messages from the feed."""
+
+        self.post_as(self.u2_id, "soon gone")
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u1_id
+
+            c.post(f"/users/stop-following/{self.u2_id}")
+
+        self.assertEqual(self.timeline_ids(self.u1_id), [])
+
+    def test_follow_backfills(self):
+        """Following copies the followed user's recent messages."""
+
+        msg = self.post_as(self.u1_id, "from u1")
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u2_id
+
+            c.post(f"/users/follow/{self.u1_id}")
+
+        self.assertIn(msg.id, self.timeline_ids(self.u2_id))
+
+    def test_fan_out_on_read(self):
+        """Authors over the fan-out limit are merged into feeds on read."""
+
+        app.config['TIMELINE_FANOUT_LIMIT'] = 1
+
+        msg = self.post_as(self.u2_id, "too popular")
+
+        self.assertTrue(User.query.get(self.u2_id).fanout_on_read)
+        self.assertEqual(self.timeline_ids(self.u1_id), [])
+
+        u1 = User.query.get(self.u1_id)
+        self.assertEqual(timeline.get_timeline(u1).items, [msg])
+
+    def test_read_merged_authors_plan(self):
+        """Merged authors are found from the flagged users, not the follows."""
+
+        query = timeline.read_merged_authors(self.u1_id)
+        sql = query.compile(db.engine, compile_kwargs={"literal_binds": True})
+
+        # The test tables are tiny, so make seq scans look as costly as
+        # they are on a real users table.
+        db.session.execute(db.text("SET LOCAL enable_seqscan = off"))
+        plan = "\n".join(db.session.scalars(db.text(f"EXPLAIN {sql}")))
+
+        self.assertIn("ix_users_fanout_on_read", plan)
+        self.assertNotIn("Seq Scan on follows", plan)
+
+    def test_unfollow_self_keeps_own_entries(self):
+        """Unfollowing yourself doesn't empty your own feed."""
+
+        msg = self.post_as(self.u1_id, "mine")
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u1_id
+
+            c.post(f"/users/follow/{self.u1_id}")
+            c.post(f"/users/stop-following/{self.u1_id}")
+
+        self.assertEqual(self.timeline_ids(self.u1_id), [msg.id])
+        self.assertEqual(User.query.get(self.u1_id).following_count, 1)
+
+    def test_timeline_pages(self):
+        """Feed pages walk back and forward through stored and merged rows."""
+
+        app.config['TIMELINE_FANOUT_LIMIT'] = 1
+        older = self.post_as(self.u2_id, "merged on read")
+        newer = self.post_as(self.u1_id, "stored entry")
+        u1 = User.query.get(self.u1_id)
+
+        first = timeline.get_timeline(u1, per_page=1)
+        self.assertEqual(first.items, [newer])
+        self.assertIsNone(first.prev_cursor)
+
+        second = timeline.get_timeline(u1, before=first.next_cursor,
+                                       per_page=1)
+        self.assertEqual(second.items, [older])
+        self.assertIsNone(second.next_cursor)
+
+        back = timeline.get_timeline(u1, after=second.prev_cursor,
+                                     per_page=1)
+        self.assertEqual(back.items, [newer])
+
+    def test_rebuild_timelines(self):
+        """Rebuilding materializes feeds from the base tables."""
+
+        msg = Message(text="bulk loaded", user_id=self.u2_id)
+        db.session.add(msg)
+        db.session.commit()
+
+        timeline.rebuild_timelines()
+        db.session.commit()
+
+        self.assertEqual(self.timeline_ids(self.u1_id), [msg.id])
+        self.assertEqual(self.timeline_ids(self.u2_id), [msg.id])
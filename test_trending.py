@@ -0,0 +1,167 @@
+"""Trending messages tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_trending.py
+
+
+import os
+from datetime import datetime, timedelta
+from unittest import TestCase
+
+from models import db, User, Message, Like, LikeBucket, TrendingMessage
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
+
+from app import app, CURR_USER_KEY
+import deletions
+import trending
+
+app.config['TESTING'] = True
+
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+db.drop_all()
+db.create_all()
+
+NOW = datetime(2024, 5, 1, 12, 0)
+
+
+class TrendingTestCase(TestCase):
+    def setUp(self):
+        db.session.rollback()
+        User.query.delete()
+
+        u1 = User.signup("u1", "u1@email.com", "password", None)
+        u2 = User.signup("u2", "u2@email.com", "password", None)
+        db.session.flush()
+        messages = [Message(text=f"m{i}", user_id=u2.id) for i in range(3)]
+        db.session.add_all(messages)
+        db.session.commit()
+
+        self.u1_id = u1.id
+        self.message_ids = [msg.id for msg in messages]
+
+        self.client = app.test_client()
+        with self.client.session_transaction() as session:
+            session[CURR_USER_KEY] = self.u1_id
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def add_likes(self, message_id, count, age):
+        trending.count_likes({message_id: count}, now=NOW - age)
+        db.session.commit()
+
+    def ranked(self, window):
+        return db.session.scalars(
+            db.select(TrendingMessage.message_id)
+            .where(TrendingMessage.window == window)
+            .order_by(TrendingMessage.rank)).all()
+
+    def test_like_routes_count(self):
+        m0 = self.message_ids[0]
+
+        self.client.post(f"/like/{m0}")
+        self.assertEqual(
+            db.session.scalar(db.select(db.func.sum(LikeBucket.count))), 1)
+
+        # Unlikes aren't counted
+        self.client.post(f"/unlike/{m0}")
+        self.assertEqual(
+            db.session.scalar(db.select(db.func.sum(LikeBucket.count))), 1)
+
+    def test_buckets(self):
+        app.config['TRENDING_BUCKET_MINUTES'] = 15
+        self.addCleanup(app.config.__setitem__, 'TRENDING_BUCKET_MINUTES', 5)
+
+        self.assertEqual(
+            trending.bucket_start(datetime(2024, 5, 1, 9, 44, 7)),
+            datetime(2024, 5, 1, 9, 30))
+
+    def test_refresh(self):
+        m0, m1, m2 = self.message_ids
+        # m0: a few likes just now; m1: more, but hours ago; m2: days ago
+        self.add_likes(m0, 3, timedelta(minutes=5))
+        self.add_likes(m1, 2, timedelta(hours=12))
+        self.add_likes(m1, 20, timedelta(hours=12))
+        self.add_likes(m2, 80, timedelta(days=3))
+        self.add_likes(m2, 1, timedelta(days=30))
+
+        trending.refresh(size=10, now=NOW)
+        db.session.commit()
+
+        self.assertEqual(self.ranked("1h"), [m0])
+        self.assertEqual(self.ranked("24h"), [m1, m0])
+        self.assertEqual(self.ranked("7d"), [m2, m1, m0])
+        # The month-old bucket is beyond every window
+        self.assertEqual(LikeBucket.query.count(), 3)
+
+        # Decayed: in the 24h window, m1's likes are two half-lives old
+        scores = dict(db.session.execute(
+            db.select(TrendingMessage.message_id, TrendingMessage.score)
+            .where(TrendingMessage.window == "24h")).all())
+        self.assertAlmostEqual(scores[m1], 22 / 4)
+
+        trending.refresh(size=1, now=NOW)
+        db.session.commit()
+        self.assertEqual(self.ranked("7d"), [m2])
+
+    def test_unliked(self):
+        """Unliking a like counted hours ago doesn't take a like off the
+        message's last hour."""
+
+        m0 = self.message_ids[0]
+        now = datetime.utcnow()
+        db.session.add(Like(user_id=self.u1_id, message_id=m0))
+        trending.count_likes({m0: 1}, now=now - timedelta(hours=3))
+        trending.count_likes({m0: 1}, now=now)
+        db.session.commit()
+
+        self.client.post(f"/unlike/{m0}")
+        trending.refresh(size=10, now=now)
+        db.session.commit()
+
+        self.assertEqual(self.ranked("1h"), [m0])
+
+    def test_pages(self):
+        m0, m1, _ = self.message_ids
+        self.add_likes(m0, 1, timedelta(0))
+        self.add_likes(m1, 2, timedelta(0))
+        trending.refresh(size=10, now=NOW)
+        db.session.commit()
+
+        html = self.client.get("/trending?window=1h").get_data(as_text=True)
+        self.assertLess(html.index("m1"), html.index("m0"))
+        self.assertNotIn("m2", html)
+        self.assertEqual(
+            self.client.get("/trending?window=2h").status_code, 404)
+
+        resp = self.client.get("/api/v1/trending?window=1h&fields=id")
+        self.assertEqual(resp.json["data"], [{"id": m1}, {"id": m0}])
+
+    def test_author_disabled(self):
+        m0 = self.message_ids[0]
+        self.add_likes(m0, 1, timedelta(0))
+        trending.refresh(size=10, now=NOW)
+        deletions.disable(db.session.get(Message, m0).user_id)
+        db.session.commit()
+
+        html = self.client.get("/trending?window=1h").get_data(as_text=True)
+        self.assertNotIn("m0", html)
+        resp = self.client.get("/api/v1/trending?window=1h&fields=id")
+        self.assertEqual(resp.json["data"], [])
+
+    def test_message_deleted(self):
+        m0 = self.message_ids[0]
+        self.add_likes(m0, 1, timedelta(0))
+        trending.refresh(size=10, now=NOW)
+        db.session.commit()
+
+        db.session.delete(db.session.get(Message, m0))
+        db.session.commit()
+
+        self.assertEqual(self.ranked("1h"), [])
+        self.assertEqual(LikeBucket.query.count(), 0)
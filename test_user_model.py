@@ -11,6 +11,7 @@ from sqlalchemy.exc import IntegrityError, DatabaseError
 from psycopg2.errors import UniqueViolation
 
 from models import db, User, Message, Follow
+from querystats import count_queries
 
 # BEFORE we import our app, let's set an environmental variable
 # to use a different database for tests (we need to do this
@@ -79,6 +80,31 @@ class UserModelTestCase(TestCase):
         self.assertEqual(u1.is_following(u2), False)
         self.assertEqual(u2.is_following(u1), True)
 
+    def test_following_ids(self):
+        """Tests batched follow checks, and that they're remembered"""
+
+        u1 = User.query.get(self.u1_id)
+        u2 = User.query.get(self.u2_id)
+        u3 = User.signup("u3", "u3@email.com", "password", None)
+        u1.following.append(u2)
+        u3.following.append(u1)
+        db.session.commit()
+        u3_id = u3.id
+        u1 = User.query.get(self.u1_id)
+        u2 = User.query.get(self.u2_id)
+
+        with count_queries() as stats:
+            self.assertEqual(u1.following_ids([u2, u3_id]), {self.u2_id})
+            self.assertTrue(u1.is_following(u2))
+            self.assertFalse(u1.is_following(u3_id))
+        self.assertEqual(stats.count, 1)
+
+        self.assertEqual(u1.followed_by_ids([u2, u3_id]), {u3_id})
+
+        # A change to the follows is seen
+        u1.following.remove(u2)
+        self.assertFalse(u1.is_following(u2))
+
     def test_valid_user_signup(self):
         """Tests signup function correctly handles new users.
         """
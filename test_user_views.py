@@ -1,4 +1,5 @@
 """User view function tests"""
+import json
 import os
 from dotenv import load_dotenv
 from flask import Flask, render_template, request, flash, redirect, session, g
@@ -8,6 +9,9 @@ from sqlalchemy.exc import IntegrityError, DatabaseError
 
 from models import db, User, Message, Follow
 from forms import CSRFForm
+import counters
+import timeline
+from querystats import QueryBudgetMixin
 
 
 
@@ -42,7 +46,7 @@ CURR_USER_KEY = "curr_user"
 db.drop_all()
 db.create_all()
 
-class UserViewTestCase(TestCase):
+class UserViewTestCase(TestCase, QueryBudgetMixin):
     """Test case for the user-related view functions."""
     def setUp(self):
         User.query.delete()
@@ -96,7 +100,8 @@ class UserViewTestCase(TestCase):
 
         with self.client as c:
             resp = c.get("/")
-            self.assertEqual(g.user, u1)
+            self.assertEqual(g.user.id, u1.id)
+            self.assertEqual(g.user.get(), u1)
 
     def test_csrf_from_in_g(self):
         """Tests csrf form is added to g"""
@@ -105,6 +110,46 @@ class UserViewTestCase(TestCase):
             resp = c.get("/")
             self.assertIsInstance(g.csrf_form, CSRFForm)
 
+    def test_current_user_lazy(self):
+        """Test pages that only need the session's claims don't load the
+        user, and anonymous pages don't touch the session."""
+
+        with self.client as c:
+            resp = c.post("/login", data={"username": "u1",
+                                          "password": "password"})
+            self.assertEqual(resp.status_code, 302)
+
+            db.session.expunge_all()
+            with self.assertMaxQueries(0):
+                resp = c.get("/messages/new")
+            self.assertIn('alt="u1"', resp.get_data(as_text=True))
+            self.assertFalse(g.user.loaded)
+
+        resp = app.test_client().get("/")
+        self.assertNotIn("Set-Cookie", resp.headers)
+
+    def test_profile_edit_updates_claims(self):
+        """Test editing a profile bumps its version and the nav bar's copy."""
+
+        with self.client as c:
+            c.post("/login", data={"username": "u1", "password": "password"})
+            c.post("/users/profile", data={
+                "username": "u1-renamed",
+                "email": "u1@email.com",
+                "image_url": "",
+                "header_image_url": "",
+                "bio": "",
+                "location": "",
+                "password": "password",
+            })
+
+            with c.session_transaction() as session:
+                claims = session["curr_user_claims"]
+
+        self.assertEqual(claims["username"], "u1-renamed")
+        self.assertEqual(claims["profile_version"], 2)
+        self.assertEqual(User.query.get(self.u1_id).profile_version, 2)
+
     # def test_do_login(user="random_id"):
     #     """Test the do_login helper function."""
     #     with self.client.session_transaction() as session:
@@ -259,6 +304,156 @@ class UserViewTestCase(TestCase):
             self.assertEqual(resp.status_code, 200)
             self.assertIn("u1", html)
 
+    def test_show_user_paginates(self):
+        """Test a profile shows one page of messages with an older link."""
+
+        app.config['PAGE_SIZE'] = 1
+        u1 = User.query.get(self.u1_id)
+        u1.messages.append(Message(text="test text 4"))
+        db.session.commit()
+
+        with self.client.session_transaction() as session:
+            session[CURR_USER_KEY] = self.u1_id
+
+        try:
+            with self.client as c:
+                resp = c.get(f"/users/{self.u1_id}")
+                html = resp.get_data(as_text=True)
+                self.assertEqual(resp.status_code, 200)
+                self.assertIn("test text 4", html)
+                self.assertNotIn("test text 1", html)
+                self.assertIn("Older", html)
+
+                cursor = html.split("?before=")[1].split('"')[0]
+                resp = c.get(f"/users/{self.u1_id}?before={cursor}")
+                html = resp.get_data(as_text=True)
+                self.assertIn("test text 1", html)
+                self.assertNotIn("test text 4", html)
+                self.assertIn("Newer", html)
+        finally:
+            app.config['PAGE_SIZE'] = 50
+
+    def test_show_user_bad_cursor(self):
+        """Test a malformed page cursor is rejected."""
+
+        with self.client.session_transaction() as session:
+            session[CURR_USER_KEY] = self.u1_id
+
+        with self.client as c:
+            resp = c.get(f"/users/{self.u1_id}?before=not-a-cursor")
+            self.assertEqual(resp.status_code, 400)
+
+    def test_follow_updates_counters(self):
+        """Test following and unfollowing adjust both users' counters."""
+
+        with self.client.session_transaction() as session:
+            session[CURR_USER_KEY] = self.u1_id
+
+        with self.client as c:
+            c.post(f"/users/follow/{self.u2_id}")
+            self.assertEqual(User.query.get(self.u1_id).following_count, 1)
+            self.assertEqual(User.query.get(self.u2_id).followers_count, 1)
+
+            c.post(f"/users/stop-following/{self.u2_id}")
+            self.assertEqual(User.query.get(self.u1_id).following_count, 0)
+            self.assertEqual(User.query.get(self.u2_id).followers_count, 0)
+
+    def test_reconcile_counters(self):
+        """Test counters are rebuilt from the base tables."""
+
+        counters.reconcile()
+        db.session.commit()
+
+        u1 = User.query.get(self.u1_id)
+        self.assertEqual(u1.messages_count, 1)
+        self.assertEqual(u1.likes_count, 1)
+        self.assertEqual(u1.followers_count, 0)
+
+    def test_homepage_query_budget(self):
+        """Test the home feed's query count doesn't grow with its size."""
+
+        u1 = User.query.get(self.u1_id)
+        for user_id in (self.u2_id, self.u3_id):
+            u1.following.append(User.query.get(user_id))
+        for n in range(10):
+            db.session.add(Message(text=f"feed {n}", user_id=self.u2_id))
+            db.session.add(Message(text=f"feed {n}", user_id=self.u3_id))
+        db.session.commit()
+        timeline.rebuild_timelines()
+        db.session.commit()
+
+        with self.client.session_transaction() as session:
+            session[CURR_USER_KEY] = self.u1_id
+
+        # One more than a profile page: the who-to-follow sidebar
+        with self.client as c:
+            with self.assertMaxQueries(6):
+                resp = c.get("/")
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("Server-Timing", resp.headers)
+
+    def test_show_user_query_budget(self):
+        """Test a profile page stays within its query budget."""
+
+        for n in range(10):
+            db.session.add(Message(text=f"profile {n}", user_id=self.u2_id))
+        db.session.commit()
+
+        with self.client.session_transaction() as session:
+            session[CURR_USER_KEY] = self.u1_id
+
+        with self.client as c:
+            with self.assertMaxQueries(5):
+                resp = c.get(f"/users/{self.u2_id}")
+            self.assertEqual(resp.status_code, 200)
+
+    def test_request_query_log(self):
+        """Test each request logs its query stats as one JSON line."""
+
+        with self.client.session_transaction() as session:
+            session[CURR_USER_KEY] = self.u1_id
+
+        with self.assertLogs("warbler.querystats", "INFO") as logs:
+            self.client.get(f"/users/{self.u2_id}")
+
+        line = json.loads(logs.records[-1].getMessage())
+        self.assertEqual(line["endpoint"], "show_user")
+        self.assertGreater(line["queries"], 0)
+
+    def test_list_users_query_budget(self):
+        """Test follow buttons on the users page take one query, not one
+        per card."""
+
+        for n in range(10):
+            User.signup(f"extra{n}", f"extra{n}@email.com", "password", None)
+        u1 = User.query.get(self.u1_id)
+        u1.following.append(User.query.get(self.u2_id))
+        db.session.commit()
+
+        with self.client.session_transaction() as session:
+            session[CURR_USER_KEY] = self.u1_id
+
+        with self.client as c:
+            with self.assertMaxQueries(3):
+                resp = c.get("/users")
+            html = resp.get_data(as_text=True)
+
+        self.assertEqual(html.count("Unfollow"), 1)
+        self.assertIn(f'action="/users/stop-following/{self.u2_id}"', html)
+
+    def test_follow_twice(self):
+        """Test following someone already followed changes nothing."""
+
+        with self.client.session_transaction() as session:
+            session[CURR_USER_KEY] = self.u1_id
+
+        with self.client as c:
+            c.post(f"/users/follow/{self.u2_id}")
+            c.post(f"/users/follow/{self.u2_id}")
+
+        self.assertEqual(Follow.query.count(), 1)
+        self.assertEqual(User.query.get(self.u2_id).followers_count, 1)
+
     def test_start_following(self):
         """Test function for a user to begin following another user."""
 
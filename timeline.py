@@ -0,0 +1,336 @@
+"""Materialized home timelines for Warbler.
+
+Each user's home feed is stored as rows in `timeline_entries`, written when
+a message is posted (fan-out-on-write) and read back as a single indexed
+range scan. Authors with very large follower counts are flagged
+`fanout_on_read`; their messages are not copied to every follower, and are
+instead merged into the feed when it is read.
+"""
+
+from flask import current_app
+from sqlalchemy import func, literal, true
+from sqlalchemy.dialects.postgresql import insert
+
+from models import db, User, Message, Follow, TimelineEntry
+import followindex
+from pagination import (decode_cursor, keyset_query, make_page,
+                        windowed_keyset_query)
+
+
+def _config(key):
+    """Get a timeline setting from the app config."""
+
+    return current_app.config[key]
+
+
+def fan_out_message(msg):
+    """Deliver a newly posted message to its author's and followers' feeds.
+
+    The message must already be flushed so it has an id and timestamp.
+    Authors at or above TIMELINE_FANOUT_LIMIT followers are switched to
+    fan-out-on-read, and only their own timeline gets the entry.
+    """
+
+    author = db.session.get(User, msg.user_id)
+
+    if (not author.fanout_on_read and
+            author.followers_count >= _config('TIMELINE_FANOUT_LIMIT')):
+        # Sticky: once an author's messages are read-merged, switching back
+        # would hide every message posted while the flag was set.
+        author.fanout_on_read = True
+
+    db.session.add(TimelineEntry(
+        user_id=msg.user_id,
+        message_id=msg.id,
+        author_id=msg.user_id,
+        timestamp=msg.timestamp,
+    ))
+
+    if not author.fanout_on_read:
+        followers = (db
+                     .select(
+                         Follow.user_following_id,
+                         literal(msg.id),
+                         literal(msg.user_id),
+                         literal(msg.timestamp),
+                     )
+                     .where(Follow.user_being_followed_id == msg.user_id)
+                     .where(Follow.user_following_id != msg.user_id))
+
+        db.session.execute(
+            db.insert(TimelineEntry).from_select(
+                ["user_id", "message_id", "author_id", "timestamp"],
+                followers,
+            )
+        )
+
+
+def backfill_follow(user_id, followed_user):
+    """Copy recent messages from `followed_user` into this user's feed.
+
+    Copies at most TIMELINE_BACKFILL messages. Nothing is copied for
+    fan-out-on-read authors, whose messages are merged when read.
+    """
+
+    if followed_user.fanout_on_read or followed_user.id == user_id:
+        return
+
+    recent = (db
+              .select(
+                  literal(user_id),
+                  Message.id,
+                  Message.user_id,
+                  Message.timestamp,
+              )
+              .where(Message.user_id == followed_user.id)
+              .order_by(Message.timestamp.desc(), Message.id.desc())
+              .limit(_config('TIMELINE_BACKFILL')))
+
+    db.session.execute(
+        db.insert(TimelineEntry).from_select(
+            ["user_id", "message_id", "author_id", "timestamp"],
+            recent,
+        )
+    )
+
+
+def remove_follow(user_id, followed_user_id):
+    """Remove an unfollowed user's messages from this user's feed."""
+
+    # A user's own messages stay, whatever their follows say.
+    if followed_user_id == user_id:
+        return
+
+    db.session.execute(
+        db.delete(TimelineEntry)
+        .where(TimelineEntry.user_id == user_id)
+        .where(TimelineEntry.author_id == followed_user_id)
+    )
+
+
+def read_merged_authors(user_id):
+    """A select of the fan-out-on-read authors this user follows.
+
+    Starts from the (few) flagged authors, via ix_users_fanout_on_read,
+    and checks each against the follows primary key, so the cost doesn't
+    grow with how many users the reader follows.
+    """
+
+    return (db
+            .select(User.id)
+            .where(User.fanout_on_read)
+            .where(db.select(Follow)
+                   .where(Follow.user_being_followed_id == User.id)
+                   .where(Follow.user_following_id == user_id)
+                   .exists()))
+
+
+def get_timeline_keys(user, before=None, after=None, per_page=100):
+    """Get one page of this user's home feed as (timestamp, message id)
+    pairs, newest first.
+
+    Reads the materialized entries and merges in messages from any
+    followed fan-out-on-read authors. `before`/`after` are page cursors
+    (see pagination.py).
+    """
+
+    stored_order = (TimelineEntry.timestamp, TimelineEntry.message_id)
+    merged_order = (Message.timestamp, Message.id)
+    before_key = decode_cursor(before, stored_order)
+    after_key = decode_cursor(after, stored_order)
+
+    stored = keyset_query(
+        (db.session
+         .query(*stored_order)
+         .filter(TimelineEntry.user_id == user.id)),
+        stored_order, before_key, after_key, per_page,
+    ).all()
+
+    # Most readers follow no fan-out-on-read authors; the messages query,
+    # which may take a few tries (see windowed_keyset_query), is only
+    # needed by those who do.
+    authors = db.session.scalars(read_merged_authors(user.id)).all()
+    merged = windowed_keyset_query(
+        (db.session
+         .query(*merged_order)
+         .filter(Message.user_id.in_(authors))),
+        merged_order, before_key, after_key, per_page,
+        _config('MESSAGE_WINDOWS'),
+    ) if authors else []
+
+    rows = sorted(
+        {tuple(row) for row in stored + merged},
+        reverse=after_key is None,
+    )
+    return make_page(rows, per_page, lambda row: row, before_key, after_key)
+
+
+def get_timeline(user, before=None, after=None, per_page=100):
+    """Get one page of this user's home feed, newest first.
+
+    See get_timeline_keys(). Returns a Page of messages.
+    """
+
+    page = get_timeline_keys(user, before, after, per_page)
+
+    # Giving the timestamps too lets a partitioned messages table skip
+    # the months the page doesn't reach.
+    ids = [message_id for _, message_id in page.items]
+    by_id = {msg.id: msg for msg in (
+        Message
+        .query
+        .options(db.joinedload(Message.user))
+        .filter(Message.id.in_(ids))
+        .filter(Message.timestamp.in_(
+            {timestamp for timestamp, _ in page.items})))}
+    page.items = [by_id[message_id] for message_id in ids if message_id in by_id]
+
+    return page
+
+
+def feed_version(user_id):
+    """A version of everything on a user's home feed, from one query.
+
+    Made of the activity_version and profile_version of the user and
+    everyone they follow, which change whenever any of them posts,
+    deletes, likes, follows or edits their profile. With FOLLOW_INDEX on,
+    who they follow comes from the follow index (see followindex.py).
+    """
+
+    index = followindex.get_index()
+    followed = (index.following(user_id).tolist() if index is not None
+                else db.select(Follow.user_being_followed_id)
+                .where(Follow.user_following_id == user_id))
+    return tuple(db.session.execute(
+        db.select(func.count(),
+                  func.sum(User.activity_version + User.profile_version))
+        .where((User.id == user_id) | User.id.in_(followed))
+    ).one())
+
+
+def rebuild_timelines():
+    """Rebuild every user's feed from the messages and follows tables.
+
+    Meant for after a bulk load (see seed.py), since bulk inserts skip the
+    per-message fan-out. Run counters.reconcile() first: the fan-out choice
+    is made from followers_count.
+    """
+
+    db.session.execute(
+        db.update(User).values(
+            fanout_on_read=(User.followers_count >=
+                            _config('TIMELINE_FANOUT_LIMIT')))
+        .execution_options(synchronize_session=False)
+    )
+
+    db.session.execute(db.delete(TimelineEntry))
+
+    own = db.select(
+        Message.user_id,
+        Message.id,
+        Message.user_id,
+        Message.timestamp,
+    )
+    db.session.execute(
+        db.insert(TimelineEntry).from_select(
+            ["user_id", "message_id", "author_id", "timestamp"],
+            own,
+        )
+    )
+
+    followed = (db
+                .select(
+                    Follow.user_following_id,
+                    Message.id,
+                    Message.user_id,
+                    Message.timestamp,
+                )
+                .join(Message, Message.user_id == Follow.user_being_followed_id)
+                .join(User, User.id == Message.user_id)
+                .where(Follow.user_following_id != Follow.user_being_followed_id)
+                .where(User.fanout_on_read.is_(False)))
+    db.session.execute(
+        db.insert(TimelineEntry).from_select(
+            ["user_id", "message_id", "author_id", "timestamp"],
+            followed,
+        )
+    )
+
+
+def fan_out_loaded(new_messages, new_follows=None):
+    """Bring feeds up to date after rows are bulk-appended (see seed.py).
+
+    `new_messages` is a filter on Message picking out the appended
+    messages, e.g. `Message.id > last_id`; `new_follows` is a table or
+    subquery of appended (user_being_followed_id, user_following_id) rows.
+    Appended messages are fanned out like fan_out_message() does, and new
+    followers get a backfill like backfill_follow(). Unlike
+    rebuild_timelines(), this leaves everyone else's feed alone. Run
+    counters.reconcile() for the affected users first.
+    """
+
+    columns = ["user_id", "message_id", "author_id", "timestamp"]
+
+    if new_follows is not None:
+        # Only followed users' follower counts changed.
+        db.session.execute(
+            db.update(User)
+            .where(User.id.in_(
+                db.select(new_follows.c.user_being_followed_id)))
+            .where(User.fanout_on_read.is_(False))
+            .where(User.followers_count >= _config('TIMELINE_FANOUT_LIMIT'))
+            .values(fanout_on_read=True)
+            .execution_options(synchronize_session=False)
+        )
+
+    own = (db
+           .select(Message.user_id, Message.id, Message.user_id,
+                   Message.timestamp)
+           .where(new_messages))
+    db.session.execute(db.insert(TimelineEntry).from_select(columns, own))
+
+    followed = (db
+                .select(
+                    Follow.user_following_id,
+                    Message.id,
+                    Message.user_id,
+                    Message.timestamp,
+                )
+                .join(Message, Message.user_id == Follow.user_being_followed_id)
+                .join(User, User.id == Message.user_id)
+                .where(new_messages)
+                .where(Follow.user_following_id != Follow.user_being_followed_id)
+                .where(User.fanout_on_read.is_(False)))
+    db.session.execute(
+        db.insert(TimelineEntry).from_select(columns, followed))
+
+    if new_follows is None:
+        return
+
+    recent = (db
+              .select(Message.id, Message.user_id, Message.timestamp)
+              .where(Message.user_id == new_follows.c.user_being_followed_id)
+              .order_by(Message.timestamp.desc(), Message.id.desc())
+              .limit(_config('TIMELINE_BACKFILL'))
+              .lateral())
+    backfill = (db
+                .select(
+                    new_follows.c.user_following_id,
+                    recent.c.id,
+                    recent.c.user_id,
+                    recent.c.timestamp,
+                )
+                .select_from(new_follows)
+                .join(recent, true())
+                .join(User, User.id == new_follows.c.user_being_followed_id)
+                .where(new_follows.c.user_following_id !=
+                       new_follows.c.user_being_followed_id)
+                .where(User.fanout_on_read.is_(False)))
+
+    # Appended messages from a newly followed user were just delivered
+    # above as well.
+    db.session.execute(
+        insert(TimelineEntry)
+        .from_select(columns, backfill)
+        .on_conflict_do_nothing()
+    )
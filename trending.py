@@ -0,0 +1,111 @@
+"""Trending messages: the most liked lately, worked out ahead of time.
+
+Scoring from the likes table would mean counting every like of every
+message. Instead, likes are counted as they're made (edges.py calls
+`count_likes()`) into `like_buckets`, one row per message per
+TRENDING_BUCKET_MINUTES. Unlikes aren't counted: likes themselves aren't
+timestamped, so there's no telling which bucket the like went in, and
+taking it off the current one would leave that bucket short and push
+scores below zero. An unliked like counts until it ages out of a window.
+
+`refresh()`, run every so often by `flask refresh-trending --forever`,
+scores the messages liked within each of WINDOWS from just the buckets
+in it, with each bucket's count halving every `half_life` of age, and
+stores each window's top TRENDING_SIZE in `trending_messages`. Pages read
+a window's list by its primary key: K rows, however many likes there are.
+Buckets older than the longest window are deleted as it goes.
+"""
+
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import literal
+from sqlalchemy.dialects.postgresql import insert
+
+from models import db, LikeBucket, Message, TrendingMessage, User
+
+# name: (window, half_life)
+WINDOWS = {
+    "1h": (timedelta(hours=1), timedelta(minutes=20)),
+    "24h": (timedelta(days=1), timedelta(hours=6)),
+    "7d": (timedelta(days=7), timedelta(days=2)),
+}
+
+DEFAULT_WINDOW = "24h"
+
+
+def bucket_start(when):
+    """The start of the bucket `when` falls in."""
+
+    minutes = current_app.config["TRENDING_BUCKET_MINUTES"]
+    since_midnight = when.hour * 60 + when.minute
+    return (when.replace(hour=0, minute=0, second=0, microsecond=0) +
+            timedelta(minutes=since_midnight - since_midnight % minutes))
+
+
+def count_likes(deltas, now=None):
+    """Count likes just made: `deltas` maps message ids to likes added.
+    Anything else (an unlike) is ignored."""
+
+    bucket = bucket_start(now or datetime.utcnow())
+    # Always in the same order, so concurrent counts can't deadlock.
+    rows = [{"message_id": message_id, "bucket": bucket, "count": delta}
+            for message_id, delta in sorted(deltas.items()) if delta > 0]
+    if not rows:
+        return
+
+    query = insert(LikeBucket).values(rows)
+    db.session.execute(query.on_conflict_do_update(
+        index_elements=[LikeBucket.message_id, LikeBucket.bucket],
+        set_={"count": LikeBucket.count + query.excluded.count},
+    ))
+
+
+def score(now, half_life):
+    """A message's decayed like count, summed over its buckets."""
+
+    age = db.func.extract("epoch", literal(now) - LikeBucket.bucket)
+    return db.func.sum(LikeBucket.count *
+                       db.func.power(0.5, age / half_life.total_seconds()))
+
+
+def refresh(size, now=None):
+    """Recompute every window's top `size` messages. The caller commits."""
+
+    now = now or datetime.utcnow()
+
+    for name, (window, half_life) in WINDOWS.items():
+        scored = score(now, half_life).label("score")
+        top = db.session.execute(
+            db.select(LikeBucket.message_id, scored)
+            .where(LikeBucket.bucket >= now - window)
+            .group_by(LikeBucket.message_id)
+            .having(scored > 0)
+            .order_by(scored.desc(), LikeBucket.message_id.desc())
+            .limit(size)
+        ).all()
+
+        db.session.execute(
+            db.delete(TrendingMessage).where(TrendingMessage.window == name))
+        if top:
+            db.session.execute(db.insert(TrendingMessage), [
+                {"window": name, "rank": rank, "message_id": message_id,
+                 "score": message_score, "refreshed_at": now}
+                for rank, (message_id, message_score) in enumerate(top)
+            ])
+
+    longest = max(window for window, _ in WINDOWS.values())
+    db.session.execute(
+        db.delete(LikeBucket)
+        .where(LikeBucket.bucket < bucket_start(now - longest)))
+
+
+def trending_query(query, window):
+    """Restrict a query on messages to `window`'s list, in order, leaving
+    out messages by users being deleted (see deletions.py)."""
+
+    return (query
+            .join(TrendingMessage, TrendingMessage.message_id == Message.id)
+            .filter(TrendingMessage.window == window)
+            .filter(Message.user.has(User.disabled_at.is_(None)))
+            .order_by(TrendingMessage.rank))